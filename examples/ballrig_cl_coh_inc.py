@@ -9,16 +9,18 @@ from flystim.trajectory import RectangleTrajectory
 from flystim.screen import Screen
 from flystim.stim_server import launch_stim_server
 from flystim.util import latency_report
+from flystim.experiment import ExperimentRunner, LineReader
+from flystim.trials import TrialStructure
+from flystim.session import SessionWriter
 
 from time import sleep, time, strftime, localtime
 import numpy as np
 import math
 from math import degrees
 import itertools
-import os, subprocess
+import os, sys, subprocess
 import h5py
 import socket
-import select
 
 import matplotlib.pyplot as plt
 
@@ -71,63 +73,52 @@ def dir_to_tri_list(dir):
 def make_tri_list():
     return dir_to_tri_list('w') + dir_to_tri_list('n') + dir_to_tri_list('e')
 
-ft_buffer = ""
-def fictrac_get_data(sock):
-    global ft_buffer
+class FicTracState:
+    def __init__(self, manager, session=None):
+        self.manager = manager
 
-    # if not select.select([sock], [], [])[0]:
-    #     return fictrac_get_data(sock)
-    ready = select.select([sock], [], [])[0]
-    if ready:
-        data = sock.recv(4098)
-    else:
-        return fictrac_get_data(sock)
-
-    # Decode received data
-    ogline = data.decode('UTF-8')
-    line = ft_buffer + ogline
-    endline = line.rfind("\n")
-    if endline == -1: # there is no linebreak
-        startline = line.rfind("FT")
-        if startline != -1: #there is line start
-            line = line[startline:]
-        ft_buffer += line # add (perhaps) trimmed line to buffer
-        logging.warning("No line end: %s", line)
-        return fictrac_get_data(sock)
-    else: # there is a linebreak
-        ft_buffer = line[endline:] # write everything after linebreak to the buffer
-        line = line[:endline]
-        startline = line.rfind("FT")
-        if startline == -1: #there is no line start... this shouldn't happen bc we have a buffer
-            logging.warning("No line start: %s", line)
-            return fictrac_get_data(sock)
-        else: # start line exists as well as a linebreak, so trim to the start
-            line = line[startline:]
-
-    # There is a complete line!
-    toks = line.split(", ")
-
-    if len(toks) != 27:
-        logging.warning("This should not happen: %s", str(len(toks)) + ' ' + line)
-        return fictrac_get_data(sock)
-
-    frame_num = int(toks[FT_FRAME_NUM_IDX+1])
-    heading = float(toks[FT_THETA_IDX+1])
-    ts = float(toks[FT_TIMESTAMP_IDX+1])#
-
-    return (frame_num, heading, ts)#
-
-def handle_fictrac_data(fictrac_sock, manager, theta_rad_0):
-    frame_num, theta_rad_1, ts = fictrac_get_data(fictrac_sock)#
-    theta_rad = theta_rad_1 - theta_rad_0 if theta_rad_0 is not None else 0
-    theta_deg = degrees(theta_rad)
-    manager.set_global_theta_offset(theta_deg)
-    return frame_num, theta_rad_1, ts#
-
-def load_txt(fpath):
-    with open(fpath, 'r') as handler:
-        return np.array([float(line) for line in handler])
+        # samples are appended to the current trial of the session as they arrive
+        self.session = session
+
+        # latest sample
+        self.frame_num = None
+        self.theta_rad = None
+        self.ts = None
+
+        # closed loop: the heading is sent to flystim relative to the first sample of the trial
+        self.closed_loop = False
+        self.frame_num_0 = None
+        self.theta_rad_0 = None
+        self.ts_0 = None
+
+        # FicTrac lines may be split across datagrams
+        self.reader = LineReader(self.handle_line, prefix="FT")
+
+    def start_closed_loop(self):
+        self.theta_rad_0 = None
+        self.closed_loop = True
+
+    def handle_line(self, line):
+        toks = line.split(", ")
 
+        if len(toks) != 27:
+            logging.warning("This should not happen: %s", str(len(toks)) + ' ' + line)
+            return
+
+        self.frame_num = int(toks[FT_FRAME_NUM_IDX+1])
+        self.theta_rad = float(toks[FT_THETA_IDX+1])
+        self.ts = float(toks[FT_TIMESTAMP_IDX+1])
+
+        if self.session is not None:
+            self.session.append('ft_frame', self.frame_num)
+            self.session.append('ft_theta', self.theta_rad)
+            self.session.append('ft_timestamps', self.ts/1e3)
+            self.session.append('ft_square', float(toks[FT_SQURE_IDX+1]))
+
+        if self.closed_loop:
+            if self.theta_rad_0 is None: # i.e. first sample of the trial
+                self.frame_num_0, self.theta_rad_0, self.ts_0 = self.frame_num, self.theta_rad, self.ts
+            self.manager.set_global_theta_offset(degrees(self.theta_rad - self.theta_rad_0))
 
 def main():
     #####################################################
@@ -276,6 +267,16 @@ def main():
     inc_occluder_l_visible = RectangleTrajectory(x=inc_occluder_traj_l, y=90, w=occluder_width, h=occluder_height, color=occluder_color)
     inc_occluder_l_invisible = RectangleTrajectory(x=inc_occluder_traj_l, y=90, w=occluder_width, h=occluder_height, color=background_color)
 
+    # stimuli of each trial type: invisible occluders, coherent or incoherent, to the right or left
+    def trial_stims(bar_traj, occ_traj):
+        return [('MovingPatch', {'trajectory': bar_traj, 'background': background_color, 'hold': True}),
+                ('MovingPatch', {'trajectory': occ_traj, 'background': None, 'hold': True})]
+
+    trials = TrialStructure({'inc_r': trial_stims(inc_bar_r, inc_occluder_r_invisible),
+                             'coh_r': trial_stims(coh_bar_r, coh_occluder_r_invisible),
+                             'inc_l': trial_stims(inc_bar_l, inc_occluder_l_invisible),
+                             'coh_l': trial_stims(coh_bar_l, inc_occluder_l_invisible)})
+
     if save_history:
         params = {'genotype':genotype, 'age':age, \
             'save_path':save_path, 'save_prefix': save_prefix, \
@@ -325,12 +326,20 @@ def main():
     FICTRAC_BIN =    "/home/clandinin/lib/fictrac211/bin/fictrac"
     FICTRAC_CONFIG = "/home/clandinin/lib/fictrac211/config_MC_cl.txt"
 
+    # The session file is written while the experiment runs: FicTrac samples as they arrive, trial attributes, and
+    # links to the display history that each display writes to its own file
+    session = SessionWriter(os.path.join(save_path, save_prefix + '.h5'), attrs=params) if save_history else None
+
     # Start stim server
     manager = launch_stim_server(screen)
     if save_history:
-        manager.set_save_history_params(save_history_flag=save_history, save_path=save_path, fs_frame_rate_estimate=fs_frame_rate, save_duration=stim_duration+iti*2)
+        manager.set_save_history_params(save_history_flag=save_history, save_path=save_path, fs_frame_rate_estimate=fs_frame_rate, save_duration=stim_duration+iti*2,
+                                        save_format='h5')
     manager.set_idle_background(background_color)
 
+    # send the trajectories once, so that each trial only refers to them by name
+    trials.upload(manager)
+
     #####################################################
     # part 3: start the loop
     #####################################################
@@ -342,80 +351,41 @@ def main():
     fictrac_sock.bind((FICTRAC_HOST, FICTRAC_PORT))
     fictrac_sock.setblocking(0)
 
-    if save_history:
-        trial_start_times = []
-        trial_start_ft_frames = []
-        trial_end_times = []
-        trial_end_ft_frames = []
-
-    # Pretend previous trial ended here before trial 0
-    t_iti_start = time()
-    ft_frame_num_00,_,_ = fictrac_get_data(fictrac_sock)
-
-    # Loop through trials
-    for t in range(n_trials):
-        # begin trial
-
-        if trial_structure[t] == "inc_r": # invisible, incoherent_r. 00, 01, 10, 11
-            bar_traj = inc_bar_r
-            occ_traj = inc_occluder_r_invisible
-        elif trial_structure[t] == "coh_r": # invisible, coherent_r. 00, 01, 10, 11
-            bar_traj = coh_bar_r
-            occ_traj = coh_occluder_r_invisible
-        elif trial_structure[t] == "inc_l": # invisible, incoherent_l. 00, 01, 10, 11
-            bar_traj = inc_bar_l
-            occ_traj = inc_occluder_l_invisible
-        elif trial_structure[t] == "coh_l": # invisible, coherent_l. 00, 01, 10, 11
-            bar_traj = coh_bar_l
-            occ_traj = inc_occluder_l_invisible
-
-        while (time() - t_iti_start) < iti/2:
-            _,_,_ = fictrac_get_data(fictrac_sock)
-
-        if save_history:
-            manager.start_saving_history()
+    # FicTrac samples are handled whenever they arrive, while the runner waits for the next event
+    fictrac = FicTracState(manager, session=session)
+    runner = ExperimentRunner()
+    runner.add_socket(fictrac_sock, fictrac.reader.feed)
 
-        while (time() - t_iti_start) < iti:
-            _,_,_ = fictrac_get_data(fictrac_sock)
+    while fictrac.frame_num is None:
+        runner.wait(0.01)
 
+    def start_trial(t):
         print(f"===== Trial {t}; type {trial_structure[t]} ======")
 
         manager.set_global_theta_offset(0)
-        manager.load_stim('MovingPatch', trajectory=bar_traj.to_dict(), background=background_color, hold=True)
-        manager.load_stim('MovingPatch', trajectory=occ_traj.to_dict(), background=None, hold=True)
-        theta_rad_0 = None
-
-        t_start = time()
-        manager.start_stim()
-        while (time() -  t_start) < stim_duration:
-            ft_frame_num, theta_rad, ts = handle_fictrac_data(fictrac_sock, manager, theta_rad_0)
-            if theta_rad_0 is None: # i.e. first trial
-                ft_frame_num_0, theta_rad_0, ts_0 = ft_frame_num, theta_rad, ts
-        manager.stop_stim()
-        t_end = time()
-        t_iti_start = t_end
-        ft_frame_num_end = ft_frame_num + 1
-
-        print(f"===== Trial end (FT dur: {(ts-ts_0)/1000:.{5}}s)======")
-        while (time() - t_iti_start) < iti/2:
-            _,_,_ = fictrac_get_data(fictrac_sock)
-        if save_history:
-            manager.stop_saving_history()
+        trials.load(manager, trial_structure[t])
+        fictrac.start_closed_loop()
+
+    def end_trial(t):
+        fictrac.closed_loop = False
+        print(f"===== Trial end (FT dur: {(fictrac.ts-fictrac.ts_0)/1000:.{5}}s)======")
 
-        # Save things
         if save_history:
-            save_prefix_with_trial = save_prefix+"_t"+f'{t:03}'
-            manager.set_save_prefix(save_prefix_with_trial)
-            manager.save_history()
+            session.end_trial(label=str(trial_structure[t]), start_ft_frame=fictrac.frame_num_0,
+                              end_ft_frame=fictrac.frame_num + 1)
 
-            trial_start_times.append(t_start)
-            trial_start_ft_frames.append(ft_frame_num_0)
-            trial_end_times.append(t_end)
-            trial_end_ft_frames.append(ft_frame_num_end)
+    def history_saved(t, trial_save_prefix):
+        session.link_history(save_path, screen.name, trial_save_prefix)
 
-    # Burn off the second half of last ITI
-    while (time() - t_iti_start) < iti:
-        continue
+    # Loop through trials.  Each trial group of the session holds the FicTrac samples from the start of the trial to
+    # the start of the next one.
+    runner.run_trials(n_trials, stim_duration=stim_duration, iti=iti, start_trial=start_trial, end_trial=end_trial,
+                      manager=manager, save_history=save_history, save_prefix=save_prefix, session=session,
+                      history_saved=history_saved if save_history else None)
+    runner.close()
+
+    if save_history:
+        session.close()
 
     # close fictrac
     fictrac_sock.close()
@@ -436,104 +406,6 @@ def main():
         # Move Fictrac summary
         os.rename(os.path.join(parent_path, save_prefix+".png"), os.path.join(save_path, save_prefix+".png"))
 
-        # Open up fictrac file
-        fictrac_data_fn = fictrac_files[0]
-        ft_data_handler = open(os.path.join(save_path, fictrac_data_fn), 'r')
-
-        # Create h5f file
-        h5f = h5py.File(os.path.join(save_path, save_prefix + '.h5'), 'a')
-        # params
-        for (k,v) in params.items():
-            h5f.attrs[k] = v
-        # trials group
-        trials = h5f.require_group('trials')
-
-        # Process through ft_data_handler until it gets to the frame iti before first trial
-        start_frame_next_trial = trial_start_ft_frames[0]
-        ft_frame_next = []
-        ft_theta_next = []
-        ft_timestamps_next = []
-        ft_square_next = []
-
-        curr_frame = 0
-        while curr_frame < ft_frame_num_00:
-            ft_line = ft_data_handler.readline()
-            ft_toks = ft_line.split(", ")
-            curr_frame = int(ft_toks[0])
-
-        while curr_frame < start_frame_next_trial:
-            ft_line = ft_data_handler.readline()
-            ft_toks = ft_line.split(", ")
-            curr_frame = int(ft_toks[FT_FRAME_NUM_IDX])
-            ft_frame_next.append(curr_frame)
-            ft_theta_next.append(float(ft_toks[FT_THETA_IDX]))
-            ft_timestamps_next.append(float(ft_toks[FT_TIMESTAMP_IDX]))
-            ft_square_next.append(float(ft_toks[FT_SQURE_IDX]))
-
-        # Loop through trials and create trial groups and datasets
-        ft_line = ft_data_handler.readline()
-        for t in range(n_trials):
-            save_prefix_with_trial = save_prefix+"_t"+f'{t:03}'
-            save_dir_prefix = os.path.join(save_path, save_prefix_with_trial)
-
-            fs_square = load_txt(save_dir_prefix+'_fs_square.txt')
-            fs_timestamps = load_txt(save_dir_prefix+'_fs_timestamps.txt')
-            fs_stim_timestamps = load_txt(save_dir_prefix+'_fs_stim_timestamps.txt')
-            fs_theta = load_txt(save_dir_prefix+'_fs_theta.txt')
-
-            ft_frame = ft_frame_next
-            ft_theta = ft_theta_next
-            ft_timestamps = ft_timestamps_next
-            ft_square = ft_square_next
-            ft_frame_next = []
-            ft_theta_next = []
-            ft_timestamps_next = []
-            ft_square_next = []
-
-            if t < n_trials-1:
-                start_frame_next_trial = trial_start_ft_frames[t+1]
-            else: #t == n_trials-1
-                start_frame_next_trial = np.infty
-
-            while ft_line!="" and curr_frame < start_frame_next_trial:
-                ft_toks = ft_line.split(", ")
-                curr_frame = int(ft_toks[FT_FRAME_NUM_IDX])
-                ft_frame.append(curr_frame)
-                ft_theta.append(float(ft_toks[FT_THETA_IDX]))
-                ft_timestamps.append(float(ft_toks[FT_TIMESTAMP_IDX]))
-                ft_square.append(float(ft_toks[FT_SQURE_IDX]))
-                if curr_frame >= trial_end_ft_frames[t]:
-                    ft_frame_next.append(curr_frame)
-                    ft_theta_next.append(float(ft_toks[FT_THETA_IDX]))
-                    ft_timestamps_next.append(float(ft_toks[FT_TIMESTAMP_IDX]))
-                    ft_square_next.append(float(ft_toks[FT_SQURE_IDX]))
-                ft_line = ft_data_handler.readline()
-
-            # trial
-            trial = trials.require_group(f'{t:03}')
-
-            # start time for trial
-            trial.attrs['start_time'] = trial_start_times[t]
-            trial.attrs['start_ft_frame'] = trial_start_ft_frames[t]
-            trial.attrs['end_time'] = trial_end_times[t]
-            trial.attrs['end_ft_frame'] = trial_end_ft_frames[t]
-            trial.create_dataset("fs_square", data=fs_square)
-            trial.create_dataset("fs_timestamps", data=fs_timestamps)
-            trial.create_dataset("fs_stim_timestamps", data=fs_stim_timestamps)
-            trial.create_dataset("fs_theta", data=fs_theta)
-            trial.create_dataset("ft_frame", data=ft_frame)
-            trial.create_dataset("ft_square", data=ft_square)
-            trial.create_dataset("ft_timestamps", data=np.array(ft_timestamps)/1e3)
-            trial.create_dataset("ft_theta", data=ft_theta)
-
-        ft_data_handler.close()
-        h5f.close()
-
-        # Delete flystim txt output files
-        fs_txt_files = [x for x in os.listdir(save_path) if x.startswith(save_prefix) and x.endswith('.txt')]
-        for txt_fn in fs_txt_files:
-            os.remove(os.path.join(save_path, txt_fn))
-
         # Move hdf5 file out to parent path
         os.rename(os.path.join(save_path, save_prefix + '.h5'), os.path.join(parent_path, save_prefix + '.h5'))
 
@@ -2,3 +2,4 @@ from .files import rel_path
 from .util import normalize, rotx, roty, rotz, get_rgba, translate, scale
 from .cave import GenPerspective, CaveSystem
 from .shapes import GlQuad, GlTri, GlVertices, GlCube, GlSphericalRect, GlSphericalCirc, GlCylinder
+from .scene import SceneNode, model_rotx, model_roty, model_rotz, model_scale, model_translate
@@ -0,0 +1,196 @@
+# Asyncio client for the stim server.  Commands are queued without waiting and sent by a background thread, which
+# batches everything that has accumulated since its last send into a single multicall, so that a burst of commands
+# costs one message instead of one round of socket writes each.  Each command returns a future that completes once
+# the command has been handed to the server.  To know when commands are actually on the screen, frame_applied() asks
+# every display for a frame event (see StimEngine.mark_frame), which arrives as a UDP datagram handled by the event
+# loop, so FicTrac ingestion, trial scheduling and logging can share one event loop without busy-waiting, e.g.:
+#
+# client = AsyncStimClient(launch_stim_server(screen))
+# await client.start()
+# client.load_stim('MovingPatch', trajectory=trajectory.to_dict())
+# client.start_stim()
+# frame_times = await client.frame_applied()
+
+import json
+import asyncio
+import threading
+
+from queue import Queue
+
+from flystim.wire import encode
+
+
+class FrameEventProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        try:
+            event = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return
+
+        self.client.handle_frame_event(event)
+
+
+class AsyncStimClient:
+    def __init__(self, manager, n_screens=1, host='127.0.0.1'):
+        """
+        :param manager: client returned by launch_stim_server
+        :param n_screens: number of screens that report frame events.  frame_applied() completes once all of them have
+        reported.
+        :param host: local address that frame events are sent to
+        """
+
+        # save settings
+        self.manager = manager
+        self.n_screens = n_screens
+        self.host = host
+
+        self.loop = None
+        self.transport = None
+
+        # commands waiting to be sent, as (name, args, kwargs, future) tuples
+        self.queue = Queue()
+        self.thread = None
+
+        # frame_applied() calls waiting for frame events, as (future, frame times by screen) indexed by mark
+        self.mark_count = 0
+        self.waiting = {}
+
+    async def start(self):
+        """
+        Starts the sender thread and the listener for frame events.  Must be called from the event loop that will use
+        the client.
+        """
+
+        self.loop = asyncio.get_running_loop()
+
+        self.thread = threading.Thread(target=self.send_loop, daemon=True)
+        self.thread.start()
+
+        # listen for frame events on a free port
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: FrameEventProtocol(self),
+                                                                     local_addr=(self.host, 0))
+        port = self.transport.get_extra_info('sockname')[1]
+
+        await self.call('set_frame_listener', self.host, port)
+
+    async def close(self):
+        """
+        Sends the remaining commands and stops the client.
+        """
+
+        await self.call('set_frame_listener', None)
+
+        self.queue.put(None)
+        await self.loop.run_in_executor(None, self.thread.join)
+
+        self.transport.close()
+
+        for future, _ in self.waiting.values():
+            future.cancel()
+        self.waiting = {}
+
+    def call(self, name, *args, **kwargs):
+        """
+        Queues a call to the stim server without waiting for it to be sent.
+        :return: future that completes when the call has been sent
+        """
+
+        future = self.loop.create_future()
+        self.queue.put((name, args, kwargs, future))
+
+        return future
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def queue_call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+
+        return queue_call
+
+    def frame_applied(self):
+        """
+        Requests a frame event from every screen.  The commands queued before this call are visible on the screen by
+        the time the returned future completes.
+        :return: future whose result is a dictionary with the time of the first frame drawn after the commands, by
+        screen name
+        """
+
+        self.mark_count += 1
+        mark = self.mark_count
+
+        future = self.loop.create_future()
+        self.waiting[mark] = (future, {})
+
+        self.call('mark_frame', mark)
+
+        return future
+
+    def handle_frame_event(self, event):
+        # if several marks arrived before the same frame, only the last one is reported, so an event also covers
+        # every earlier mark
+        for mark in sorted(self.waiting):
+            if mark > event['mark']:
+                break
+
+            future, frame_times = self.waiting[mark]
+            frame_times.setdefault(event['screen'], event['t'])
+
+            if len(frame_times) >= self.n_screens:
+                del self.waiting[mark]
+                if not future.done():
+                    future.set_result(frame_times)
+
+    ###########################################
+    # functions called by the sender thread
+    ###########################################
+
+    def send_loop(self):
+        while True:
+            item = self.queue.get()
+
+            # send everything that is waiting in one batch
+            items = [item]
+            while not self.queue.empty():
+                items.append(self.queue.get())
+
+            requests = [item for item in items if item is not None]
+            if requests:
+                try:
+                    self.send_batch([(name, args, kwargs) for name, args, kwargs, _ in requests])
+                except Exception as error:
+                    for _, _, _, future in requests:
+                        self.loop.call_soon_threadsafe(self.set_future, future, None, error)
+                else:
+                    for _, _, _, future in requests:
+                        self.loop.call_soon_threadsafe(self.set_future, future, None, None)
+
+            if None in items:
+                return
+
+    def send_batch(self, requests):
+        """
+        Sends a list of (name, args, kwargs) calls to the stim server in a single message.  numpy arrays in the
+        arguments are sent in the format of flystim.wire.
+        """
+
+        from flyrpc.multicall import MyMultiCall
+
+        multicall = MyMultiCall(self.manager)
+        for name, args, kwargs in requests:
+            getattr(multicall, name)(*[encode(arg) for arg in args], **encode(kwargs))
+        multicall()
+
+    @staticmethod
+    def set_future(future, result, error):
+        if future.done():
+            return
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
@@ -0,0 +1,190 @@
+# Content-addressed cache of large stimulus assets (e.g., ArbitraryGrid codes or long trajectories).  Each display
+# process keeps recently used assets in an LRU cache with a size budget, keyed by a hash of their content, and stimuli
+# refer to them as {'__asset__': key}.  RPC calls are one-way, so displays cannot report a cache miss.  Instead, the
+# client keeps a mirror of the cache: both sides see the same puts and uses in the same order, with the same sizes and
+# budget, so the client knows exactly which assets a display holds and uploads an asset only when it is missing, e.g.:
+#
+# assets = AssetClient(manager)
+# manager.load_stim('ArbitraryGrid', stimulus_code=assets.ref(code), ...)
+
+import json
+import hashlib
+import numpy as np
+
+from collections import OrderedDict
+from functools import wraps
+
+from flystim.wire import encode
+
+ASSET_TAG = '__asset__'
+
+# default size budget of the cache on each display (bytes)
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+def content_key(obj):
+    """
+    Returns a hash of the content of an asset (a numpy array, or JSON data that may contain numpy arrays).
+    """
+
+    h = hashlib.sha1()
+
+    if isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        h.update('{}{}'.format(obj.dtype.str, obj.shape).encode('ascii'))
+        h.update(memoryview(obj).cast('B'))
+    else:
+        h.update(json.dumps(encode(obj), sort_keys=True).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def asset_size(obj):
+    """
+    Returns the size of an asset (bytes), as counted against the budget of the cache.
+    """
+
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+
+    return len(json.dumps(encode(obj)))
+
+
+class AssetCache:
+    """
+    LRU cache of assets with a budget on their total size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, key, value, size):
+        """
+        Adds an asset, evicting the least recently used assets as needed to stay within the budget.
+        :return: list of evicted keys
+        """
+
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+
+        return self.evict()
+
+    def get(self, key):
+        """
+        Returns an asset and marks it as recently used.
+        """
+
+        try:
+            value, _ = self.entries[key]
+        except KeyError:
+            raise KeyError('Asset {} is not in the cache.'.format(key))
+
+        self.entries.move_to_end(key)
+
+        return value
+
+    def touch(self, key):
+        self.entries.move_to_end(key)
+
+    def evict(self):
+        evicted = []
+
+        # the newest asset is kept even if it is larger than the budget on its own
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(key)
+
+        return evicted
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        return self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def resolve(self, obj):
+        """
+        Returns a copy of obj (e.g., the arguments of an RPC call) in which every {'__asset__': key} reference is
+        replaced by the cached asset.
+        """
+
+        if isinstance(obj, dict):
+            if ASSET_TAG in obj:
+                return self.get(obj[ASSET_TAG])
+            return {key: self.resolve(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            if not any(isinstance(value, (dict, list)) for value in obj):
+                return obj
+            return [self.resolve(value) for value in obj]
+        else:
+            return obj
+
+    def resolve_args(self, function):
+        """
+        Wraps an RPC function so that asset references in its arguments are resolved before it is called.
+        """
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return function(*[self.resolve(arg) for arg in args], **self.resolve(kwargs))
+
+        return wrapper
+
+
+class AssetClient:
+    """
+    Client side of the asset cache.  Keeps a mirror of the cache of the displays (without the assets themselves) to
+    decide which assets have to be uploaded.
+    """
+
+    def __init__(self, manager, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param manager: client returned by launch_stim_server
+        :param max_bytes: size budget of the cache, which is also set on the displays
+        """
+
+        self.manager = manager
+        self.mirror = AssetCache(max_bytes=max_bytes)
+
+        # start from an empty cache on the displays, so that the mirror matches it
+        self.manager.clear_assets()
+        self.manager.set_asset_budget(max_bytes)
+
+        # number of uploads and of references that were already cached
+        self.upload_count = 0
+        self.hit_count = 0
+
+    def ref(self, asset):
+        """
+        Returns a reference to the asset that can be used in place of it in any RPC call, uploading the asset first if
+        the displays do not have it.  The reference should be sent in exactly one call, since the mirror assumes that
+        the displays use each reference once.
+        """
+
+        key = content_key(asset)
+
+        if key in self.mirror:
+            self.mirror.touch(key)
+            self.hit_count += 1
+        else:
+            size = asset_size(asset)
+            self.manager.put_asset(key, encode(asset), size)
+            self.mirror.put(key, None, size)
+            self.upload_count += 1
+
+        return {ASSET_TAG: key}
@@ -2,10 +2,110 @@
 
 import moderngl
 import numpy as np
-import os.path
+from functools import lru_cache
 from string import Template
 from math import pi, radians
 
+from flystim.gl_cache import get_context_cache, get_program, get_screen_vertex_array, get_warp_texture, shader_source
+from flystim.gl_cache import add_defines
+
+# texture units reserved for per-screen lookup textures, so that they don't collide with textures used by stimuli
+SPH_TEXTURE_UNIT = 6
+WARP_TEXTURE_UNIT = 7
+
+@lru_cache(maxsize=None)
+def fragment_shader_template():
+    return Template(shader_source('base.template'))
+
+class SphericalLookup:
+    """
+    Texture holding the spherical coordinates (r, theta, phi) of each pixel of a screen relative to the fly.  The
+    texture is only recomputed when the fly position or the viewport changes, so stimuli do a texture fetch per pixel
+    instead of evaluating length, acos, and atan for every layer of every frame.
+    """
+
+    def __init__(self, ctx, screen):
+        # save settings
+        self.ctx = ctx
+        self.screen = screen
+
+        # screens with a warp map look up pixel positions in a texture
+        defines = ['USE_WARP'] if self.screen.warp is not None else []
+
+        # create the program that computes spherical coordinates
+        self.prog = get_program(self.ctx, vertex_shader=add_defines(shader_source('base.vert'), defines),
+                                fragment_shader=add_defines(shader_source('sph.frag'), defines))
+        self.vao = get_screen_vertex_array(self.ctx, prog=self.prog, screen=self.screen)
+
+        # bind the warp map, if any
+        if self.screen.warp is not None:
+            self.warp_texture = get_warp_texture(self.ctx, self.screen.warp)
+            self.prog['warp_map'].value = WARP_TEXTURE_UNIT
+        else:
+            self.warp_texture = None
+
+        # the texture and framebuffer are created when the size of the viewport is known
+        self.texture = None
+        self.fbo = None
+        self.fly_pos = None
+        self.viewport = None
+
+    def resize(self, width, height):
+        if self.fbo is not None:
+            self.fbo.release()
+            self.texture.release()
+
+        self.texture = self.ctx.texture((width, height), 4, dtype='f4')
+        self.texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        self.fbo = self.ctx.framebuffer(color_attachments=[self.texture])
+
+    def update(self, global_fly_pos):
+        """
+        Recomputes the spherical coordinates if the fly position or viewport has changed since the last call.
+        :param global_fly_pos: position of the fly (meters)
+        """
+
+        fly_pos = tuple(float(x) for x in global_fly_pos)
+        viewport = tuple(self.ctx.viewport)
+
+        if (fly_pos == self.fly_pos) and (viewport == self.viewport):
+            return
+
+        # the texture covers the framebuffer up to the far corner of the viewport, so that it can be indexed directly
+        # with gl_FragCoord
+        size = (viewport[0] + viewport[2], viewport[1] + viewport[3])
+        if (self.texture is None) or (self.texture.size != size):
+            self.resize(*size)
+
+        # render the spherical coordinates into the texture, then restore the previous framebuffer
+        prev_fbo = self.ctx.fbo
+        self.fbo.use()
+        self.ctx.viewport = viewport
+        self.fbo.clear(0.0, 0.0, 0.0, 0.0)
+
+        if self.warp_texture is not None:
+            self.warp_texture.use(location=WARP_TEXTURE_UNIT)
+
+        self.prog['global_fly_pos'].value = fly_pos
+        self.vao.render(mode=moderngl.TRIANGLES)
+
+        prev_fbo.use()
+        self.ctx.viewport = viewport
+
+        # remember the state that the texture corresponds to
+        self.fly_pos = fly_pos
+        self.viewport = viewport
+
+    def use(self):
+        self.texture.use(location=SPH_TEXTURE_UNIT)
+
+def get_spherical_lookup(ctx, screen):
+    """
+    Returns the SphericalLookup shared by all programs drawing the given screen with the given context.
+    """
+
+    return get_context_cache(ctx).shared(('sph', id(screen)), lambda: SphericalLookup(ctx=ctx, screen=screen))
+
 class BaseConfigOptions:
     def __init__(self, *args, box_min_x=-180, box_max_x=180, box_min_y=0, box_max_y=180, **kwargs):
         self.args = args
@@ -50,53 +150,47 @@ class BaseProgram:
             '''
         self.rgb = rgb
 
-    def initialize(self, ctx):
+        # texture unit used by stimuli with textures.  this is changed when the stimulus is drawn as one layer of a
+        # composited program (see flystim.compositor)
+        self.texture_unit = 0
+
+    def make_fragment_shader(self):
         """
-        :param ctx: ModernGL context
+        Returns the GLSL source of the fragment shader for this program, generated from base.template.
         """
 
-        # save context
-        self.ctx = ctx
-
-        # find path to shader directory
-        this_file_path = os.path.realpath(os.path.expanduser(__file__))
-        shader_dir = os.path.join(os.path.dirname(os.path.dirname(this_file_path)), 'shaders')
-
-        # load the vertex shader
-        vertex_shader = open(os.path.join(shader_dir, 'base.vert'), 'r').read()
-
         # convert list of uniforms to GLSL code
         decl_uniforms = ''.join(str(uniform)+';\n' for uniform in self.uniforms)
 
         # convert list of functions to GLSL code
         decl_functions = ''.join(str(function)+'\n' for function in self.functions)
 
-        # load the fragment shader
-        fragment_shader_template = Template(open(os.path.join(shader_dir, 'base.template'), 'r').read())
-        fragment_shader = fragment_shader_template.substitute(
+        # fill in the fragment shader template
+        return fragment_shader_template().substitute(
             decl_uniforms=decl_uniforms,
             decl_functions=decl_functions,
             calc_color=self.calc_color,
             rgb=self.rgb
         )
 
-        self.prog = self.ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
-
-        # create a flat list of all of the 5-tuples that describe the screen coordinates
-        data = []
+    def initialize(self, ctx):
+        """
+        :param ctx: ModernGL context
+        """
 
-        for tri in self.screen.tri_list:
-            for pt in [tri.pa, tri.pb, tri.pc]:
-                data.extend(pt.ndc)
-                data.extend(pt.cart)
+        # save context
+        self.ctx = ctx
 
-        data = np.array(data, dtype=float)
+        # compile the program, or reuse it if the same source has already been compiled for this context
+        self.prog = get_program(self.ctx, vertex_shader=shader_source('base.vert'),
+                                fragment_shader=self.make_fragment_shader())
+        self.prog['sph_coords'].value = SPH_TEXTURE_UNIT
 
-        # create a VBO for the vertex data
-        vbo = self.ctx.buffer(data.astype('f4').tobytes())
+        # get the lookup texture of spherical coordinates, which is shared by all programs drawing this screen
+        self.sph_lookup = get_spherical_lookup(self.ctx, screen=self.screen)
 
-        # create vertex array object
-        self.vao = self.ctx.simple_vertex_array(self.prog, vbo, 'vert_pos', 'vert_col')
+        # create vertex array object, which shares a VBO with all other programs drawing this screen
+        self.vao = get_screen_vertex_array(self.ctx, prog=self.prog, screen=self.screen)
 
     def configure(self, *args, **kwargs):
         pass
@@ -106,17 +200,28 @@ class BaseProgram:
         :param t: current time in seconds
         """
 
+        self.prog['global_theta_offset'].value = global_theta_offset
+        self.prog['global_phi_offset'].value = global_phi_offset
+
+        # the spherical coordinates are only recomputed if the fly has moved
+        self.sph_lookup.update(global_fly_pos)
+        self.sph_lookup.use()
+
+        self.eval_layer(t)
+        self.vao.render(mode=moderngl.TRIANGLES)
+
+    def eval_layer(self, t):
+        """
+        Writes the uniforms that are specific to this stimulus for time t.
+        :param t: current time in seconds
+        """
+
         self.prog['box_min_x'].value = self.box_min_x
         self.prog['box_max_x'].value = self.box_max_x
         self.prog['box_min_y'].value = self.box_min_y
         self.prog['box_max_y'].value = self.box_max_y
 
-        self.prog['global_fly_pos'].value = tuple(global_fly_pos)
-        self.prog['global_theta_offset'].value = global_theta_offset
-        self.prog['global_phi_offset'].value = global_phi_offset
-
         self.eval_at(t)
-        self.vao.render(mode=moderngl.TRIANGLES)
 
     def eval_at(self, t):
         """
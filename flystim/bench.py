@@ -0,0 +1,230 @@
+# Rendering benchmark for the stimulus classes and CAVE shapes.  Each case is drawn headlessly for a fixed number of
+# frames, and the CPU time per frame, GPU time per frame and achievable frame rate are reported as JSON.  Results can be
+# compared against a stored baseline to catch performance regressions, e.g.:
+#
+# flystim_bench --save baseline.json
+# flystim_bench --baseline baseline.json
+
+import sys
+import json
+import platform
+import numpy as np
+
+from argparse import ArgumentParser
+from math import radians
+from time import perf_counter
+
+from flystim import CaveSystem, GenPerspective, GlCube, GlCylinder, GlSphericalRect, GlSphericalCirc
+from flystim.engine import STIM_CLASSES
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+
+# stimuli that take an update rate parameter
+UPDATE_RATE_STIMS = ['RandomGrid', 'ArbitraryGrid']
+
+# shapes drawn by the CAVE benchmark, along with whether they are textured
+CAVE_SHAPES = {'GlCube': (lambda: GlCube(), False),
+               'GlCylinder': (lambda: GlCylinder(), False),
+               'GlCylinder(texture)': (lambda: GlCylinder(texture=True), True),
+               'GlSphericalRect': (lambda: GlSphericalRect(), False),
+               'GlSphericalCirc': (lambda: GlSphericalCirc(), False),
+               'GlSphericalRect(fine)': (lambda: GlSphericalRect(n_steps_x=300, n_steps_y=300), False)}
+
+
+def summarize(values):
+    values = np.asarray(values)
+    return {'mean': float(np.mean(values)), 'median': float(np.median(values)),
+            'p95': float(np.percentile(values, 95)), 'max': float(np.max(values))}
+
+
+def time_frames(display, draw, n_frames, n_warmup, frame_rate):
+    """
+    Times a drawing function on the given display.  The achievable frame rate is measured first with frames drawn
+    back to back; then each frame is timed individually, which requires waiting for the GPU after every frame.
+    :param draw: function that draws one frame, called with the time of the frame in seconds
+    """
+
+    times = [k/frame_rate for k in range(n_warmup + n_frames)]
+
+    # warm up (e.g., compile programs and allocate textures)
+    for t in times[:n_warmup]:
+        draw(t)
+    display.ctx.finish()
+
+    # achievable frame rate
+    start = perf_counter()
+    for t in times[n_warmup:]:
+        draw(t)
+    display.ctx.finish()
+    fps = n_frames/(perf_counter() - start)
+
+    # CPU and GPU time of individual frames
+    cpu_times = []
+    gpu_times = []
+    query = display.ctx.query(time=True)
+    for t in times[n_warmup:]:
+        start = perf_counter()
+        with query:
+            draw(t)
+        cpu_times.append(perf_counter() - start)
+        gpu_times.append(1e-9*query.elapsed)
+
+    return {'fps': fps, 'cpu_ms': summarize(1e3*np.array(cpu_times)), 'gpu_ms': summarize(1e3*np.array(gpu_times))}
+
+
+def bench_stim(display, name, settings, layers=1, update_rate=60.0, **kwargs):
+    """
+    Benchmarks a stimulus class, loaded the given number of times as layers on top of each other.
+    :param settings: keyword arguments of time_frames
+    """
+
+    if name in UPDATE_RATE_STIMS:
+        kwargs['update_rate'] = update_rate
+
+    display.stop_stim(print_profile=False)
+    for _ in range(layers):
+        display.load_stim(name, hold=True, **kwargs)
+    display.start_stim(t=0)
+
+    stims = [stim for stim, _ in display.stim_list]
+    composited = display.composite_layers and (layers > 1) and display.compositor.can_composite(stims)
+
+    result = time_frames(display, draw=display.paint, **settings)
+    result.update({'name': name, 'kind': 'stim', 'layers': layers, 'composited': composited})
+
+    display.stop_stim(print_profile=False)
+
+    return result
+
+
+def bench_cave_shape(display, name, settings, layers=1):
+    """
+    Benchmarks drawing a CAVE shape, drawn the given number of times per frame.
+    :param settings: keyword arguments of time_frames
+    """
+
+    make_shape, textured = CAVE_SHAPES[name]
+
+    cave = CaveSystem()
+    cave.add_subscreen((0, 0, display.width, display.height),
+                       GenPerspective(pa=(+1, -1, -1), pb=(+1, +1, -1), pc=(+1, -1, 1), pe=(0, 0, 0)))
+    cave.initialize(display)
+
+    # the texture is uploaded once, as a stimulus with a fixed texture would do
+    texture = None
+    if textured:
+        texture = cave.create_texture((255*np.random.RandomState(0).rand(256, 256)).astype(np.uint8))
+
+    def draw(t):
+        display.fbo.use()
+        display.ctx.viewport = (0, 0, display.width, display.height)
+        display.ctx.clear(0, 0, 0, 1)
+
+        # shapes are rebuilt every frame, as they would be when animated
+        for _ in range(layers):
+            cave.render(make_shape().rotz(radians(20*t)), texture=texture)
+
+    result = time_frames(display, draw=draw, **settings)
+    result.update({'name': name, 'kind': 'cave', 'layers': layers, 'composited': False})
+
+    return result
+
+
+def run_bench(width=512, height=512, layers=1, n_frames=200, n_warmup=10, frame_rate=120.0, update_rate=60.0,
+              names=None, backend=None):
+    """
+    Runs the benchmark for every stimulus class and CAVE shape (or the given subset of names).
+    :return: dictionary with the benchmark settings, information about the renderer, and one result per case
+    """
+
+    if names is None:
+        names = list(STIM_CLASSES) + list(CAVE_SHAPES)
+
+    display = HeadlessStimDisplay(screen=Screen(), width=width, height=height, backend=backend)
+    display.hide_corner_square()
+    settings = {'n_frames': n_frames, 'n_warmup': n_warmup, 'frame_rate': frame_rate}
+
+    results = []
+    for name in names:
+        if name in STIM_CLASSES:
+            results.append(bench_stim(display, name, settings, layers=layers, update_rate=update_rate))
+        elif name in CAVE_SHAPES:
+            results.append(bench_cave_shape(display, name, settings, layers=layers))
+        else:
+            raise ValueError('Unknown benchmark: {}'.format(name))
+
+    report = {'settings': {'width': width, 'height': height, 'layers': layers, 'n_frames': n_frames,
+                           'frame_rate': frame_rate, 'update_rate': update_rate},
+              'environment': {'renderer': display.ctx.info['GL_RENDERER'], 'gl_version': display.ctx.info['GL_VERSION'],
+                              'python': platform.python_version(), 'platform': platform.platform()},
+              'results': results}
+
+    display.release()
+
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Compares a benchmark report against a baseline report.  A case is a regression if its median CPU or GPU time per
+    frame grew, or its frame rate dropped, by more than the given fraction.
+    :return: list of (name, metric, baseline value, new value) for each regression
+    """
+
+    baseline_results = {(result['name'], result['layers']): result for result in baseline['results']}
+
+    regressions = []
+    for result in report['results']:
+        old = baseline_results.get((result['name'], result['layers']))
+        if old is None:
+            continue
+
+        for metric in ['cpu_ms', 'gpu_ms']:
+            if result[metric]['median'] > (1 + tolerance)*old[metric]['median']:
+                regressions.append((result['name'], metric, old[metric]['median'], result[metric]['median']))
+
+        if result['fps'] < (1 - tolerance)*old['fps']:
+            regressions.append((result['name'], 'fps', old['fps'], result['fps']))
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Benchmarks headless rendering of each stimulus class and CAVE shape.')
+    parser.add_argument('names', nargs='*', help='Stimulus classes or shapes to benchmark (default: all)')
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--layers', type=int, default=1, help='Number of copies of each stimulus drawn per frame')
+    parser.add_argument('--frames', type=int, default=200, help='Number of frames timed for each case')
+    parser.add_argument('--frame-rate', type=float, default=120.0, help='Display frame rate that is simulated')
+    parser.add_argument('--update-rate', type=float, default=60.0, help='Update rate of noise stimuli')
+    parser.add_argument('--backend', default=None, help='ModernGL backend, e.g. egl')
+    parser.add_argument('--save', default=None, help='File where the JSON report is written')
+    parser.add_argument('--baseline', default=None, help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed fractional slowdown vs. the baseline')
+    args = parser.parse_args()
+
+    report = run_bench(width=args.width, height=args.height, layers=args.layers, n_frames=args.frames,
+                       frame_rate=args.frame_rate, update_rate=args.update_rate, names=args.names or None,
+                       backend=args.backend)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(report, baseline, tolerance=args.tolerance)
+        for name, metric, old, new in regressions:
+            print('REGRESSION: {} {}: {:.3f} -> {:.3f}'.format(name, metric, old, new), file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
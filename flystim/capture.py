@@ -0,0 +1,193 @@
+import io
+import os
+import json
+import zipfile
+import threading
+import numpy as np
+
+from queue import Queue, Full
+
+
+class FrameCapture:
+    """
+    Reads rendered frames back from the GPU without stalling the render loop.  Each call to capture() starts an
+    asynchronous copy of the framebuffer into one buffer of a ring of pixel buffer objects.  The copy is only mapped
+    once the ring wraps around (i.e., a couple of frames later, when the GPU has finished with it), and the pixels are
+    then handed to a writer thread that calls the given callback.  If the writer thread falls behind, frames are
+    dropped (and counted in dropped_count) rather than stalling the render loop, unless block is set.
+    """
+
+    def __init__(self, ctx, size, callback, n_buffers=3, components=3, max_queue=64, block=False):
+        """
+        :param ctx: ModernGL context used for rendering
+        :param size: (width, height) of the region to capture, in pixels
+        :param callback: Function called from the writer thread as callback(frame, info) for each frame, where frame
+        is a (height, width, components) uint8 array with the top row first.
+        :param n_buffers: Number of pixel buffer objects in the ring.  Frames are mapped n_buffers-1 frames after
+        they are captured.
+        :param components: Number of color components to read (3 for RGB, 4 for RGBA)
+        :param max_queue: Maximum number of frames waiting for the writer thread.
+        :param block: If True, capture() waits for the writer thread when max_queue frames are waiting, so that no
+        frame is lost.  This is meant for offline rendering (e.g., flystim.export), where stalling is harmless.
+        Otherwise, frames that do not fit in the queue are dropped.
+        """
+
+        # save settings
+        self.ctx = ctx
+        self.size = size
+        self.callback = callback
+        self.components = components
+        self.block = block
+
+        # create the ring of buffers
+        width, height = size
+        self.buffers = [ctx.buffer(reserve=width*height*components) for _ in range(n_buffers)]
+        self.pending = [None]*n_buffers
+        self.index = 0
+
+        # statistics
+        self.frame_count = 0
+        self.dropped_count = 0
+
+        # start the writer thread
+        self.queue = Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def capture(self, fbo=None, info=None):
+        """
+        Starts reading back the current contents of a framebuffer.
+        :param fbo: Framebuffer to read from.  Defaults to the framebuffer currently in use.
+        :param info: Arbitrary data passed to the callback along with the frame (e.g., frame time)
+        """
+
+        if self.error is not None:
+            raise self.error
+
+        if fbo is None:
+            fbo = self.ctx.fbo
+
+        # map the oldest read if the ring is full
+        if self.pending[self.index] is not None:
+            self.map(self.index)
+
+        # start the copy into the buffer
+        fbo.read_into(self.buffers[self.index], viewport=(0, 0) + tuple(self.size), components=self.components)
+        self.pending[self.index] = info if info is not None else {}
+
+        self.index = (self.index + 1) % len(self.buffers)
+        self.frame_count += 1
+
+    def map(self, index, block=None):
+        if block is None:
+            block = self.block
+
+        width, height = self.size
+
+        data = self.buffers[index].read()
+        frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, self.components)[::-1]
+
+        try:
+            self.queue.put((frame, self.pending[index]), block=block)
+        except Full:
+            self.dropped_count += 1
+        self.pending[index] = None
+
+    def flush(self):
+        """
+        Maps all reads that are still in flight (oldest first) and waits for the writer thread to process them.  None
+        of these frames are dropped, since the render loop is not waiting for them.
+        """
+
+        n_buffers = len(self.buffers)
+        for k in range(n_buffers):
+            index = (self.index + k) % n_buffers
+            if self.pending[index] is not None:
+                self.map(index, block=True)
+
+        self.queue.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Flushes all frames, stops the writer thread and releases the buffers.
+        """
+
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+            for buffer in self.buffers:
+                buffer.release()
+
+    def write_frames(self):
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                if self.error is None:
+                    self.callback(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+
+class FrameArchive:
+    """
+    Writes frames as compressed .npy files in a zip archive, along with the time of each frame.
+    """
+
+    def __init__(self, file_name):
+        self.zip_file = zipfile.ZipFile(file_name, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.frame_count = 0
+        self.info = []
+
+    def write(self, frame, info):
+        data = io.BytesIO()
+        np.save(data, frame)
+
+        self.zip_file.writestr('frame_{:07d}.npy'.format(self.frame_count), data.getvalue())
+        self.info.append(info)
+        self.frame_count += 1
+
+    def close(self):
+        self.zip_file.writestr('frames.json', json.dumps(self.info))
+        self.zip_file.close()
+
+
+class VideoFile:
+    """
+    Writes frames to a compressed video file.  This requires the imageio package (with its ffmpeg plugin), which is
+    only imported when a video is written.
+    """
+
+    def __init__(self, file_name, fps=120):
+        import imageio
+
+        self.writer = imageio.get_writer(file_name, fps=fps, macro_block_size=1)
+
+    def write(self, frame, info):
+        self.writer.append_data(frame)
+
+    def close(self):
+        self.writer.close()
+
+
+def open_output(file_name, fps=120):
+    """
+    Opens a frame archive (.zip) or a video file (any other extension), depending on the name of the file.
+    """
+
+    if os.path.splitext(file_name)[1].lower() == '.zip':
+        return FrameArchive(file_name)
+    else:
+        return VideoFile(file_name, fps=fps)
@@ -3,8 +3,12 @@
 import numpy as np
 import moderngl
 from flystim import normalize, rotx, roty, rotz, rel_path
+from flystim.scene import SceneNode
 import os
 
+# model matrix of shapes drawn with CaveSystem.render, whose vertices are already in world coordinates
+IDENTITY_MODEL = np.eye(4, dtype='f4').tobytes(order='F')
+
 class CaveSystem:
     def __init__(self, num_tri=200):
         # save settings
@@ -13,6 +17,21 @@ class CaveSystem:
         # initialize
         self.subscreens = []
 
+        # vertex buffers are kept between frames and only reallocated when a larger object is drawn.  they are indexed
+        # by whether the vertices include texture coordinates.
+        self.vertex_objects = {}
+
+        # textures, indexed by handle (see create_texture)
+        self.textures = {}
+        self.texture_count = 0
+
+        # handle of the texture used by render(obj, texture_img=...)
+        self.default_texture = None
+
+        # retained scene drawn by render_scene, and the static VBOs of its meshes, indexed by mesh
+        self.scene = SceneNode()
+        self.meshes = {}
+
     def add_subscreen(self, viewport, perspective):
         self.subscreens.append((viewport, perspective))
 
@@ -21,21 +40,110 @@ class CaveSystem:
         self.prog = self.create_prog()
         self.update_vertex_objects()
 
-    def update_vertex_objects(self, use_texture=False):
+    def update_vertex_objects(self, use_texture=False, n_bytes=None):
+        """
+        Returns the VBO and VAO for vertices with or without texture coordinates, growing the VBO if it cannot hold
+        n_bytes of vertex data.
+        """
+
+        # 3 points per triangle, 9 values (3 for vert, 4 for color, 2 for tex_coords) or 7 values, 4 bytes per value
+        if n_bytes is None:
+            n_bytes = self.num_tri*3*(9 if use_texture else 7)*4
+
+        if use_texture in self.vertex_objects:
+            vbo, vao = self.vertex_objects[use_texture]
+            if vbo.size >= n_bytes:
+                return vbo, vao
+
+            # grow to at least twice the previous size, so that slowly growing objects are reallocated rarely
+            n_bytes = max(n_bytes, 2*vbo.size)
+            vao.release()
+            vbo.release()
+
+        vbo = self.ctx.buffer(reserve=n_bytes)
         if use_texture:
-            # 3 points, 9 values (3 for vert, 4 for color, 2 for tex_coords), 4 bytes per value
-            self.vbo = self.ctx.buffer(reserve=self.num_tri*3*9*4)
-            self.vao = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_vert', 'in_color', 'in_tex_coord')
+            vao = self.ctx.simple_vertex_array(self.prog, vbo, 'in_vert', 'in_color', 'in_tex_coord')
         else:
-            # basic, no-texture vbo and vao:
-            self.vbo = self.ctx.buffer(reserve=self.num_tri*3*7*4) # 3 points, 7 values, 4 bytes per value
-            self.vao = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_vert', 'in_color')
+            vao = self.ctx.simple_vertex_array(self.prog, vbo, 'in_vert', 'in_color')
+
+        self.vertex_objects[use_texture] = (vbo, vao)
+
+        return vbo, vao
+
+    def create_texture(self, texture_img):
+        """
+        Creates a monochrome texture from a 2D uint8 image.
+        :return: handle that can be passed to render, update_texture and release_texture
+        """
+
+        self.texture_count += 1
+        handle = self.texture_count
+
+        self.textures[handle] = self.ctx.texture(size=(texture_img.shape[1], texture_img.shape[0]), components=1,
+                                                 data=np.ascontiguousarray(texture_img, dtype=np.uint8).tobytes())
+
+        return handle
+
+    def update_texture(self, handle, texture_img):
+        """
+        Replaces the image of a texture.  If the size is unchanged, the texture is written in place.
+        """
+
+        texture = self.textures[handle]
+
+        if texture.size == (texture_img.shape[1], texture_img.shape[0]):
+            texture.write(np.ascontiguousarray(texture_img, dtype=np.uint8))
+        else:
+            texture.release()
+            self.textures[handle] = self.ctx.texture(size=(texture_img.shape[1], texture_img.shape[0]), components=1,
+                                                     data=np.ascontiguousarray(texture_img, dtype=np.uint8).tobytes())
+
+    def release_texture(self, handle):
+        self.textures.pop(handle).release()
+
+        if handle == self.default_texture:
+            self.default_texture = None
 
     def add_texture(self, texture_img):
-        self.texture = self.ctx.texture(size=(texture_img.shape[1], texture_img.shape[0]),
-                                        components=1,
-                                        data=texture_img.tobytes()) # size = (width, height)
-        self.texture.use()
+        """
+        Sets the image of the default texture, which is written in place after the first call.
+        :return: handle of the default texture
+        """
+
+        if self.default_texture is None:
+            self.default_texture = self.create_texture(texture_img)
+        else:
+            self.update_texture(self.default_texture, texture_img)
+
+        return self.default_texture
+
+    def upload_mesh(self, mesh):
+        """
+        Uploads a shape to a static VBO, if it has not been uploaded yet.
+        :return: VAO and number of vertices of the mesh
+        """
+
+        if mesh not in self.meshes:
+            data = mesh.data.astype('f4')
+            vbo = self.ctx.buffer(data)
+
+            if mesh.tex_coords is not None:
+                vao = self.ctx.simple_vertex_array(self.prog, vbo, 'in_vert', 'in_color', 'in_tex_coord')
+                vertices = len(data) // 9
+            else:
+                vao = self.ctx.simple_vertex_array(self.prog, vbo, 'in_vert', 'in_color')
+                vertices = len(data) // 7
+
+            self.meshes[mesh] = (vbo, vao, vertices)
+
+        _, vao, vertices = self.meshes[mesh]
+
+        return vao, vertices
+
+    def release_mesh(self, mesh):
+        vbo, vao, _ = self.meshes.pop(mesh)
+        vao.release()
+        vbo.release()
 
     def create_prog(self):
         return self.ctx.program(
@@ -50,11 +158,12 @@ class CaveSystem:
                 out vec2 v_tex_coord;
 
                 uniform mat4 Mvp;
+                uniform mat4 Model;
 
                 void main() {
                     v_color = in_color;
                     v_tex_coord = in_tex_coord;
-                    gl_Position = Mvp * vec4(in_vert, 1.0);
+                    gl_Position = Mvp * Model * vec4(in_vert, 1.0);
                 }
             ''',
             fragment_shader='''
@@ -81,21 +190,30 @@ class CaveSystem:
             '''
         )
 
-    def render(self, obj, texture_img=None):
+    def render(self, obj, texture_img=None, texture=None):
+        """
+        Draws an object on every subscreen.
+        :param obj: shape from flystim.shapes
+        :param texture_img: 2D uint8 image to texture the object with, which is copied into the default texture
+        :param texture: handle of a texture created with create_texture, used instead of texture_img
+        """
+
         data = obj.data
 
-        if texture_img is not None:
-            self.update_vertex_objects(use_texture=True)
-            self.prog['use_texture'].value = True
-            self.add_texture(texture_img)
-            vertices = len(data) // 9
-        else:
-            self.update_vertex_objects(use_texture=False)
-            self.prog['use_texture'].value = False
-            vertices = len(data) // 7
+        if texture_img is not None and texture is None:
+            texture = self.add_texture(texture_img)
+
+        use_texture = texture is not None
+        vertices = len(data) // (9 if use_texture else 7)
 
-        # write data to VBO
-        self.vbo.write(data.astype('f4'))
+        # write data to the VBO
+        vbo, vao = self.update_vertex_objects(use_texture=use_texture, n_bytes=4*len(data))
+        vbo.write(data.astype('f4'))
+
+        self.prog['use_texture'].value = use_texture
+        if use_texture:
+            self.textures[texture].use()
+        self.prog['Model'].write(IDENTITY_MODEL)
 
         # render each viewport separately
         for viewport, perspective in self.subscreens:
@@ -104,7 +222,34 @@ class CaveSystem:
             # set the perspective matrix
             self.prog['Mvp'].write(perspective.matrix.astype('f4').tobytes(order='F'))
             # render the objects
-            self.vao.render(mode=moderngl.TRIANGLES, vertices=vertices)
+            vao.render(mode=moderngl.TRIANGLES, vertices=vertices)
+
+    def render_scene(self, scene=None):
+        """
+        Draws every visible node of a scene on every subscreen.  Meshes are uploaded the first time they are drawn.
+        :param scene: root SceneNode (default: self.scene)
+        """
+
+        if scene is None:
+            scene = self.scene
+
+        # look up the GPU state of each node once per frame
+        draws = []
+        for node, model in scene.draw_list():
+            vao, vertices = self.upload_mesh(node.mesh)
+            draws.append((vao, vertices, node.texture, model.astype('f4').tobytes(order='F')))
+
+        for viewport, perspective in self.subscreens:
+            self.ctx.viewport = viewport
+            self.prog['Mvp'].write(perspective.matrix.astype('f4').tobytes(order='F'))
+
+            for vao, vertices, texture, model in draws:
+                self.prog['use_texture'].value = texture is not None
+                if texture is not None:
+                    self.textures[texture].use()
+                self.prog['Model'].write(model)
+
+                vao.render(mode=moderngl.TRIANGLES, vertices=vertices)
 
 class GenPerspective:
     def __init__(self, pa, pb, pc, pe=(0, 0, 0), near=0.1, far=100):
@@ -0,0 +1,179 @@
+import re
+import moderngl
+
+from functools import lru_cache
+from string import Template
+
+from flystim.base import SPH_TEXTURE_UNIT, get_spherical_lookup
+from flystim.gl_cache import get_program, get_screen_vertex_array, shader_source
+from flystim.glsl import Uniform, Texture
+
+# uniforms that every stimulus has, in addition to its own
+BOX_UNIFORMS = [Uniform('box_min_x', float), Uniform('box_max_x', float),
+                Uniform('box_min_y', float), Uniform('box_max_y', float)]
+
+# texture units 0 through 5 can be given to layers, since 6 and up are reserved for per-screen lookup textures
+MAX_TEXTURED_LAYERS = SPH_TEXTURE_UNIT
+
+@lru_cache(maxsize=None)
+def composite_template():
+    return Template(shader_source('composite.template'))
+
+@lru_cache(maxsize=None)
+def layer_template():
+    return Template(shader_source('layer.template'))
+
+def layer_prefix(k):
+    return 'l{}_'.format(k)
+
+def uses_texture(stim):
+    return any(isinstance(uniform, Texture) for uniform in stim.uniforms)
+
+class LayerProgram:
+    """
+    Stand-in for a ModernGL program that redirects uniform names to the copies belonging to one layer of a composited
+    program, so that stimulus code written as self.prog['name'] works unchanged.
+    """
+
+    def __init__(self, prog, prefix):
+        self.prog = prog
+        self.prefix = prefix
+
+    def __getitem__(self, name):
+        return self.prog[self.prefix + name]
+
+class CompositeProgram:
+    """
+    Program that draws a list of stimuli in a single full-screen pass.  The calc_color code of each stimulus is
+    placed in its own block of the generated fragment shader, with its uniforms and functions renamed to avoid
+    collisions, and the layers are blended in the shader the same way that they would be blended by OpenGL if drawn
+    one after another.
+    """
+
+    def __init__(self, ctx, screen, stims):
+        # save settings
+        self.ctx = ctx
+        self.screen = screen
+
+        # compile the program
+        self.prog = get_program(self.ctx, vertex_shader=shader_source('base.vert'),
+                                fragment_shader=self.make_fragment_shader(stims))
+        self.prog['sph_coords'].value = SPH_TEXTURE_UNIT
+        self.vao = get_screen_vertex_array(self.ctx, prog=self.prog, screen=self.screen)
+
+        # create a view of the program for each layer
+        self.layers = [LayerProgram(self.prog, layer_prefix(k)) for k in range(len(stims))]
+
+        # assign a texture unit to each layer that needs one
+        self.texture_units = []
+        for layer, stim in zip(self.layers, stims):
+            if uses_texture(stim):
+                texture_unit = len([unit for unit in self.texture_units if unit is not None])
+                for uniform in stim.uniforms:
+                    if isinstance(uniform, Texture):
+                        layer[uniform.name].value = texture_unit
+            else:
+                texture_unit = None
+
+            self.texture_units.append(texture_unit)
+
+    @staticmethod
+    def make_fragment_shader(stims):
+        decl_layers = ''
+        calc_layers = ''
+
+        for k, stim in enumerate(stims):
+            prefix = layer_prefix(k)
+
+            # collect all of the names that belong to this layer
+            uniforms = BOX_UNIFORMS + stim.uniforms
+            names = [uniform.name for uniform in uniforms]
+            for function in stim.functions:
+                names.append(function.name)
+                names.extend(uniform.name for uniform in function.uniforms)
+
+            # rename them in the code of this layer
+            pattern = re.compile(r'\b(' + '|'.join(re.escape(name) for name in names) + r')\b')
+            def rename(code):
+                return pattern.sub(lambda match: prefix + match.group(1), code)
+
+            # add declarations
+            decl_layers += '// layer {}: {}\n'.format(k, type(stim).__name__)
+            decl_layers += rename(''.join(str(uniform)+';\n' for uniform in uniforms))
+            decl_layers += rename(''.join(str(function)+'\n' for function in stim.functions))
+            decl_layers += '\n'
+
+            # add code
+            calc_layers += '// layer {}: {}\n'.format(k, type(stim).__name__)
+            calc_layers += layer_template().substitute(prefix=prefix, rgb=rename(stim.rgb),
+                                                       calc_color=rename(stim.calc_color))
+            calc_layers += '\n'
+
+        return composite_template().substitute(decl_layers=decl_layers, calc_layers=calc_layers)
+
+class Compositor:
+    """
+    Draws the list of loaded stimuli for a screen in a single pass, caching one composited program per combination of
+    stimuli.
+    """
+
+    def __init__(self, ctx, screen):
+        # save settings
+        self.ctx = ctx
+        self.screen = screen
+
+        # initialize
+        self.programs = {}
+        self.sph_lookup = get_spherical_lookup(self.ctx, screen=self.screen)
+
+    @staticmethod
+    def can_composite(stims):
+        """
+        Returns True if the given stimuli can be drawn in a single pass.  Each stimulus instance only has one texture,
+        so a textured stimulus can only appear once.
+        """
+
+        textured = [stim for stim in stims if uses_texture(stim)]
+
+        return (len(textured) == len(set(id(stim) for stim in textured))) and (len(textured) <= MAX_TEXTURED_LAYERS)
+
+    def get_program(self, stims):
+        key = tuple(type(stim).__name__ for stim in stims)
+
+        if key not in self.programs:
+            self.programs[key] = CompositeProgram(ctx=self.ctx, screen=self.screen, stims=stims)
+
+        return self.programs[key]
+
+    def paint_at(self, stim_list, t, global_fly_pos, global_theta_offset, global_phi_offset):
+        """
+        :param stim_list: list of (stim, config_options) tuples, in the order they should be layered
+        :param t: current time in seconds
+        """
+
+        program = self.get_program([stim for stim, _ in stim_list])
+
+        # write the uniforms of each layer by temporarily pointing each stimulus at its part of the program
+        for layer, texture_unit, (stim, config_options) in zip(program.layers, program.texture_units, stim_list):
+            prog, stim.prog = stim.prog, layer
+            stim.texture_unit = texture_unit or 0
+
+            try:
+                stim.apply_config_options(config_options)
+                stim.eval_layer(t)
+            finally:
+                stim.prog = prog
+                stim.texture_unit = 0
+
+        # write the global uniforms
+        program.prog['global_theta_offset'].value = global_theta_offset
+        program.prog['global_phi_offset'].value = global_phi_offset
+
+        # the spherical coordinates are only recomputed if the fly has moved
+        self.sph_lookup.update(global_fly_pos)
+        self.sph_lookup.use()
+
+        # blending between layers happens in the shader, and the result replaces the cleared screen
+        self.ctx.disable(moderngl.BLEND)
+        program.vao.render(mode=moderngl.TRIANGLES)
+        self.ctx.enable(moderngl.BLEND)
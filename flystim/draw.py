@@ -14,11 +14,9 @@ def draw_screens(screens):
     ax = Axes3D(fig)
 
     for screen in screens:
-        for tri in screen.tri_list:
+        for tri in screen.get_tri_array():
             # grab just the xyz coordinates of each point in the triangle
-            pa = np.array(tri.pa.cart)
-            pb = np.array(tri.pb.cart)
-            pc = np.array(tri.pc.cart)
+            pa, pb, pc = tri[:, 2:5]
 
             # draw the triangle
             tri_draw(pa, pb, pc, ax=ax, color=COLOR_LIST[screen.id % len(COLOR_LIST)])
@@ -0,0 +1,665 @@
+import time
+import numpy as np
+import os
+import math
+import json
+import socket
+
+import moderngl
+
+from flystim.stimuli import ContrastReversingGrating, RotatingBars, ExpandingEdges, RandomBars, SequentialBars, SineGrating, RandomGrid
+from flystim.stimuli import Checkerboard, MovingPatch, ConstantBackground, ArbitraryGrid
+from flystim.square import SquareProgram
+from flystim.compositor import Compositor
+from flystim.capture import FrameCapture, open_output
+from flystim.session import SessionWriter, history_file_name
+from flystim.startup import startup_timer
+from flystim.trajectory import TrajectoryBank
+from flystim.wire import decode_args
+from flystim.assets import AssetCache
+from math import radians
+
+# stimulus classes that can be loaded by name
+STIM_CLASSES = {cls.__name__: cls for cls in [ContrastReversingGrating, RotatingBars, ExpandingEdges, RandomBars,
+                                              SequentialBars, SineGrating, RandomGrid, MovingPatch, Checkerboard,
+                                              ConstantBackground, ArbitraryGrid]}
+
+class StimEngine:
+    """
+    Class that holds the stimulus state of one screen and renders it with a ModernGL context.  It has no knowledge of
+    windows, so the same engine is used to draw into a Qt window (flystim.framework.StimDisplay) or into an offscreen
+    framebuffer (flystim.headless.HeadlessStimDisplay).
+    """
+
+    # names of the methods that are exposed over RPC
+    rpc_function_names = ['load_stim', 'start_stim', 'stop_stim', 'pause_stim', 'update_stim', 'start_corner_square',
+                          'stop_corner_square', 'white_corner_square', 'black_corner_square', 'set_corner_square',
+                          'set_corner_square_mode', 'show_corner_square', 'hide_corner_square', 'set_idle_background',
+                          'set_composite_layers', 'set_global_fly_pos', 'set_global_theta_offset',
+                          'set_global_phi_offset', 'set_save_path', 'set_save_prefix', 'set_save_history_params',
+                          'save_history', 'start_saving_history', 'stop_saving_history', 'print_startup_report',
+                          'save_startup_report', 'start_capture', 'stop_capture', 'set_shared_pose',
+                          'set_frame_listener', 'mark_frame', 'upload_trajectory', 'clear_trajectories', 'put_asset',
+                          'clear_assets', 'set_asset_budget']
+
+    def __init__(self, screen):
+        """
+        :param screen: Screen object (from flystim.screen) corresponding to the screen on which the stimulus will
+        be displayed.
+        """
+
+        # stimulus initialization
+        self.stim_list = []
+
+        # stimulus state
+        self.stim_paused = True
+        self.stim_start_time = None
+        self.stim_offset_time = 0
+
+        # profiling information
+        self.profile_frame_count = None
+        self.profile_start_time = None
+        self.profile_last_time = None
+        self.profile_frame_times = None
+
+        # save handle to screen
+        self.screen = screen
+
+        # OpenGL programs used by stimuli are created and compiled the first time each stimulus is loaded
+        self.render_programs = {}
+
+        # trajectories uploaded once per session, referred to by name when loading stimuli
+        self.trajectory_bank = TrajectoryBank()
+
+        # large assets (e.g., ArbitraryGrid codes) cached by content, referred to as {'__asset__': key}
+        self.asset_cache = AssetCache()
+
+        # make program for rendering the corner square
+        self.square_program = SquareProgram(screen=screen)
+
+        # draw layered stimuli in a single pass when possible
+        self.composite_layers = True
+
+        # initialize background color
+        self.idle_background = 0.5
+
+        # set the closed-loop parameters
+        self.global_theta_offset = 0
+        self.global_phi_offset = 0
+        self.global_fly_pos = np.array([0, 0, 0], dtype=float)
+
+        # closed-loop pose shared by the client through shared memory (optional)
+        self.shared_pose = None
+
+        # address that frame events are sent to (see flystim.aio), and the mark to report after the next frame
+        self.frame_listener = None
+        self.frame_socket = None
+        self.pending_mark = None
+
+        # save history for behavior analysis and stim-behavior alignment
+        self.save_history_flag = False
+        self.saving_history = False
+        self.saved_frame_count = None
+        self.save_format = 'txt'
+        self.history_writer = None
+
+        # capture of displayed frames (off by default)
+        self.capture_settings = None
+        self.frame_capture = None
+        self.capture_output = None
+        # number of frames dropped by the last capture
+        self.capture_dropped_count = 0
+
+    def initialize_gl(self, ctx):
+        """
+        :param ctx: ModernGL context that the engine will render with
+        """
+
+        # save context
+        self.ctx = ctx
+
+        # initialize square program
+        self.square_program.initialize(self.ctx)
+
+        # initialize the compositor for layered stimuli
+        self.compositor = Compositor(ctx=self.ctx, screen=self.screen)
+
+    def register_functions(self, server):
+        """
+        Registers the control functions of this engine with an RPC server.
+        """
+
+        # numpy arrays in the arguments arrive in the format of flystim.wire, and cached assets by reference
+        for name in self.rpc_function_names:
+            server.register_function(self.asset_cache.resolve_args(decode_args(getattr(self, name))))
+
+    def get_render_program(self, name):
+        """
+        Returns the program for the stimulus with the given name, creating and compiling it on first use.
+        :param name: Name of the stimulus (should be a class name)
+        """
+
+        if name not in self.render_programs:
+            render_program = STIM_CLASSES[name](screen=self.screen)
+            render_program.initialize(self.ctx)
+            self.render_programs[name] = render_program
+
+        return self.render_programs[name]
+
+    def get_stim_time(self, t):
+        stim_time = self.stim_offset_time
+
+        if not self.stim_paused:
+            stim_time += t - self.stim_start_time
+
+        return stim_time
+
+    def render(self, viewport, t=None):
+        """
+        Draws one frame into the framebuffer that is currently in use.
+        :param viewport: (x, y, width, height) of the region to draw into, in pixels
+        :param t: time of the frame in seconds.  If None, the current time is used.
+        """
+
+        # set the viewport
+        self.ctx.viewport = viewport
+
+        # use the current time unless rendering offline
+        if t is None:
+            t = time.time()
+
+        # get the latest pose if it is shared through memory
+        if self.shared_pose is not None:
+            self.read_shared_pose()
+
+        # draw the stimulus
+        if self.stim_list:
+
+            stim_time = self.get_stim_time(t)
+            self.ctx.clear(0, 0, 0, 1)
+            self.ctx.enable(moderngl.BLEND)
+
+            # theta + 90degrees because 90 is directly in front of the animal and this allows stimulus definition to use 0 as in front of the animal.
+            # theta mod 360deg - 360deg keeps the extreme theta values on screen. Flystim seems to not handle extreme theta values well.
+            global_theta_offset = (self.global_theta_offset+math.pi/2) % (2*math.pi) - 2*math.pi
+
+            stims = [stim for stim, _ in self.stim_list]
+            if self.composite_layers and (len(stims) > 1) and self.compositor.can_composite(stims):
+                # draw all layers in one pass
+                self.compositor.paint_at(self.stim_list, stim_time, global_fly_pos=self.global_fly_pos,
+                                         global_theta_offset=global_theta_offset,
+                                         global_phi_offset=self.global_phi_offset)
+            else:
+                for stim, config_options in self.stim_list:
+                    stim.apply_config_options(config_options)
+                    stim.paint_at(stim_time, global_fly_pos=self.global_fly_pos,
+                                  global_theta_offset=global_theta_offset,
+                                  global_phi_offset=self.global_phi_offset)
+
+            if self.profile_frame_count is not None:
+                self.profile_frame_count += 1
+
+        else:
+            self.ctx.clear(self.idle_background, self.idle_background, self.idle_background, 1.0)
+
+        # Save data...
+        # Save stim_time AND global positions and offsets
+        if self.save_history_flag and self.saving_history:
+            self.square_history[self.saved_frame_count] = int(self.square_program.color) #stim_time
+            self.time_history[self.saved_frame_count] = t
+            self.stim_time_history[self.saved_frame_count] = np.nan if not self.stim_list else stim_time
+            self.global_theta_offset_history[self.saved_frame_count] = self.global_theta_offset
+            # self.global_fly_posx_history[self.saved_frame_count] = self.global_fly_pos[0]
+            # self.global_fly_posy_history[self.saved_frame_count] = self.global_fly_pos[1]
+            #self.global_fly_posz_history[self.saved_frame_count] = self.global_fly_pos[2]
+            #self.global_phi_offset_history[self.saved_frame_count] = self.global_phi_offset
+
+            self.saved_frame_count += 1
+
+
+        # draw the corner square
+        self.square_program.paint() #must come after saving history to match length??
+
+        # capture the frame if desired
+        if self.capture_settings is not None:
+            self.capture_frame(viewport=viewport, t=t, stim_time=stim_time if self.stim_list else None)
+
+        # report that the commands received before the mark have been applied
+        if self.pending_mark is not None:
+            self.send_frame_event(t)
+
+    def read_shared_pose(self):
+        pose = self.shared_pose.read()
+
+        if pose is not None:
+            self.set_global_theta_offset(pose['theta_offset'])
+            self.set_global_phi_offset(pose['phi_offset'])
+            self.set_global_fly_pos(*pose['fly_pos'])
+
+    def capture_frame(self, viewport, t, stim_time):
+        # the capture is created on the first frame, since the size of the window is not known before then
+        if self.frame_capture is None:
+            self.capture_output = open_output(self.capture_settings['file_name'], fps=self.capture_settings['fps'])
+            self.frame_capture = FrameCapture(self.ctx, size=(int(viewport[2]), int(viewport[3])),
+                                              callback=self.capture_output.write,
+                                              n_buffers=self.capture_settings['n_buffers'])
+
+        # the pixels are read back asynchronously, and written to the file a few frames later
+        self.frame_capture.capture(info={'frame': self.frame_capture.frame_count, 'time': t, 'stim_time': stim_time})
+
+    def send_frame_event(self, t):
+        if self.frame_listener is not None:
+            event = {'screen': self.screen.name, 'mark': self.pending_mark, 't': t}
+            try:
+                self.frame_socket.sendto(json.dumps(event).encode('utf-8'), self.frame_listener)
+            except OSError:
+                # events are best effort, and must never interrupt the display
+                pass
+
+        self.pending_mark = None
+
+    ###########################################
+    # control functions
+    ###########################################
+
+    def update_stim(self, t, rate=None, color=None, background=None):
+        for stim, config_options in self.stim_list:
+            if isinstance(stim, (SineGrating, RotatingBars)):
+                # get the time that will be passed to the stimulus
+                t = self.get_stim_time(t)
+
+                # get the spatial period, rate, and offset (in degrees)
+                period = config_options.kwargs.get('period', 20)
+                old_rate = config_options.kwargs.get('rate', 10)
+                old_offset = config_options.kwargs.get('offset', 0)
+
+                # set the new rate and offset
+                if rate is not None:
+                    config_options.kwargs['rate'] = rate
+                    config_options.kwargs['offset'] = (rate - old_rate) * (360 / period) * t + old_offset
+
+                if color is not None:
+                    config_options.kwargs['color'] = color
+                if background is not None:
+                    config_options.kwargs['background'] = background
+
+
+    def load_stim(self, name, hold=False, *args, **kwargs):
+        """
+        Loads the stimulus with the given name, using the given params.  After the stimulus is loaded, the
+        background color is changed to the one specified in the stimulus, and the stimulus is evaluated at time 0.
+        :param name: Name of the stimulus (should be a class name)
+        :param kwargs: params of the stimulus.  A trajectory param may be the name of a trajectory uploaded with
+        upload_trajectory instead of the trajectory itself.
+        """
+
+        if hold is False:
+            self.stim_list = []
+            self.stim_offset_time = 0
+
+        # trajectories uploaded with upload_trajectory are referred to by name
+        if isinstance(kwargs.get('trajectory'), str):
+            kwargs['trajectory'] = self.trajectory_bank.get(kwargs['trajectory'])
+
+        stim = self.get_render_program(name)
+        config_options = stim.make_config_options(*args, **kwargs)
+
+        self.stim_list.append((stim, config_options))
+
+    def upload_trajectory(self, trajectory_id, trajectory):
+        """
+        Stores a trajectory for the rest of the session, so that stimuli can be loaded with trajectory=trajectory_id
+        instead of sending the whole trajectory for every trial.
+        :param trajectory: RectangleTrajectory converted to dictionary (to_dict method)
+        """
+
+        self.trajectory_bank.add(trajectory_id, trajectory)
+
+    def clear_trajectories(self):
+        self.trajectory_bank.clear()
+
+    def put_asset(self, key, asset, size):
+        """
+        Adds an asset to the cache (see flystim.assets.AssetClient, which decides when assets have to be sent).
+        :param size: size of the asset as counted by the client, so that both sides evict the same assets
+        """
+
+        self.asset_cache.put(key, asset, size)
+
+    def clear_assets(self):
+        self.asset_cache.clear()
+
+    def set_asset_budget(self, max_bytes):
+        self.asset_cache.set_max_bytes(max_bytes)
+
+    def start_stim(self, t):
+        """
+        Starts the stimulus animation, using the given time as t=0
+        :param t: Time corresponding to t=0 of the animation
+        """
+        self.profile_frame_count = 0
+        self.profile_start_time = time.time()
+
+        self.profile_last_time = None
+        self.profile_frame_times = []
+
+        self.stim_paused = False
+        self.stim_start_time = t
+
+
+    def pause_stim(self, t):
+        self.stim_paused = True
+        self.stim_offset_time = t - self.stim_start_time + self.stim_offset_time
+        self.stim_start_time = t
+
+    def stop_stim(self, print_profile = True):
+        """
+        Stops the stimulus animation and removes it from the display.
+        """
+
+        # print profiling information if applicable
+
+        if ((self.profile_frame_count is not None) and
+            (self.profile_start_time is not None) and
+            (self.stim_list)):
+
+            profile_duration = time.time() - self.profile_start_time
+
+            # filter out frame times of duration zero
+            fps_data = np.array(self.profile_frame_times)
+            fps_data = fps_data[fps_data != 0]
+
+            if len(fps_data) > 0 and print_profile:
+                # pandas is only needed for this summary, so it is not imported until it is used
+                import pandas as pd
+
+                fps_data = pd.Series(1.0/fps_data)
+                stim_names = ', '.join([type(stim).__name__ for stim, _ in self.stim_list])
+                print('*** ' + stim_names + ' ***')
+                print(fps_data.describe(percentiles=[0.01, 0.05, 0.1, 0.9, 0.95, 0.99]))
+                print()
+
+        # reset stim variables
+
+        self.stim_list = []
+        self.stim_offset_time = 0
+
+        self.stim_paused = True
+        self.stim_start_time = None
+
+        self.profile_frame_count = None
+        self.profile_start_time = None
+
+        self.profile_last_time = None
+        self.profile_frame_times = None
+
+    def start_corner_square(self):
+        """
+        Start toggling the corner square.
+        """
+
+        self.square_program.toggle = True
+
+    def stop_corner_square(self):
+        """
+        Stop toggling the corner square.
+        """
+
+        self.square_program.toggle = False
+
+    def white_corner_square(self):
+        """
+        Stop the corner square from toggling, then make it white.
+        """
+
+        self.set_corner_square(1.0)
+
+    def black_corner_square(self):
+        """
+        Stop the corner square from toggling, then make it black.
+        """
+
+        self.set_corner_square(0.0)
+
+    def set_corner_square(self, color):
+        """
+        Stop the corner square from toggling, then set it to the desired color.
+        """
+
+        self.stop_corner_square()
+        self.square_program.color = color
+
+    def set_corner_square_mode(self, mode='random', seed=0, n_bits=15, frames_per_bit=1):
+        """
+        Sets how the corner square toggles: 'random' (default), 'seeded' or 'mseq'.  See SquareProgram.set_mode.
+        """
+
+        self.square_program.set_mode(mode=mode, seed=seed, n_bits=n_bits, frames_per_bit=frames_per_bit)
+
+    def show_corner_square(self):
+        """
+        Show the corner square.
+        """
+
+        self.square_program.draw = True
+
+    def hide_corner_square(self):
+        """
+        Hide the corner square.  Note that it will continue to toggle if self.should_toggle_square is True,
+        even though nothing will be displayed.
+        """
+
+        self.square_program.draw = False
+
+    def set_composite_layers(self, value):
+        """
+        If True (default), layered stimuli are drawn in a single pass by a composited program.  Otherwise each layer
+        is drawn separately and blended by OpenGL.
+        """
+
+        self.composite_layers = value
+
+    def set_idle_background(self, color):
+        """
+        Sets the monochrome color of the background when there is no stimulus being displayed (sometimes called the
+        interleave period).
+        """
+
+        self.idle_background = color
+
+    def set_global_fly_pos(self, x, y, z):
+        self.global_fly_pos = np.array([x, y, z], dtype=float)
+
+    def set_global_theta_offset(self, value):
+        self.global_theta_offset = radians(value)
+
+    def set_global_phi_offset(self, value):
+        self.global_phi_offset = radians(value)
+
+    def set_shared_pose(self, name=None):
+        """
+        Attaches to a flystim.shm.SharedPose block, which is then read at the start of every frame to set the global
+        theta offset, phi offset and fly position.  This avoids one RPC call per closed-loop update.
+        :param name: Name of the shared memory block, or None to stop using shared memory.
+        """
+
+        if self.shared_pose is not None:
+            self.shared_pose.close()
+            self.shared_pose = None
+
+        if name is not None:
+            # shared memory needs Python 3.8+, so it is only imported when used
+            from flystim.shm import SharedPose
+
+            self.shared_pose = SharedPose(name=name)
+
+    def set_frame_listener(self, host=None, port=None):
+        """
+        Sets the UDP address that frame events are sent to.  After a frame is drawn following a call to mark_frame,
+        a small JSON datagram with the screen name, the mark and the time of the frame is sent to this address.
+        :param host: Host of the listener, or None to stop sending frame events.
+        """
+
+        if host is None:
+            self.frame_listener = None
+            if self.frame_socket is not None:
+                self.frame_socket.close()
+                self.frame_socket = None
+            return
+
+        if self.frame_socket is None:
+            self.frame_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.frame_socket.setblocking(False)
+
+        self.frame_listener = (host, port)
+
+    def mark_frame(self, mark):
+        """
+        Requests a frame event for the next frame that is drawn.  Since commands are processed in order before each
+        frame, the event means that every command sent before this one is visible on the screen.
+        :param mark: Number identifying the request, which is sent back with the event.
+        """
+
+        self.pending_mark = mark
+
+    def print_startup_report(self):
+        """
+        Prints the time taken by each step of starting up this screen process.
+        """
+
+        print('*** startup: ' + self.screen.name + ' ***')
+        print(startup_timer.format_report())
+        print()
+
+    def save_startup_report(self, file_name):
+        """
+        Saves the startup timing report of this screen process as JSON.
+        """
+
+        startup_timer.save_report(file_name)
+
+    def start_capture(self, file_name, fps=120, n_buffers=3):
+        """
+        Starts writing every displayed frame to a file, either a zip archive of frames (.zip) or a video file (other
+        extensions; requires imageio).  Frames are read back asynchronously and written by a separate thread, so
+        capturing does not stall rendering.  If the file cannot be written fast enough, frames are dropped instead;
+        the number of dropped frames is printed by stop_capture, and can be seen from gaps in the frame numbers.
+        :param file_name: Name of the file to be written
+        :param fps: Frame rate of video files
+        :param n_buffers: Number of pixel buffers used for readback.  Frames are written n_buffers-1 frames late.
+        """
+
+        self.stop_capture()
+        self.capture_settings = {'file_name': file_name, 'fps': fps, 'n_buffers': n_buffers}
+
+    def stop_capture(self):
+        """
+        Stops capturing frames, and finishes writing the file.
+        """
+
+        if self.frame_capture is not None:
+            try:
+                self.frame_capture.close()
+            finally:
+                self.capture_output.close()
+
+            # frames are dropped rather than stalling the display if the file cannot be written fast enough
+            self.capture_dropped_count = self.frame_capture.dropped_count
+            if self.capture_dropped_count > 0:
+                print('*** capture: {} of {} frames dropped ***'.format(self.capture_dropped_count,
+                                                                       self.frame_capture.frame_count))
+
+        self.capture_settings = None
+        self.frame_capture = None
+        self.capture_output = None
+
+    def set_save_path(self, save_path):
+        self.save_path = save_path
+
+    def set_save_prefix(self, save_prefix):
+        self.save_prefix = save_prefix
+
+    def start_saving_history(self):
+        if self.save_history_flag:
+            self.square_history = np.zeros(self.estimated_n_frames)
+            self.time_history = np.zeros(self.estimated_n_frames)
+            self.stim_time_history = np.zeros(self.estimated_n_frames)
+            self.global_theta_offset_history = np.zeros(self.estimated_n_frames)
+            # self.global_fly_posx_history = np.zeros(self.estimated_n_frames)
+            # self.global_fly_posy_history = np.zeros(self.estimated_n_frames)
+            #self.global_fly_posz_history = np.zeros(self.estimated_n_frames)
+            #self.global_phi_offset_history = np.zeros(self.estimated_n_frames)
+
+        self.saved_frame_count = 0
+        self.saving_history = True
+
+    def stop_saving_history(self):
+        self.saving_history = False
+
+    def set_save_history_params(self, save_history_flag=True, save_path="", save_prefix="", fs_frame_rate_estimate=120, save_duration=65,
+                                save_format='txt'):
+        """
+        :param save_format: 'txt' to save the history of each trial as text files named after the save prefix, or 'h5'
+        to write it to a group named after the save prefix in one HDF5 file per screen (see flystim.session)
+        """
+
+        self.save_history_flag = save_history_flag
+        if save_history_flag:
+            self.save_path = save_path
+            self.save_prefix = save_prefix
+            self.save_format = save_format
+            self.estimated_n_frames = int(np.ceil(fs_frame_rate_estimate * save_duration * 1.1))
+            self.square_history = []
+            self.time_history = []
+            self.stim_time_history = []
+            self.global_theta_offset_history = []
+            # self.global_fly_posx_history = []
+            # self.global_fly_posy_history = []
+            #self.global_fly_posz_history = []
+            #self.global_phi_offset_history = []
+
+    def save_history(self):
+        self.square_history = self.square_history[:self.saved_frame_count]
+        self.time_history = self.time_history[:self.saved_frame_count]
+        self.stim_time_history = self.stim_time_history[:self.saved_frame_count]
+        self.global_theta_offset_history = self.global_theta_offset_history[:self.saved_frame_count]
+        # self.global_fly_posx_history = self.global_fly_posx_history[:self.saved_frame_count]
+        # self.global_fly_posy_history = self.global_fly_posy_history[:self.saved_frame_count]
+
+        if self.save_format == 'h5':
+            self.save_history_h5()
+            return
+
+        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_square.txt', np.array(self.square_history), fmt='%i', delimiter='\n')
+        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_timestamps.txt', np.array(self.time_history), delimiter='\n')
+        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_stim_timestamps.txt', np.array(self.stim_time_history), delimiter='\n')
+        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_theta.txt', np.array(self.global_theta_offset_history), delimiter='\n')
+        # np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_posx.txt', np.array(self.global_fly_posx_history), delimiter='\n')
+        # np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_posy.txt', np.array(self.global_fly_posy_history), delimiter='\n')
+        #np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_fly_posz.txt', np.array(self.global_fly_posz_history), delimiter='\n')
+        #np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_phi_offset.txt', np.array(self.global_phi_offset_history), delimiter='\n')
+
+    def save_history_h5(self):
+        # the history is written by a background thread, so that saving does not interrupt the display
+        file_name = history_file_name(self.save_path, self.screen.name)
+        if self.history_writer is None or self.history_writer.file_name != file_name:
+            if self.history_writer is not None:
+                self.history_writer.close()
+            # the file is written once per trial and only opened for each write, so that the experiment can link to it
+            # during the session and read it afterwards
+            self.history_writer = SessionWriter(file_name, keep_open=False)
+
+        self.history_writer.start_trial(name=self.save_prefix, n_frames=self.saved_frame_count)
+        self.history_writer.write('fs_square', np.array(self.square_history, dtype=int))
+        self.history_writer.write('fs_timestamps', np.array(self.time_history))
+        self.history_writer.write('fs_stim_timestamps', np.array(self.stim_time_history))
+        self.history_writer.write('fs_theta', np.array(self.global_theta_offset_history))
+
+    def close_history(self):
+        """
+        Finishes writing the display history saved in HDF5 format and closes its file.  Called when the display exits.
+        """
+
+        if self.history_writer is not None:
+            self.history_writer.close()
+            self.history_writer = None
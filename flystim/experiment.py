@@ -0,0 +1,243 @@
+# Event-driven runner for closed-loop experiments.  Instead of spinning on time() while polling the FicTrac socket, the
+# runner waits on all sensor sockets and a timer at once with a selector (epoll on Linux), so the process sleeps until
+# either data arrives or the next scheduled event is due, and the render processes get the CPU.  Deadlines are met
+# with a timerfd where Python supports it (3.13+ on Linux), and otherwise with a selector timeout followed by a short
+# time.sleep, which uses clock_nanosleep on Linux.  Trials, inter-trial intervals, and the recording and saving of the
+# display history are scheduled by run_trials, e.g.:
+#
+# runner = ExperimentRunner()
+# runner.add_socket(fictrac_sock, fictrac_reader.feed)
+# trials = runner.run_trials(n_trials, stim_duration=10, iti=5, start_trial=load_trial, manager=manager,
+#                            save_history=True, save_prefix=save_prefix)
+
+import os
+import heapq
+import selectors
+
+from itertools import count
+from time import time, monotonic, sleep
+
+# without a timerfd, the selector wakes up this long before a deadline, and the rest is slept precisely (seconds)
+SLEEP_MARGIN = 2e-3
+
+
+class Timer:
+    """
+    timerfd that becomes readable at a given value of time.monotonic(), so that deadlines wake up a selector.
+    """
+
+    def __init__(self):
+        from time import CLOCK_MONOTONIC
+
+        self.fd = os.timerfd_create(CLOCK_MONOTONIC, flags=os.TFD_NONBLOCK | os.TFD_CLOEXEC)
+
+    @staticmethod
+    def is_available():
+        return hasattr(os, 'timerfd_create')
+
+    def arm(self, deadline):
+        # a deadline of zero would disarm the timer
+        os.timerfd_settime(self.fd, flags=os.TFD_TIMER_ABSTIME, initial=max(deadline, 1e-9))
+
+    def clear(self):
+        try:
+            os.read(self.fd, 8)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LineReader:
+    """
+    Splits the data received from a stream or datagram socket into complete lines, e.g. the lines that FicTrac sends
+    over UDP, which may be split across datagrams.
+    """
+
+    def __init__(self, handle_line, prefix=None):
+        """
+        :param handle_line: called with each complete line (without the line break)
+        :param prefix: if given, data before the last occurrence of this prefix in a line is dropped (e.g., 'FT')
+        """
+
+        self.handle_line = handle_line
+        self.prefix = prefix
+        self.buffer = ''
+
+    def feed(self, data):
+        lines = (self.buffer + data.decode('utf-8')).split('\n')
+        self.buffer = lines.pop()
+
+        for line in lines:
+            if self.prefix is not None:
+                start = line.rfind(self.prefix)
+                if start == -1:
+                    continue
+                line = line[start:]
+
+            self.handle_line(line)
+
+
+class ExperimentRunner:
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+
+        # scheduled callbacks, as (deadline, order, callback), where the deadline is a value of time.monotonic()
+        self.scheduled = []
+        self.order = count()
+
+        self.timer = None
+        if Timer.is_available():
+            self.timer = Timer()
+            self.selector.register(self.timer.fd, selectors.EVENT_READ, None)
+
+    def add_reader(self, fileobj, callback):
+        """
+        Calls callback() whenever fileobj (e.g., a socket) has data to read.
+        """
+
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def add_socket(self, sock, handle_data, bufsize=4096):
+        """
+        Reads everything that a socket has received whenever it becomes readable, and passes each chunk of data to
+        handle_data.  The socket is made non-blocking.
+        """
+
+        sock.setblocking(False)
+
+        def drain():
+            while True:
+                try:
+                    data = sock.recv(bufsize)
+                except (BlockingIOError, InterruptedError):
+                    return
+                if not data:
+                    return
+                handle_data(data)
+
+        self.add_reader(sock, drain)
+
+    def remove_reader(self, fileobj):
+        self.selector.unregister(fileobj)
+
+    def call_at(self, deadline, callback):
+        """
+        Schedules callback() at the given value of time.monotonic().
+        """
+
+        heapq.heappush(self.scheduled, (deadline, next(self.order), callback))
+
+    def call_later(self, delay, callback):
+        self.call_at(monotonic() + delay, callback)
+
+    def wait_until(self, deadline):
+        """
+        Handles sensor data and scheduled callbacks until the given value of time.monotonic().
+        """
+
+        while True:
+            now = monotonic()
+
+            # run the callbacks that are due
+            while self.scheduled and self.scheduled[0][0] <= now:
+                _, _, callback = heapq.heappop(self.scheduled)
+                callback()
+                now = monotonic()
+
+            if now >= deadline:
+                return
+
+            wake_up = min(deadline, self.scheduled[0][0]) if self.scheduled else deadline
+
+            if self.timer is not None:
+                self.timer.arm(wake_up)
+                events = self.selector.select()
+            elif wake_up - now > SLEEP_MARGIN:
+                events = self.selector.select(wake_up - now - SLEEP_MARGIN)
+            else:
+                # the selector timeout is only accurate to about a millisecond, so the last bit is slept instead
+                sleep(wake_up - now)
+                events = self.selector.select(0)
+
+            for key, _ in events:
+                if key.data is None:
+                    self.timer.clear()
+                else:
+                    key.data()
+
+    def wait(self, duration):
+        self.wait_until(monotonic() + duration)
+
+    def run_trials(self, n_trials, stim_duration, iti, start_trial, end_trial=None, manager=None, save_history=False,
+                   save_prefix='', session=None, history_saved=None):
+        """
+        Runs a sequence of trials.  Each trial is preceded and followed by half of the inter-trial interval, and the
+        display history is recorded from the middle of the interval before the trial to the middle of the interval
+        after it, as in the ballrig examples.
+        :param start_trial: called with the trial number before the stimulus starts, e.g. to load the stimulus
+        :param end_trial: called with the trial number after the stimulus stops (optional)
+        :param manager: client returned by launch_stim_server, used to start and stop the stimulus and the history.
+        If None, start_trial and end_trial are responsible for both.
+        :param save_history: if True, the display history of trial t is saved with the prefix save_prefix + '_t{t:03}'
+        :param session: flystim.session.SessionWriter (optional).  A trial group is started before start_trial is
+        called, so that data appended during the trial and the following inter-trial interval goes to it, and the start
+        and end time of the trial are added to its attributes.
+        :param history_saved: called with the trial number and save prefix after the display history of a trial is
+        saved (optional), e.g. to link the history into the session with SessionWriter.link_history
+        :return: list with the start and end time (time.time()) of each trial
+        """
+
+        trials = []
+
+        # pretend that the previous trial ended now
+        iti_start = monotonic()
+
+        for t in range(n_trials):
+            self.wait_until(iti_start + iti/2)
+            if save_history:
+                manager.start_saving_history()
+
+            self.wait_until(iti_start + iti)
+            if session is not None:
+                session.start_trial()
+            start_trial(t)
+
+            if manager is not None:
+                manager.start_stim()
+            trial_start = monotonic()
+            start_time = time()
+
+            self.wait_until(trial_start + stim_duration)
+
+            if manager is not None:
+                manager.stop_stim()
+            iti_start = monotonic()
+            end_time = time()
+
+            if session is not None:
+                session.end_trial(start_time=start_time, end_time=end_time)
+
+            if end_trial is not None:
+                end_trial(t)
+
+            self.wait_until(iti_start + iti/2)
+            if save_history:
+                manager.stop_saving_history()
+                manager.set_save_prefix(save_prefix + '_t{:03}'.format(t))
+                manager.save_history()
+                if history_saved is not None:
+                    history_saved(t, save_prefix + '_t{:03}'.format(t))
+
+            trials.append({'start_time': start_time, 'end_time': end_time})
+
+        # second half of the last inter-trial interval
+        self.wait_until(iti_start + iti)
+
+        return trials
+
+    def close(self):
+        self.selector.close()
+        if self.timer is not None:
+            self.timer.close()
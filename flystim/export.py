@@ -0,0 +1,173 @@
+# Offline export of the frames shown during an experiment.  The stimuli of each trial are replayed through the
+# headless renderer using the display history saved by StimDisplay (see StimEngine.save_history), so that the frames
+# seen by the fly can be reconstructed after the fact without capturing the screens online.
+#
+# A session is described by a JSON file of the form:
+#
+# {
+#     "screens": [<Screen.serialize() output>, ...],
+#     "trials": [
+#         {
+#             "stims": [{"name": "MovingPatch", "kwargs": {"trajectory": ..., "background": 0.5}}, ...],
+#             "save_path": "/path/to/data",
+#             "save_prefix": "trial_001"
+#         },
+#         ...
+#     ],
+#     "trajectories": {"coh_r_0": <RectangleTrajectory.to_dict() output>, ...}
+# }
+#
+# where "save_path" and "save_prefix" are the values passed to set_save_history_params for that trial.  Stimuli that
+# were loaded with the name of a trajectory uploaded with upload_trajectory (e.g. by flystim.trials.TrialStructure)
+# need that trajectory in "trajectories", which is uploaded to the headless display before the trials are replayed.
+
+import os
+import json
+import numpy as np
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+from flystim.capture import FrameCapture, open_output
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.session import history_file_name
+from flystim.wire import decode
+
+
+def load_history(save_path, save_prefix, screen_name=None):
+    """
+    Loads the display history of one trial, as saved by StimEngine.save_history in either format.
+    :param screen_name: name of the screen, which is needed to find histories saved in HDF5 format
+    :return: dictionary with the arrays 'square', 'time', 'stim_time' and 'theta' (in radians), one entry per frame
+    """
+
+    # histories saved with save_format='h5' are in one file per screen, with a group per trial
+    if screen_name is not None:
+        file_name = history_file_name(save_path, screen_name)
+        if os.path.exists(file_name):
+            import h5py
+
+            with h5py.File(file_name, 'r') as f:
+                group = f.get('trials/' + save_prefix)
+                if group is not None:
+                    return {'square': group['fs_square'][:],
+                            'time': group['fs_timestamps'][:],
+                            'stim_time': group['fs_stim_timestamps'][:],
+                            'theta': group['fs_theta'][:]}
+
+    def load(suffix):
+        return np.atleast_1d(np.loadtxt(os.path.join(save_path, save_prefix + suffix), ndmin=1))
+
+    return {'square': load('_fs_square.txt'),
+            'time': load('_fs_timestamps.txt'),
+            'stim_time': load('_fs_stim_timestamps.txt'),
+            'theta': load('_fs_theta.txt')}
+
+
+def replay_trial(display, stims, history, capture, trial=0):
+    """
+    Renders the frames of one trial and passes them to a FrameCapture.
+    :param display: HeadlessStimDisplay for the screen being exported
+    :param stims: list of {'name': ..., 'kwargs': ...} dictionaries, in the order that the stimuli were loaded.  Any
+    trajectory referred to by name must already be uploaded to the display (see export_session).
+    :param history: display history of the trial (see load_history)
+    :param capture: FrameCapture that receives the rendered frames
+    :param trial: trial number, recorded with each frame
+    """
+
+    # load the stimuli as they were loaded during the experiment
+    display.stop_stim(print_profile=False)
+    for stim in stims:
+        display.load_stim(stim['name'], hold=True, **stim.get('kwargs', {}))
+    stim_list = display.stim_list
+
+    # the recorded stimulus time is used directly as the time of each frame
+    display.stim_paused = False
+    display.stim_start_time = 0
+
+    # the corner square is set to the recorded color on every frame
+    display.stop_corner_square()
+
+    for k in range(len(history['time'])):
+        stim_time = history['stim_time'][k]
+
+        # frames without a stimulus show the idle background
+        display.stim_list = [] if np.isnan(stim_time) else stim_list
+        display.global_theta_offset = history['theta'][k]
+        display.square_program.color = history['square'][k]
+
+        display.paint(t=0 if np.isnan(stim_time) else stim_time)
+        capture.capture(fbo=display.fbo, info={'trial': trial, 'frame': k, 'time': history['time'][k]})
+
+    display.stop_stim(print_profile=False)
+
+
+def export_session(session, output_dir, width=512, height=512, ext='.zip', fps=120, backend=None, verbose=True):
+    """
+    Exports the frames of every trial of a session, writing one file per screen.
+    :param session: session description (see the top of this file), or the name of a JSON file containing it
+    :param output_dir: directory where the exported files are written, named after each screen
+    :param ext: '.zip' for a frame archive, or a video extension such as '.mp4'
+    :return: list of the names of the files written
+    """
+
+    if isinstance(session, str):
+        with open(session, 'r') as f:
+            session = json.load(f)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    file_names = []
+    for screen_data in session['screens']:
+        screen = Screen.deserialize(screen_data)
+        file_name = os.path.join(output_dir, screen.name + ext)
+
+        histories = [load_history(trial['save_path'], trial['save_prefix'], screen_name=screen.name)
+                     for trial in session['trials']]
+
+        display = HeadlessStimDisplay(screen=screen, width=width, height=height, backend=backend)
+        for trajectory_id, trajectory in session.get('trajectories', {}).items():
+            display.upload_trajectory(trajectory_id, decode(trajectory))
+
+        output = open_output(file_name, fps=fps)
+
+        # frames are read back asynchronously and compressed by a writer thread while the next frames are rendered.
+        # rendering waits for the writer if it falls behind, so that every frame is exported.
+        capture = FrameCapture(display.ctx, size=display.size, callback=output.write, block=True)
+
+        start = perf_counter()
+        try:
+            for k, (trial, history) in enumerate(zip(session['trials'], histories)):
+                replay_trial(display, stims=trial['stims'], history=history, capture=capture, trial=k)
+        finally:
+            capture.close()
+            output.close()
+            display.release()
+
+        if verbose:
+            duration = perf_counter() - start
+            print('{}: {} frames in {:.1f} s ({:.1f} fps)'.format(file_name, capture.frame_count, duration,
+                                                                  capture.frame_count/duration))
+
+        file_names.append(file_name)
+
+    return file_names
+
+
+def main():
+    parser = ArgumentParser(description='Replays the stimuli of a session and exports the frames shown on each screen.')
+    parser.add_argument('session', help='JSON file describing the screens and trials of the session')
+    parser.add_argument('output_dir', help='Directory where the exported frames are written')
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--format', default='zip', help='zip (frame archive) or a video format such as mp4')
+    parser.add_argument('--fps', type=float, default=120, help='Frame rate of exported videos')
+    args = parser.parse_args()
+
+    export_session(args.session, args.output_dir, width=args.width, height=args.height, ext='.' + args.format,
+                   fps=args.fps)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,28 @@
-from PyQt5 import QtOpenGL, QtWidgets
+from flystim.startup import startup_timer
+
+with startup_timer.step('import PyQt5'):
+    from PyQt5 import QtOpenGL, QtWidgets
 
-import time
 import sys
 import signal
-import moderngl
-import numpy as np
-import pandas as pd
 import platform
-import os
-import math
 
-from flystim.stimuli import ContrastReversingGrating, RotatingBars, ExpandingEdges, RandomBars, SequentialBars, SineGrating, RandomGrid
-from flystim.stimuli import Checkerboard, MovingPatch, ConstantBackground, ArbitraryGrid
-from flystim.square import SquareProgram
-from flystim.screen import Screen
-from math import radians
+with startup_timer.step('import moderngl'):
+    import moderngl
+
+with startup_timer.step('import flystim stimuli'):
+    from flystim.engine import StimEngine
+    from flystim.screen import Screen
 
-from flyrpc.transceiver import MySocketServer
-from flyrpc.util import get_kwargs
+with startup_timer.step('import flyrpc'):
+    from flyrpc.transceiver import MySocketServer
+    from flyrpc.util import get_kwargs
 
 class StimDisplay(QtOpenGL.QGLWidget):
     """
-    Class that controls the stimulus display on one screen.  It contains the pyglet window object for that screen,
-    and also controls rendering of the stimulus, toggling corner square, and/or debug information.
+    Class that controls the stimulus display on one screen.  It contains the Qt window object for that screen, and
+    draws into it with a StimEngine, which controls rendering of the stimulus, toggling corner square, and/or debug
+    information.
     """
 
     def __init__(self, screen, server, app):
@@ -42,65 +42,18 @@ class StimDisplay(QtOpenGL.QGLWidget):
             self.move(rectScreen.left(), rectScreen.top())
             self.resize(rectScreen.width(), rectScreen.height())
 
-        # stimulus initialization
-        self.stim_list = []
-
-        # stimulus state
-        self.stim_paused = True
-        self.stim_start_time = None
-        self.stim_offset_time = 0
-
-        # profiling information
-        self.profile_frame_count = None
-        self.profile_start_time = None
-        self.profile_last_time = None
-        self.profile_frame_times = None
-
         # save handles to screen and server
         self.screen = screen
         self.server = server
         self.app = app
 
-        # make OpenGL programs that are used by stimuli
-        cls_list = [ContrastReversingGrating, RotatingBars, ExpandingEdges, RandomBars, SequentialBars, SineGrating, RandomGrid,
-                    MovingPatch, Checkerboard, ConstantBackground, ArbitraryGrid]
-        self.render_programs = {cls.__name__: cls(screen=screen) for cls in cls_list}
-
-        # make program for rendering the corner square
-        self.square_program = SquareProgram(screen=screen)
-
-        # initialize background color
-        self.idle_background = 0.5
-
-        # set the closed-loop parameters
-        self.global_theta_offset = 0
-        self.global_phi_offset = 0
-        self.global_fly_pos = np.array([0, 0, 0], dtype=float)
-
-        # save history for behavior analysis and stim-behavior alignment
-        self.save_history_flag = False
-        self.saving_history = False
-        self.saved_frame_count = None
-
+        # create the engine that holds the stimulus state and does the rendering
+        self.engine = StimEngine(screen=screen)
 
     def initializeGL(self):
-        # get OpenGL context
-        self.ctx = moderngl.create_context()
-
-        # initialize stimuli programs
-        for render_program in self.render_programs.values():
-            render_program.initialize(self.ctx)
-
-        # initialize square program
-        self.square_program.initialize(self.ctx)
-
-    def get_stim_time(self, t):
-        stim_time = self.stim_offset_time
-
-        if not self.stim_paused:
-            stim_time += t - self.stim_start_time
-
-        return stim_time
+        with startup_timer.step('initialize OpenGL'):
+            # get OpenGL context and initialize the engine with it
+            self.engine.initialize_gl(moderngl.create_context())
 
     def paintGL(self):
         # quit if desired
@@ -110,277 +63,16 @@ class StimDisplay(QtOpenGL.QGLWidget):
         # handle RPC input
         self.server.process_queue()
 
-        # set the viewport to fill the window
+        # draw the frame, with the viewport filling the window
         # ref: https://github.com/pyqtgraph/pyqtgraph/issues/422
-        self.ctx.viewport = (0, 0, self.width()*self.devicePixelRatio(), self.height()*self.devicePixelRatio())
-
-        t = time.time()
-
-        # draw the stimulus
-        if self.stim_list:
-
-            stim_time = self.get_stim_time(t)
-            self.ctx.clear(0, 0, 0, 1)
-            self.ctx.enable(moderngl.BLEND)
-
-            for stim, config_options in self.stim_list:
-                stim.apply_config_options(config_options)
-                # theta + 90degrees because 90 is directly in front of the animal and this allows stimulus definition to use 0 as in front of the animal.
-                # theta mod 360deg - 360deg keeps the extreme theta values on screen. Flystim seems to not handle extreme theta values well.
-                stim.paint_at(stim_time, global_fly_pos=self.global_fly_pos,
-                              global_theta_offset=(self.global_theta_offset+math.pi/2) % (2*math.pi) - 2*math.pi,
-                              global_phi_offset=self.global_phi_offset)
-
-            if self.profile_frame_count is not None:
-                self.profile_frame_count += 1
-
-        else:
-            self.ctx.clear(self.idle_background, self.idle_background, self.idle_background, 1.0)
-
-        # Save data...
-        # Save stim_time AND global positions and offsets
-        if self.save_history_flag and self.saving_history:
-            self.square_history[self.saved_frame_count] = int(self.square_program.color) #stim_time
-            self.time_history[self.saved_frame_count] = t
-            self.stim_time_history[self.saved_frame_count] = np.nan if not self.stim_list else stim_time
-            self.global_theta_offset_history[self.saved_frame_count] = self.global_theta_offset
-            # self.global_fly_posx_history[self.saved_frame_count] = self.global_fly_pos[0]
-            # self.global_fly_posy_history[self.saved_frame_count] = self.global_fly_pos[1]
-            #self.global_fly_posz_history[self.saved_frame_count] = self.global_fly_pos[2]
-            #self.global_phi_offset_history[self.saved_frame_count] = self.global_phi_offset
-
-            self.saved_frame_count += 1
-
-
-        # draw the corner square
-        self.square_program.paint() #must come after saving history to match length??
+        self.engine.render(viewport=(0, 0, self.width()*self.devicePixelRatio(), self.height()*self.devicePixelRatio()))
 
         # update the window
         self.update()
 
-    ###########################################
-    # control functions
-    ###########################################
-
-    def update_stim(self, t, rate=None, color=None, background=None):
-        for stim, config_options in self.stim_list:
-            if isinstance(stim, (SineGrating, RotatingBars)):
-                # get the time that will be passed to the stimulus
-                t = self.get_stim_time(t)
-
-                # get the spatial period, rate, and offset (in degrees)
-                period = config_options.kwargs.get('period', 20)
-                old_rate = config_options.kwargs.get('rate', 10)
-                old_offset = config_options.kwargs.get('offset', 0)
-
-                # set the new rate and offset
-                if rate is not None:
-                    config_options.kwargs['rate'] = rate
-                    config_options.kwargs['offset'] = (rate - old_rate) * (360 / period) * t + old_offset
-
-                if color is not None:
-                    config_options.kwargs['color'] = color
-                if background is not None:
-                    config_options.kwargs['background'] = background
-
-
-    def load_stim(self, name, hold=False, *args, **kwargs):
-        """
-        Loads the stimulus with the given name, using the given params.  After the stimulus is loaded, the
-        background color is changed to the one specified in the stimulus, and the stimulus is evaluated at time 0.
-        :param name: Name of the stimulus (should be a class name)
-        """
-
-        if hold is False:
-            self.stim_list = []
-            self.stim_offset_time = 0
-
-        stim = self.render_programs[name]
-        config_options = stim.make_config_options(*args, **kwargs)
-
-        self.stim_list.append((stim, config_options))
-
-    def start_stim(self, t):
-        """
-        Starts the stimulus animation, using the given time as t=0
-        :param t: Time corresponding to t=0 of the animation
-        """
-        self.profile_frame_count = 0
-        self.profile_start_time = time.time()
-
-        self.profile_last_time = None
-        self.profile_frame_times = []
-
-        self.stim_paused = False
-        self.stim_start_time = t
-
-
-    def pause_stim(self, t):
-        self.stim_paused = True
-        self.stim_offset_time = t - self.stim_start_time + self.stim_offset_time
-        self.stim_start_time = t
-
-    def stop_stim(self, print_profile = True):
-        """
-        Stops the stimulus animation and removes it from the display.
-        """
-
-        # print profiling information if applicable
-
-        if ((self.profile_frame_count is not None) and
-            (self.profile_start_time is not None) and
-            (self.stim_list)):
-
-            profile_duration = time.time() - self.profile_start_time
-
-            # filter out frame times of duration zero
-            fps_data = np.array(self.profile_frame_times)
-            fps_data = fps_data[fps_data != 0]
-
-            if len(fps_data) > 0:
-                fps_data = pd.Series(1.0/fps_data)
-                stim_names = ', '.join([type(stim).__name__ for stim, _ in self.stim_list])
-                if print_profile:
-                    print('*** ' + stim_names + ' ***')
-                    print(fps_data.describe(percentiles=[0.01, 0.05, 0.1, 0.9, 0.95, 0.99]))
-                    print()
-
-        # reset stim variables
-
-        self.stim_list = []
-        self.stim_offset_time = 0
-
-        self.stim_paused = True
-        self.stim_start_time = None
-
-        self.profile_frame_count = None
-        self.profile_start_time = None
-
-        self.profile_last_time = None
-        self.profile_frame_times = None
-
-    def start_corner_square(self):
-        """
-        Start toggling the corner square.
-        """
-
-        self.square_program.toggle = True
-
-    def stop_corner_square(self):
-        """
-        Stop toggling the corner square.
-        """
-
-        self.square_program.toggle = False
-
-    def white_corner_square(self):
-        """
-        Stop the corner square from toggling, then make it white.
-        """
-
-        self.set_corner_square(1.0)
-
-    def black_corner_square(self):
-        """
-        Stop the corner square from toggling, then make it black.
-        """
-
-        self.set_corner_square(0.0)
-
-    def set_corner_square(self, color):
-        """
-        Stop the corner square from toggling, then set it to the desired color.
-        """
-
-        self.stop_corner_square()
-        self.square_program.color = color
-
-    def show_corner_square(self):
-        """
-        Show the corner square.
-        """
-
-        self.square_program.draw = True
-
-    def hide_corner_square(self):
-        """
-        Hide the corner square.  Note that it will continue to toggle if self.should_toggle_square is True,
-        even though nothing will be displayed.
-        """
-
-        self.square_program.draw = False
-
-    def set_idle_background(self, color):
-        """
-        Sets the monochrome color of the background when there is no stimulus being displayed (sometimes called the
-        interleave period).
-        """
-
-        self.idle_background = color
-
-    def set_global_fly_pos(self, x, y, z):
-        self.global_fly_pos = np.array([x, y, z], dtype=float)
-
-    def set_global_theta_offset(self, value):
-        self.global_theta_offset = radians(value)
-
-    def set_global_phi_offset(self, value):
-        self.global_phi_offset = radians(value)
-
-    def set_save_path(self, save_path):
-        self.save_path = save_path
-
-    def set_save_prefix(self, save_prefix):
-        self.save_prefix = save_prefix
-
-    def start_saving_history(self):
-        if self.save_history_flag:
-            self.square_history = np.zeros(self.estimated_n_frames)
-            self.time_history = np.zeros(self.estimated_n_frames)
-            self.stim_time_history = np.zeros(self.estimated_n_frames)
-            self.global_theta_offset_history = np.zeros(self.estimated_n_frames)
-            # self.global_fly_posx_history = np.zeros(self.estimated_n_frames)
-            # self.global_fly_posy_history = np.zeros(self.estimated_n_frames)
-            #self.global_fly_posz_history = np.zeros(self.estimated_n_frames)
-            #self.global_phi_offset_history = np.zeros(self.estimated_n_frames)
-
-        self.saved_frame_count = 0
-        self.saving_history = True
-
-    def stop_saving_history(self):
-        self.saving_history = False
-
-    def set_save_history_params(self, save_history_flag=True, save_path="", save_prefix="", fs_frame_rate_estimate=120, save_duration=65):
-        self.save_history_flag = save_history_flag
-        if save_history_flag:
-            self.save_path = save_path
-            self.save_prefix = save_prefix
-            self.estimated_n_frames = int(np.ceil(fs_frame_rate_estimate * save_duration * 1.1))
-            self.square_history = []
-            self.time_history = []
-            self.stim_time_history = []
-            self.global_theta_offset_history = []
-            # self.global_fly_posx_history = []
-            # self.global_fly_posy_history = []
-            #self.global_fly_posz_history = []
-            #self.global_phi_offset_history = []
-
-    def save_history(self):
-        self.square_history = self.square_history[:self.saved_frame_count]
-        self.time_history = self.time_history[:self.saved_frame_count]
-        self.stim_time_history = self.stim_time_history[:self.saved_frame_count]
-        self.global_theta_offset_history = self.global_theta_offset_history[:self.saved_frame_count]
-        # self.global_fly_posx_history = self.global_fly_posx_history[:self.saved_frame_count]
-        # self.global_fly_posy_history = self.global_fly_posy_history[:self.saved_frame_count]
-
-        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_square.txt', np.array(self.square_history), fmt='%i', delimiter='\n')
-        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_timestamps.txt', np.array(self.time_history), delimiter='\n')
-        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_stim_timestamps.txt', np.array(self.stim_time_history), delimiter='\n')
-        np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_theta.txt', np.array(self.global_theta_offset_history), delimiter='\n')
-        # np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_posx.txt', np.array(self.global_fly_posx_history), delimiter='\n')
-        # np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_posy.txt', np.array(self.global_fly_posy_history), delimiter='\n')
-        #np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_fly_posz.txt', np.array(self.global_fly_posz_history), delimiter='\n')
-        #np.savetxt(self.save_path+os.path.sep+self.save_prefix+'_fs_phi_offset.txt', np.array(self.global_phi_offset_history), delimiter='\n')
+        # note when the first frame has been drawn
+        if not startup_timer.has_mark('first frame'):
+            startup_timer.mark('first frame')
 
 def make_qt_format(vsync):
     """
@@ -419,38 +111,20 @@ def main():
     screen = Screen.deserialize(kwargs.get('screen', {}))
 
     # launch the server
-    server = MySocketServer(host=kwargs['host'], port=kwargs['port'], threaded=True, auto_stop=True, name=screen.name)
+    with startup_timer.step('launch RPC server'):
+        server = MySocketServer(host=kwargs['host'], port=kwargs['port'], threaded=True, auto_stop=True, name=screen.name)
 
     # launch application
-    app = QtWidgets.QApplication([])
+    with startup_timer.step('create QApplication'):
+        app = QtWidgets.QApplication([])
 
     # create the StimDisplay object
-    screen = Screen.deserialize(kwargs.get('screen', {}))
-    stim_display = StimDisplay(screen=screen, server=server, app=app)
+    with startup_timer.step('create StimDisplay'):
+        screen = Screen.deserialize(kwargs.get('screen', {}))
+        stim_display = StimDisplay(screen=screen, server=server, app=app)
 
     # register functions
-    server.register_function(stim_display.load_stim)
-    server.register_function(stim_display.start_stim)
-    server.register_function(stim_display.stop_stim)
-    server.register_function(stim_display.pause_stim)
-    server.register_function(stim_display.update_stim)
-    server.register_function(stim_display.start_corner_square)
-    server.register_function(stim_display.stop_corner_square)
-    server.register_function(stim_display.white_corner_square)
-    server.register_function(stim_display.black_corner_square)
-    server.register_function(stim_display.set_corner_square)
-    server.register_function(stim_display.show_corner_square)
-    server.register_function(stim_display.hide_corner_square)
-    server.register_function(stim_display.set_idle_background)
-    server.register_function(stim_display.set_global_fly_pos)
-    server.register_function(stim_display.set_global_theta_offset)
-    server.register_function(stim_display.set_global_phi_offset)
-    server.register_function(stim_display.set_save_path)
-    server.register_function(stim_display.set_save_prefix)
-    server.register_function(stim_display.set_save_history_params)
-    server.register_function(stim_display.save_history)
-    server.register_function(stim_display.start_saving_history)
-    server.register_function(stim_display.stop_saving_history)
+    stim_display.engine.register_functions(server)
 
     # display the stimulus
     if screen.fullscreen:
@@ -465,7 +139,12 @@ def main():
     # Use Ctrl+C to exit.
     # ref: https://stackoverflow.com/questions/2300401/qapplication-how-to-shutdown-gracefully-on-ctrl-c
     signal.signal(signal.SIGINT, signal.SIG_DFL)
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+
+    # finish writing the display history
+    stim_display.engine.close_history()
+
+    sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,177 @@
+# Caches for OpenGL objects that are expensive to create and can be shared between stimuli drawn with the same
+# ModernGL context.  Programs are keyed by a hash of their generated GLSL source, so two stimuli whose shaders are
+# textually identical only compile once per context.
+
+import hashlib
+import weakref
+from functools import lru_cache
+
+import moderngl
+import numpy as np
+
+from flystim.files import rel_path
+
+# one cache per ModernGL context, dropped automatically when the context goes away
+_context_caches = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=None)
+def shader_source(name):
+    """
+    Returns the contents of a file in the shaders directory.  Files are only read from disk once per process.
+    :param name: Name of the shader file (e.g., 'base.vert')
+    """
+
+    with open(rel_path('shaders', name), 'r') as f:
+        return f.read()
+
+
+def add_defines(source, defines):
+    """
+    Returns GLSL source with a #define line for each of the given names inserted after the #version directive.
+    """
+
+    if not defines:
+        return source
+
+    lines = source.split('\n')
+    for k, line in enumerate(lines):
+        if line.strip().startswith('#version'):
+            break
+    else:
+        k = -1
+
+    return '\n'.join(lines[:k+1] + ['#define ' + define for define in defines] + lines[k+1:])
+
+
+def source_hash(*sources):
+    """
+    Returns a hex digest that uniquely identifies the given GLSL source strings.
+    """
+
+    h = hashlib.sha1()
+    for source in sources:
+        h.update(source.encode('utf-8'))
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+class ContextCache:
+    def __init__(self, ctx):
+        # save settings
+        self.ctx = ctx
+
+        # initialize
+        self.programs = {}
+        self.vertex_buffers = {}
+        self.vertex_arrays = {}
+        self.textures = {}
+        self.objects = {}
+
+    def program(self, vertex_shader, fragment_shader):
+        key = source_hash(vertex_shader, fragment_shader)
+
+        if key not in self.programs:
+            self.programs[key] = self.ctx.program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+
+        return self.programs[key]
+
+    def shared(self, key, factory):
+        """
+        Returns the object stored under the given key, calling factory() to create it the first time.  This is used
+        for objects such as per-screen lookup textures that are shared by all programs drawing to this context.
+        """
+
+        if key not in self.objects:
+            self.objects[key] = factory()
+
+        return self.objects[key]
+
+    def vertex_buffer(self, data):
+        """
+        Returns a VBO holding the given float32 vertex data.  Buffers are keyed by content, so all programs drawing
+        the same screen geometry share a single buffer on the GPU.
+        """
+
+        data = np.ascontiguousarray(data, dtype='f4')
+        key = hashlib.sha1(data.tobytes()).hexdigest()
+
+        if key not in self.vertex_buffers:
+            self.vertex_buffers[key] = self.ctx.buffer(data.tobytes())
+
+        return self.vertex_buffers[key]
+
+    def warp_texture(self, warp):
+        """
+        Returns a float texture holding the 3D positions of a warp map (see Screen), keyed by content.  The texture is
+        sampled with linear filtering, so positions are interpolated between grid nodes.
+        """
+
+        warp = np.ascontiguousarray(warp, dtype='f4')
+        key = ('warp', hashlib.sha1(warp.tobytes()).hexdigest())
+
+        if key not in self.textures:
+            texture = self.ctx.texture((warp.shape[1], warp.shape[0]), 3, warp.tobytes(), dtype='f4')
+            texture.filter = (moderngl.LINEAR, moderngl.LINEAR)
+            texture.repeat_x = False
+            texture.repeat_y = False
+            self.textures[key] = texture
+
+        return self.textures[key]
+
+    def screen_vertex_array(self, prog, screen):
+        """
+        Returns a VAO that binds the geometry of a screen to the vert_pos and vert_col inputs of a program.
+        """
+
+        vbo = self.vertex_buffer(screen.get_vertex_data())
+        key = (prog.glo, vbo.glo)
+
+        if key not in self.vertex_arrays:
+            # vert_col is optimized away by programs that don't use it (e.g., when a warp map is used)
+            if prog.get('vert_col', None) is not None:
+                content = (vbo, '2f 3f', 'vert_pos', 'vert_col')
+            else:
+                content = (vbo, '2f 12x', 'vert_pos')
+
+            self.vertex_arrays[key] = self.ctx.vertex_array(prog, [content])
+
+        return self.vertex_arrays[key]
+
+
+def get_context_cache(ctx):
+    """
+    Returns the ContextCache associated with a ModernGL context, creating it if necessary.
+    """
+
+    if ctx not in _context_caches:
+        _context_caches[ctx] = ContextCache(ctx)
+
+    return _context_caches[ctx]
+
+
+def get_program(ctx, vertex_shader, fragment_shader):
+    """
+    Returns a compiled program for the given shader sources, only compiling it the first time the sources are seen
+    for this context.
+    """
+
+    return get_context_cache(ctx).program(vertex_shader=vertex_shader, fragment_shader=fragment_shader)
+
+
+def get_screen_vertex_array(ctx, prog, screen):
+    """
+    Returns a VAO for drawing the geometry of a screen with the given program, sharing the underlying VBO with every
+    other program that draws the same screen.
+    """
+
+    return get_context_cache(ctx).screen_vertex_array(prog=prog, screen=screen)
+
+
+def get_warp_texture(ctx, warp):
+    """
+    Returns the texture holding a screen's warp map, creating it the first time it is requested for this context.
+    """
+
+    return get_context_cache(ctx).warp_texture(warp)
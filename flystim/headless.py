@@ -0,0 +1,159 @@
+import os
+import sys
+import numpy as np
+import moderngl
+
+from time import perf_counter, sleep
+
+from flystim.engine import StimEngine
+from flystim.screen import Screen
+from flystim.startup import startup_timer
+
+
+def default_backend():
+    """
+    Returns the ModernGL backend to use for standalone contexts.  On Linux without an X display, EGL is used so that
+    rendering works on headless machines (e.g., CI runners, or servers with only a software renderer like llvmpipe).
+    """
+
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        return 'egl'
+    else:
+        return None
+
+
+def create_standalone_context(backend=None):
+    """
+    Creates a ModernGL context that is not attached to any window.
+    :param backend: ModernGL backend (e.g., 'egl').  If None, the default for this machine is used.
+    """
+
+    if backend is None:
+        backend = default_backend()
+
+    if backend is None:
+        return moderngl.create_context(standalone=True, require=330)
+    else:
+        return moderngl.create_context(standalone=True, require=330, backend=backend)
+
+
+class HeadlessStimDisplay(StimEngine):
+    """
+    Renders the stimulus for one screen into an offscreen framebuffer instead of a window.  The control functions are
+    the same as those of the windowed display, so stimuli can be loaded and started in the same way, and frames can be
+    drawn at explicit times for batch rendering or benchmarking.
+    """
+
+    def __init__(self, screen, width=512, height=512, backend=None, ctx=None):
+        """
+        :param screen: Screen object (from flystim.screen) corresponding to the screen being rendered
+        :param width: Width of the framebuffer in pixels
+        :param height: Height of the framebuffer in pixels
+        :param backend: ModernGL backend for the standalone context (see default_backend)
+        :param ctx: Existing ModernGL context to use instead of creating a new one.
+        """
+
+        super().__init__(screen=screen)
+
+        # save settings
+        self.width = width
+        self.height = height
+
+        # create the context and the framebuffer that will be drawn into
+        self.owns_ctx = ctx is None
+        if self.owns_ctx:
+            ctx = create_standalone_context(backend=backend)
+
+        self.fbo = ctx.simple_framebuffer((self.width, self.height), components=4)
+        self.fbo.use()
+
+        self.initialize_gl(ctx)
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def paint(self, t=None):
+        """
+        Draws one frame into the framebuffer.
+        :param t: time of the frame in seconds.  If None, the current time is used.
+        """
+
+        self.fbo.use()
+        self.render(viewport=(0, 0, self.width, self.height), t=t)
+
+    def read_frame(self, components=3):
+        """
+        Returns the contents of the framebuffer as a (height, width, components) uint8 array, with the top row of the
+        screen first.
+        """
+
+        data = self.fbo.read(components=components)
+        frame = np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, components)
+
+        return frame[::-1]
+
+    def release(self):
+        self.close_history()
+        self.fbo.release()
+
+        if self.owns_ctx:
+            self.ctx.release()
+
+
+def run_headless_display(display, server):
+    """
+    Draws frames until the server is shut down, handling RPC input before each frame in the same way as the windowed
+    display.  If the screen has vsync, frames are drawn at the refresh rate of the screen; otherwise they are drawn as
+    fast as possible.
+    """
+
+    frame_period = 1.0/display.screen.refresh_rate if display.screen.vsync else 0.0
+    next_frame = perf_counter()
+
+    while not server.shutdown_flag.is_set():
+        # handle RPC input
+        server.process_queue()
+
+        # draw the frame and wait for it to finish, as if it were being swapped to a screen
+        display.paint()
+        display.ctx.finish()
+
+        # note when the first frame has been drawn
+        if not startup_timer.has_mark('first frame'):
+            startup_timer.mark('first frame')
+
+        # wait for the next frame
+        if frame_period > 0:
+            next_frame = max(next_frame + frame_period, perf_counter() - frame_period)
+            sleep(max(next_frame - perf_counter(), 0))
+
+
+def main():
+    # flyrpc is only needed when running as a display process
+    from flyrpc.transceiver import MySocketServer
+    from flyrpc.util import get_kwargs
+
+    # get the configuration parameters
+    kwargs = get_kwargs()
+
+    # get the screen
+    screen = Screen.deserialize(kwargs.get('screen', {}))
+
+    # launch the server
+    with startup_timer.step('launch RPC server'):
+        server = MySocketServer(host=kwargs['host'], port=kwargs['port'], threaded=True, auto_stop=True, name=screen.name)
+
+    # create the display and register its functions
+    with startup_timer.step('create HeadlessStimDisplay'):
+        display = HeadlessStimDisplay(screen=screen)
+    display.register_functions(server)
+
+    try:
+        run_headless_display(display, server)
+    finally:
+        display.close_history()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+# Latency analysis between the sync square drawn by flystim and the sync square seen by a camera (e.g., FicTrac's
+# sync_mean column).  Both traces are resampled onto a common time grid, and the lag is found from their
+# cross-correlation, computed with FFTs and refined to a fraction of a sample by fitting a parabola to the peak.
+
+import numpy as np
+
+from warnings import warn
+
+
+def next_fft_size(n):
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+
+def refine_peak(corr, k):
+    """
+    Returns the sub-sample position of the peak of corr at index k, found by fitting a parabola through the peak and
+    its two neighbors.  corr may have more than one dimension, in which case the last axis is used.
+    """
+
+    k = np.asarray(k)
+    n = corr.shape[-1]
+
+    # the peak cannot be refined at the edges
+    kl = np.clip(k - 1, 0, n - 1)
+    kr = np.clip(k + 1, 0, n - 1)
+
+    yl = np.take_along_axis(corr, kl[..., np.newaxis], axis=-1)[..., 0]
+    y0 = np.take_along_axis(corr, k[..., np.newaxis], axis=-1)[..., 0]
+    yr = np.take_along_axis(corr, kr[..., np.newaxis], axis=-1)[..., 0]
+
+    denom = yl - 2*y0 + yr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where((denom < 0) & (kl != k) & (kr != k), 0.5*(yl - yr)/denom, 0.0)
+
+    return k + delta
+
+
+def xcorr_lag(ground_truth, lagged, refine=True):
+    """
+    Calculates the delay of one sequence relative to another from the peak of their cross-correlation.  The
+    cross-correlation is computed with FFTs, so the cost is O(n log n) instead of O(n^2).  Both arguments can be 2D
+    arrays, in which case the lag of each row is returned.
+    :param ground_truth: ground truth sequence to align against
+    :param lagged: delayed ground truth sequence, perhaps with some added noise
+    :param refine: if True, the lag is refined to a fraction of a sample.  Otherwise it is an integer.
+    :return: lag in units of samples (positive when lagged is delayed relative to ground_truth)
+    """
+
+    ground_truth = np.asarray(ground_truth, dtype=float)
+    lagged = np.asarray(lagged, dtype=float)
+
+    n_gt = ground_truth.shape[-1]
+    n_lagged = lagged.shape[-1]
+    n_fft = next_fft_size(n_gt + n_lagged - 1)
+
+    # circular cross-correlation, padded so that it equals the linear one
+    corr = np.fft.irfft(np.fft.rfft(lagged, n_fft) * np.conj(np.fft.rfft(ground_truth, n_fft)), n_fft)
+
+    # arrange in the same order as np.correlate(lagged, ground_truth, mode='full')
+    corr = np.concatenate((corr[..., n_fft-(n_gt-1):], corr[..., :n_lagged]), axis=-1)
+
+    k = np.argmax(corr, axis=-1)
+    if refine:
+        k = refine_peak(corr, k)
+
+    return k - (n_gt - 1)
+
+
+def frame_stats(timestamps):
+    frame_lengths = np.diff(timestamps)
+
+    return {'mean_fps': 1/np.mean(frame_lengths),
+            'mean_frame_length': np.mean(frame_lengths),
+            'std_frame_length': np.std(frame_lengths),
+            'min_frame_length': np.min(frame_lengths),
+            'max_frame_length': np.max(frame_lengths)}
+
+
+class LatencyReport:
+    """
+    Results of a latency analysis.  Lags are in seconds, and are positive when the camera sees the sync square after
+    flystim draws it.
+    """
+
+    def __init__(self, flystim_stats, fictrac_stats, global_lag, local_lags, local_times, window_size, duration):
+        self.flystim_stats = flystim_stats
+        self.fictrac_stats = fictrac_stats
+        self.global_lag = global_lag
+        self.local_lags = local_lags
+        self.local_times = local_times
+        self.window_size = window_size
+        self.duration = duration
+
+    def to_dict(self):
+        return {'flystim': self.flystim_stats, 'fictrac': self.fictrac_stats, 'global_lag': self.global_lag,
+                'local_lags': list(self.local_lags), 'local_times': list(self.local_times),
+                'window_size': self.window_size, 'duration': self.duration}
+
+    def format(self):
+        template = "{:^20} | {:^16.4f} | {:^16.4f}"
+        table_width = 60
+
+        lines = ["{:^20} | {:^16} | {:^16}".format("statistic", "flystim", "fictrac"), "=" * table_width]
+        for name, key in [('mean fps', 'mean_fps'), ('mean frame length', 'mean_frame_length'),
+                          ('std frame length', 'std_frame_length'), ('min frame length', 'min_frame_length'),
+                          ('max frame length', 'max_frame_length')]:
+            lines.append(template.format(name, self.flystim_stats[key], self.fictrac_stats[key]))
+            lines.append('-' * table_width)
+
+        lines.append("Globally optimal lag: {:.1f}ms".format(self.global_lag * 1000))
+        lines.append("Local lag ({} {}s windows): {:.1f}ms mean, {:.1f}ms std".format(
+            len(self.local_lags), self.window_size, np.mean(self.local_lags) * 1000, np.std(self.local_lags) * 1000))
+        lines.append("Total length of recording: {:1f} s".format(self.duration))
+
+        return '\n'.join(lines)
+
+
+def latency_report(flystim_timestamps, flystim_sync, fictrac_timestamps, fictrac_sync,
+                   window_size=10, n_windows=32, verbose=True):
+    """ Latency analysis report
+
+    Args:
+      flystim_timestamps: list of timestamps when sync square was updated - (n_fs,)
+        units: seconds
+      flystim_sync: list of sync square states, as recorded by flystim - (n_fs,)
+      fictrac_timestamps: list of timestamps when fictrac captured a frame - (n_ft,)
+        units: seconds
+      fictrac_sync: list of sync square states, as captured by fictrac - (n_ft,)
+      window_size: size of window to use for local latency analysis
+      n_windows: number of windows to compute lag for
+      verbose: if True, print the report
+
+    Returns
+      LatencyReport
+    """
+
+    assert len(flystim_timestamps) == len(flystim_sync)
+    assert len(fictrac_timestamps) == len(fictrac_sync)
+
+    flystim_timestamps = np.asarray(flystim_timestamps, dtype=float)
+    flystim_sync = np.asarray(flystim_sync, dtype=float)
+    fictrac_timestamps = np.asarray(fictrac_timestamps, dtype=float)
+    fictrac_sync = np.asarray(fictrac_sync, dtype=float)
+
+    # TODO: why are non-zero values recorded
+    # truncate non-zero values
+    fs_mask = flystim_timestamps.astype(bool)
+    flystim_timestamps = flystim_timestamps[fs_mask]
+    flystim_sync = flystim_sync[fs_mask]
+
+    ft_mask = fictrac_timestamps.astype(bool)
+    fictrac_timestamps = fictrac_timestamps[ft_mask]
+    fictrac_sync = fictrac_sync[ft_mask]
+
+    # resample both traces to fictrac fps
+    resample_frame_len = np.mean(np.diff(fictrac_timestamps))
+
+    time_bounds = (
+        max(min(flystim_timestamps), min(fictrac_timestamps)),
+        min(max(flystim_timestamps), max(fictrac_timestamps)),
+    )
+    trial_duration = time_bounds[1] - time_bounds[0]
+
+    num_samples = 1 + int(trial_duration / resample_frame_len)
+    time_grid = np.linspace(*time_bounds, num_samples, endpoint=True)
+    grid_step = time_grid[1] - time_grid[0]
+
+    resampled_fs_sync = np.interp(time_grid, flystim_timestamps, flystim_sync)
+    resampled_ft_sync = np.interp(time_grid, fictrac_timestamps, fictrac_sync)
+
+    global_lag = xcorr_lag(resampled_fs_sync, resampled_ft_sync) * grid_step
+
+    # local lags are computed for windows of the common grid, all at once
+    if window_size >= trial_duration:
+        warn("window_size is larger than trial duration! try a smaller window_size")
+
+    window_len = min(1 + int(window_size / resample_frame_len), num_samples)
+    starts = np.round(np.linspace(0, num_samples - window_len, n_windows)).astype(int)
+    windows = starts[:, np.newaxis] + np.arange(window_len)
+
+    local_lags = xcorr_lag(resampled_fs_sync[windows], resampled_ft_sync[windows]) * grid_step
+    local_times = time_grid[starts]
+
+    report = LatencyReport(flystim_stats=frame_stats(flystim_timestamps), fictrac_stats=frame_stats(fictrac_timestamps),
+                           global_lag=global_lag, local_lags=local_lags, local_times=local_times,
+                           window_size=window_size, duration=trial_duration)
+
+    if verbose:
+        print(report.format())
+
+    return report
+
+
+class OnlineLatencyEstimator:
+    """
+    Estimates the lag between the flystim and camera sync traces while samples are still arriving, using only the most
+    recent window of data, so that each update costs the same regardless of how long the session has been running.
+    """
+
+    def __init__(self, window_size=10, resample_frame_len=None):
+        """
+        :param window_size: length of the window used for each estimate (seconds)
+        :param resample_frame_len: sample period of the common time grid (seconds).  Defaults to the mean frame
+        length of the camera.
+        """
+
+        self.window_size = window_size
+        self.resample_frame_len = resample_frame_len
+
+        self.flystim = ([], [])
+        self.fictrac = ([], [])
+
+        # history of estimates, as (time at the end of the window, lag) pairs
+        self.lags = []
+
+    @staticmethod
+    def append(trace, timestamps, sync):
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=float))
+        sync = np.atleast_1d(np.asarray(sync, dtype=float))
+
+        # a poll that returned no samples is skipped, so that the last chunk always holds the latest sample
+        if len(timestamps) == 0:
+            return
+
+        trace[0].append(timestamps)
+        trace[1].append(sync)
+
+    def add_flystim(self, timestamps, sync):
+        self.append(self.flystim, timestamps, sync)
+
+    def add_fictrac(self, timestamps, sync):
+        self.append(self.fictrac, timestamps, sync)
+
+    def recent(self, trace, t_min):
+        # merge the chunks received so far, dropping samples that are older than needed
+        timestamps = np.concatenate(trace[0]) if trace[0] else np.zeros(0)
+        sync = np.concatenate(trace[1]) if trace[1] else np.zeros(0)
+
+        keep = max(np.searchsorted(timestamps, t_min) - 1, 0)
+        timestamps, sync = timestamps[keep:], sync[keep:]
+
+        trace[0][:] = [timestamps]
+        trace[1][:] = [sync]
+
+        return timestamps, sync
+
+    def update(self):
+        """
+        Computes the lag over the most recent window in which both traces have data.
+        :return: lag in seconds, or None if there is not yet enough data.
+        """
+
+        if not (self.flystim[0] and self.fictrac[0]):
+            return None
+
+        t_end = min(self.flystim[0][-1][-1], self.fictrac[0][-1][-1])
+        t_start = t_end - self.window_size
+
+        fs_timestamps, fs_sync = self.recent(self.flystim, t_start)
+        ft_timestamps, ft_sync = self.recent(self.fictrac, t_start)
+
+        if max(fs_timestamps[0], ft_timestamps[0]) > t_start or len(ft_timestamps) < 2:
+            return None
+
+        resample_frame_len = self.resample_frame_len or np.mean(np.diff(ft_timestamps))
+        time_grid = np.arange(t_start, t_end, resample_frame_len)
+
+        lag = xcorr_lag(np.interp(time_grid, fs_timestamps, fs_sync),
+                        np.interp(time_grid, ft_timestamps, ft_sync)) * resample_frame_len
+
+        self.lags.append((t_end, lag))
+
+        return lag
@@ -0,0 +1,209 @@
+# Closed-loop latency benchmark.  A stim server is launched with a headless screen, and the global theta offset is
+# updated at FicTrac-like rates through one of several transports:
+#
+# json: one flyrpc call per sample (the way closed-loop scripts work today)
+# batched: samples are grouped into multicalls of a fixed size, so there are fewer, larger messages
+# shm: samples are written to a flystim.shm.SharedPose block that the display reads once per frame
+#
+# Each sample carries a unique theta value, so the frame in which it was first used can be found in the display
+# history (see StimEngine.save_history).  The latency of a sample is the time from the client call to the start of that
+# frame, e.g.:
+#
+# flystim_rpc_bench --rate 500 --duration 10
+
+import os
+import sys
+import json
+import tempfile
+import numpy as np
+
+from argparse import ArgumentParser
+from time import time, sleep, perf_counter
+
+from flystim.bench import summarize
+from flystim.export import load_history
+from flystim.screen import Screen
+
+# theta offset step (degrees) used to give each sample a unique value
+THETA_STEP = 1e-2
+
+TRANSPORTS = ['json', 'batched', 'shm']
+
+
+def sample_value(k):
+    return k*THETA_STEP
+
+
+def decode_theta(theta):
+    """
+    Returns the sample number encoded in the recorded theta offsets (radians).
+    """
+
+    return np.round(np.degrees(theta)/THETA_STEP).astype(int)
+
+
+def frame_latencies(sent_times, frame_times, frame_samples):
+    """
+    Matches samples to the frames in which they were rendered.
+    :param sent_times: time at which each sample was sent, indexed by sample number
+    :param frame_times: start time of each frame
+    :param frame_samples: sample number in use during each frame (non-decreasing)
+    :return: latency of each sample until the first frame that used it (or a newer one), NaN if no such frame, and
+    a boolean array that is True for samples that were rendered themselves (rather than superseded by a newer sample
+    before the next frame)
+    """
+
+    sent_times = np.asarray(sent_times)
+    frame_times = np.asarray(frame_times)
+    frame_samples = np.asarray(frame_samples)
+
+    samples = np.arange(len(sent_times))
+    frames = np.searchsorted(frame_samples, samples, side='left')
+
+    found = frames < len(frame_times)
+    latencies = np.full(len(samples), np.nan)
+    latencies[found] = frame_times[frames[found]] - sent_times[found]
+
+    rendered = np.zeros(len(samples), dtype=bool)
+    rendered[found] = frame_samples[frames[found]] == samples[found]
+
+    return latencies, rendered
+
+
+def wait_for_file(file_name, timeout=10.0):
+    # RPC calls do not return anything, so the only way to know that the history is saved is to wait for the files
+    start = perf_counter()
+    while not os.path.exists(file_name):
+        if perf_counter() - start > timeout:
+            raise TimeoutError('Timed out waiting for {}.'.format(file_name))
+        sleep(0.05)
+
+    sleep(0.1)
+
+
+def run_transport(manager, transport, rate, duration, save_path, batch=8, frame_rate=120.0):
+    """
+    Sends theta offset samples through one transport and returns the latency of each sample.
+    """
+
+    from flyrpc.multicall import MyMultiCall
+
+    n_samples = int(round(rate*duration))
+    sent_times = np.zeros(n_samples)
+
+    # start recording the display history
+    manager.set_global_theta_offset(sample_value(0))
+    manager.set_save_history_params(save_history_flag=True, save_path=save_path, save_prefix=transport,
+                                    fs_frame_rate_estimate=frame_rate, save_duration=duration+2)
+    manager.start_saving_history()
+
+    shared_pose = None
+    if transport == 'shm':
+        # shared memory needs Python 3.8+, so it is only imported when used
+        from flystim.shm import SharedPose
+
+        shared_pose = SharedPose(create=True)
+        manager.set_shared_pose(shared_pose.name)
+
+    sleep(0.5)
+
+    # send the samples at a fixed rate
+    multicall = MyMultiCall(manager)
+    next_sample = perf_counter()
+    for k in range(n_samples):
+        sent_times[k] = time()
+
+        if transport == 'json':
+            manager.set_global_theta_offset(sample_value(k))
+        elif transport == 'batched':
+            multicall.set_global_theta_offset(sample_value(k))
+            if (k + 1) % batch == 0 or k == n_samples-1:
+                multicall()
+                multicall = MyMultiCall(manager)
+        elif transport == 'shm':
+            shared_pose.write(theta_offset=sample_value(k), t=sent_times[k])
+        else:
+            raise ValueError('Unknown transport: {}'.format(transport))
+
+        next_sample += 1.0/rate
+        sleep(max(next_sample - perf_counter(), 0))
+
+    sleep(0.5)
+
+    # stop recording and save the history
+    manager.stop_saving_history()
+    manager.save_history()
+
+    if shared_pose is not None:
+        manager.set_shared_pose(None)
+
+    wait_for_file(os.path.join(save_path, transport + '_fs_theta.txt'))
+    if shared_pose is not None:
+        shared_pose.close()
+
+    history = load_history(save_path, transport)
+
+    return frame_latencies(sent_times, history['time'], decode_theta(history['theta']))
+
+
+def run_rpc_bench(transports=None, rate=500.0, duration=5.0, batch=8, frame_rate=120.0, save_path=None):
+    """
+    Launches a stim server with one headless screen and measures the latency of each transport.
+    :return: dictionary with the benchmark settings and one result per transport
+    """
+
+    from flystim.stim_server import launch_stim_server
+
+    if transports is None:
+        transports = TRANSPORTS
+    if save_path is None:
+        save_path = tempfile.mkdtemp(prefix='flystim_rpc_bench_')
+
+    screen = Screen(name='headless', headless=True, refresh_rate=frame_rate)
+    manager = launch_stim_server(screen)
+    manager.hide_corner_square()
+    manager.load_stim('ConstantBackground', background=0.5)
+
+    # give the display process time to start up
+    sleep(2.0)
+
+    results = []
+    for transport in transports:
+        latencies, rendered = run_transport(manager, transport, rate=rate, duration=duration, save_path=save_path,
+                                            batch=batch, frame_rate=frame_rate)
+        found = ~np.isnan(latencies)
+
+        results.append({'transport': transport,
+                        'n_samples': len(latencies),
+                        'n_missing': int(np.sum(~found)),
+                        'fraction_rendered': float(np.mean(rendered)),
+                        'latency_ms': summarize(1e3*latencies[found])})
+
+    return {'settings': {'rate': rate, 'duration': duration, 'batch': batch, 'frame_rate': frame_rate},
+            'results': results}
+
+
+def main():
+    parser = ArgumentParser(description='Measures the latency from a closed-loop update to the frame that uses it.')
+    parser.add_argument('transports', nargs='*', help='Transports to compare: {} (default: all)'.format(
+        ', '.join(TRANSPORTS)))
+    parser.add_argument('--rate', type=float, default=500.0, help='Rate at which samples are sent (Hz)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Duration of each run (s)')
+    parser.add_argument('--batch', type=int, default=8, help='Number of samples per batched call')
+    parser.add_argument('--frame-rate', type=float, default=120.0, help='Frame rate of the headless screen (Hz)')
+    parser.add_argument('--save', default=None, help='File where the JSON report is written')
+    args = parser.parse_args()
+
+    report = run_rpc_bench(transports=args.transports or None, rate=args.rate, duration=args.duration,
+                           batch=args.batch, frame_rate=args.frame_rate)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
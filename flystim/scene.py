@@ -0,0 +1,97 @@
+# Retained scene graph for CaveSystem.  Meshes (any GlVertices shape) are uploaded to a static VBO the first time they
+# are drawn and kept on the GPU, and each node places its mesh with a 4x4 model matrix, composed with the matrices of
+# its parents.  Animating a node only changes its matrix, so a static 3D environment costs one draw call per node and
+# subscreen per frame, and a mesh shared by several nodes (e.g. the trees of a forest) is uploaded once, e.g.:
+#
+# tree = GlCylinder(cylinder_height=1, cylinder_radius=0.25)
+# for x, y in locations:
+#     cave.scene.add(tree, model=model_translate((x, y, 0.5)))
+# patch = cave.scene.add(GlSphericalCirc())
+# display.render_actions.append(lambda: cave.render_scene())
+# ...
+# patch.model = model_rotz(radians(omega*t))
+
+import numpy as np
+
+from flystim.util import rotx_mat, roty_mat, rotz_mat
+
+
+def model_rotx(th):
+    return embed_mat(rotx_mat(th))
+
+
+def model_roty(th):
+    return embed_mat(roty_mat(th))
+
+
+def model_rotz(th):
+    return embed_mat(rotz_mat(th))
+
+
+def model_scale(amt):
+    return embed_mat(np.multiply(amt, np.eye(3)))
+
+
+def model_translate(amt):
+    model = np.eye(4)
+    model[:3, 3] = amt
+
+    return model
+
+
+def embed_mat(mat):
+    # 4x4 model matrix with the given 3x3 linear part
+    model = np.eye(4)
+    model[:3, :3] = mat
+
+    return model
+
+
+class SceneNode:
+    def __init__(self, mesh=None, texture=None, model=None):
+        """
+        :param mesh: shape from flystim.shapes drawn by this node (optional, e.g. for nodes that only group others).
+        The shape should not be changed once it has been drawn, since it is only uploaded once.
+        :param texture: handle returned by CaveSystem.create_texture (optional)
+        :param model: 4x4 model matrix, relative to the parent node (default: identity)
+        """
+
+        self.mesh = mesh
+        self.texture = texture
+        self.model = np.eye(4) if model is None else np.asarray(model, dtype=float)
+
+        self.visible = True
+        self.children = []
+
+    def add(self, mesh=None, texture=None, model=None):
+        """
+        Adds a child node.
+        :return: the new node
+        """
+
+        node = SceneNode(mesh=mesh, texture=texture, model=model)
+        self.children.append(node)
+
+        return node
+
+    def remove(self, node):
+        self.children.remove(node)
+
+    def clear(self):
+        self.children = []
+
+    def draw_list(self, parent_model=None):
+        """
+        :return: list of (node, world model matrix) pairs for the visible nodes with a mesh, parents before children
+        """
+
+        if not self.visible:
+            return []
+
+        model = self.model if parent_model is None else parent_model.dot(self.model)
+
+        draws = [(self, model)] if self.mesh is not None else []
+        for child in self.children:
+            draws.extend(child.draw_list(model))
+
+        return draws
@@ -1,5 +1,9 @@
 from math import sin, cos
 
+import numpy as np
+
+from flystim.wire import encode_array, decode_array
+
 class ScreenPoint:
     def __init__(self, ndc, cart):
         self.ndc = ndc
@@ -45,6 +49,83 @@ class ScreenTriangle:
     def __str__(self):
         return f'({str(self.pa)}, {str(self.pb)}, {str(self.pc)})'
 
+class ScreenMesh:
+    """
+    Array-backed triangle mesh describing the geometry of a screen.  The mesh is stored as an (N, 3, 5) float32 array,
+    where the first axis indexes triangles, the second indexes the corners of each triangle, and the last axis holds
+    the NDC (x, y) and cartesian (x, y, z) coordinates of each corner.  Unlike a list of ScreenTriangles, meshes with
+    tens of thousands of triangles (e.g., for curved screens or projector calibration) are cheap to build and send.
+    """
+
+    def __init__(self, data):
+        data = np.ascontiguousarray(data, dtype='f4')
+        if data.ndim != 3 or data.shape[1:] != (3, 5):
+            raise ValueError(f'Mesh data must have shape (N, 3, 5), not {data.shape}.')
+
+        self.data = data
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def ndc(self):
+        return self.data[:, :, 0:2]
+
+    @property
+    def cart(self):
+        return self.data[:, :, 2:5]
+
+    @property
+    def tri_list(self):
+        """
+        List of ScreenTriangles equivalent to this mesh, for code that works with individual triangles.
+        """
+
+        return [ScreenTriangle(*[ScreenPoint(ndc=tuple(corner[0:2]), cart=tuple(corner[2:5])) for corner in tri])
+                for tri in self.data.tolist()]
+
+    @classmethod
+    def from_tri_list(cls, tri_list):
+        """
+        :param tri_list: list of ScreenTriangles (or serialized ScreenTriangles)
+        """
+
+        tri_list = [tri if isinstance(tri, ScreenTriangle) else ScreenTriangle.deserialize(tri) for tri in tri_list]
+
+        return cls(np.array([[tuple(pt.ndc) + tuple(pt.cart) for pt in [tri.pa, tri.pb, tri.pc]]
+                             for tri in tri_list], dtype='f4').reshape((-1, 3, 5)))
+
+    @classmethod
+    def from_grid(cls, ndc, cart):
+        """
+        Builds a mesh from a grid of corresponding points, such as the nodes of a projector calibration.  Each cell of
+        the grid is split into two triangles.
+        :param ndc: (H, W, 2) array of NDC coordinates of the grid nodes
+        :param cart: (H, W, 3) array of cartesian coordinates (meters) of the grid nodes
+        """
+
+        nodes = np.concatenate((np.asarray(ndc, dtype='f4'), np.asarray(cart, dtype='f4')), axis=-1)
+        if nodes.ndim != 3 or nodes.shape[0] < 2 or nodes.shape[1] < 2:
+            raise ValueError('Grid must have at least 2x2 nodes.')
+
+        # corners of each grid cell, using the same winding as quad_to_tri_list
+        p1 = nodes[:-1, :-1]
+        p2 = nodes[:-1, 1:]
+        p3 = nodes[1:, 1:]
+        p4 = nodes[1:, :-1]
+
+        # each cell becomes the triangles (p1, p2, p4) and (p2, p3, p4)
+        tris = np.stack((np.stack((p1, p2, p4), axis=-2), np.stack((p2, p3, p4), axis=-2)), axis=2)
+
+        return cls(tris.reshape((-1, 3, 5)))
+
+    def serialize(self):
+        return encode_array(self.data)
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(decode_array(data))
+
 class Screen:
     """
     Class representing the configuration of a single screen used in the display of stimuli.
@@ -52,7 +133,8 @@ class Screen:
     """
 
     def __init__(self, width=None, height=None, rotation=None, offset=None, server_number=None, id=None,
-                 fullscreen=None, vsync=None, square_side=None, square_loc=None, name=None, tri_list=None):
+                 fullscreen=None, vsync=None, square_side=None, square_loc=None, name=None, tri_list=None,
+                 warp=None, headless=None, refresh_rate=None):
         """
         :param width: width of the screen (meters)
         :param height: height of the screen (meters)
@@ -67,8 +149,18 @@ class Screen:
         :param square_side: Length of photodiode synchronization square (meters).
         :param square_loc: Location of photodiode synchronization square (one of 'll', 'lr', 'ul', 'ur' or a tuple of (x,y))
         :param name: descriptive name to associate with this screen
-        :param tri_list: list of triangular patches defining the screen geometry.  this is a list of ScreenTriangles.
-        if the triangle list is not specified, then one is constructed automatically using rotation and offset.
+        :param tri_list: list of triangular patches defining the screen geometry.  this is a list of ScreenTriangles,
+        a ScreenMesh, or an (N, 3, 5) array in the ScreenMesh format.  if the triangle list is not specified, then one is
+        constructed automatically using rotation and offset.
+        :param warp: optional calibration map of the screen, given as an (H, W, 3) array of the 3D positions (meters)
+        seen at a grid of NDC coordinates.  Node [i, j] corresponds to NDC x = -1 + 2*j/(W-1), y = -1 + 2*i/(H-1), so
+        row 0 is the bottom of the screen.  The grid can be as fine as one node per pixel.  If a warp map is given,
+        stimuli look up the position of each pixel in the map (with bilinear interpolation between nodes) instead of
+        interpolating the positions of the triangle list, and if no triangle list is given the screen is drawn as a
+        single full-screen quad.
+        :param headless: Boolean.  If True, the stimulus is rendered offscreen, without a window (e.g., for benchmarks
+        or on machines without a display).  Defaults to False.
+        :param refresh_rate: Refresh rate of the screen (Hz).  Headless screens with vsync draw frames at this rate.
         """
 
         # Set defaults for MacBook Pro (Retina, 15-inch, Mid 2015)
@@ -84,6 +176,18 @@ class Screen:
         square_side = square_side or 2e-2
         square_loc = square_loc or 'll'
         name = name or ('Screen' + str(id))
+        headless = headless or False
+        refresh_rate = refresh_rate or 120.0
+
+        # Construct a full-screen quad if a warp map is given without a triangle list
+        if warp is not None:
+            warp = np.ascontiguousarray(warp, dtype='f4')
+            if warp.ndim != 3 or warp.shape[2] != 3 or warp.shape[0] < 2 or warp.shape[1] < 2:
+                raise ValueError(f'Warp map must have shape (H, W, 3), not {warp.shape}.')
+
+            if tri_list is None:
+                tri_list = self.quad_to_tri_list(((-1, -1), tuple(warp[0, 0])), ((+1, -1), tuple(warp[0, -1])),
+                                                 ((+1, +1), tuple(warp[-1, -1])), ((-1, +1), tuple(warp[-1, 0])))
 
         # Construct a default triangle list if needed
         if tri_list is None:
@@ -94,10 +198,16 @@ class Screen:
 
             tri_list = self.quad_to_tri_list(ll, lr, ur, ul)
 
-        # save the triangle list
-        self.tri_list = tri_list
+        # save the triangle list as an array-backed mesh
+        if isinstance(tri_list, ScreenMesh):
+            self.mesh = tri_list
+        elif isinstance(tri_list, np.ndarray):
+            self.mesh = ScreenMesh(tri_list)
+        else:
+            self.mesh = ScreenMesh.from_tri_list(tri_list)
 
         # Save settings
+        self.warp = warp
         self.width = width
         self.height = height
         self.id = id
@@ -107,6 +217,8 @@ class Screen:
         self.square_side = square_side
         self.square_loc = square_loc
         self.name = name
+        self.headless = headless
+        self.refresh_rate = refresh_rate
 
     @classmethod
     def name_to_ndc(cls, name):
@@ -141,13 +253,33 @@ class Screen:
         # create a mesh consisting of two triangles
         return [ScreenTriangle(p1, p2, p4), ScreenTriangle(p2, p3, p4)]
 
+    @property
+    def tri_list(self):
+        return self.mesh.tri_list
+
+    def get_tri_array(self):
+        """
+        Returns the triangle list as an (N, 3, 5) float32 array (see ScreenMesh).
+        """
+
+        return self.mesh.data
+
+    def get_vertex_data(self):
+        """
+        Returns the (3*N, 5) float32 array of vertices used to fill the VBO that describes the screen geometry.
+        """
+
+        return self.get_tri_array().reshape((-1, 5))
+
     def serialize(self):
         # get all variables needed to reconstruct the screen object
-        vars = ['width', 'height', 'id', 'server_number', 'fullscreen', 'vsync', 'square_side', 'square_loc', 'name']
+        vars = ['width', 'height', 'id', 'server_number', 'fullscreen', 'vsync', 'square_side', 'square_loc', 'name',
+                'headless', 'refresh_rate']
         data = {var: getattr(self, var) for var in vars}
 
-        # special handling for tri_list since it could contain numpy values
-        data['tri_list'] = [tri.serialize() for tri in self.tri_list]
+        # the triangle mesh is sent in a compact binary form
+        data['mesh'] = self.mesh.serialize()
+        data['warp'] = encode_array(self.warp) if self.warp is not None else None
 
         return data
 
@@ -157,7 +289,12 @@ class Screen:
         kwargs = data.copy()
 
         # do some post-processing as necessary
-        kwargs['tri_list'] = [ScreenTriangle.deserialize(tri) for tri in kwargs['tri_list']]
+        if 'mesh' in kwargs:
+            kwargs['tri_list'] = ScreenMesh.deserialize(kwargs.pop('mesh'))
+        elif kwargs.get('tri_list') is not None:
+            kwargs['tri_list'] = [ScreenTriangle.deserialize(tri) for tri in kwargs['tri_list']]
+        if kwargs.get('warp') is not None:
+            kwargs['warp'] = decode_array(kwargs['warp'])
 
         return Screen(**kwargs)
 
@@ -0,0 +1,280 @@
+# Incremental HDF5 writer for experiment sessions.  Display history, FicTrac samples and trial metadata are handed to
+# the writer as they are produced, and a background thread appends them to chunked, compressed datasets, so that a
+# session file is complete as soon as the experiment ends.  The layout matches the one built after the fact by the
+# ballrig examples:
+#
+# /                         session attributes (e.g., experiment parameters)
+# /trials/000               trial attributes (e.g., start_time, start_ft_frame, end_time, end_ft_frame)
+# /trials/000/fs_square     datasets, e.g. display history and FicTrac samples
+#
+# The writer thread keeps the file open until the writer is closed, and flushes it after every batch of data, so that
+# a crash loses at most the data that was still queued.  Rows appended to the same dataset in one batch (e.g.
+# FicTrac samples appended one at a time) are written with a single resize.  HDF5 locks files that are open for
+# writing, so analysis code should read the file once the writer is closed.  (SWMR mode would allow concurrent
+# readers, but it cannot create the new groups, attributes and links that each trial adds.)  Files written rarely,
+# like the display history, can instead be opened for each batch (keep_open=False), so that they can be read in
+# between.  If a reader still has the file open when the next batch arrives, the batch is kept and written once the
+# file can be opened again.
+
+import os
+import threading
+import time
+import numpy as np
+
+from queue import Queue, Empty
+
+# datasets of the display history (see StimEngine.save_history)
+HISTORY_DATASETS = ['fs_square', 'fs_timestamps', 'fs_stim_timestamps', 'fs_theta']
+
+
+def history_file_name(save_path, screen_name):
+    """
+    Returns the name of the file where a display process writes its history when saving in HDF5 format.
+    """
+
+    return os.path.join(save_path, screen_name + '_history.h5')
+
+
+class SessionWriter:
+    def __init__(self, file_name, attrs=None, compression='gzip', chunk_size=4096, keep_open=True,
+                 retry_interval=0.1, retry_timeout=10.0):
+        """
+        :param file_name: name of the HDF5 file.  Data is appended if the file already exists.
+        :param attrs: dictionary of session attributes
+        :param compression: compression filter of the datasets (e.g., 'gzip', 'lzf' or None)
+        :param chunk_size: number of rows per chunk of appended datasets
+        :param keep_open: if True, the file stays open until the writer is closed.  Otherwise it is opened for each
+        batch of data, so that other processes can read it in between.
+        :param retry_interval: seconds between attempts at opening the file while it is locked, e.g. by a reader
+        :param retry_timeout: seconds that close waits for a locked file before the data still queued is dropped
+        """
+
+        # h5py is only needed when sessions are written
+        import h5py
+        self.h5py = h5py
+
+        # save settings
+        self.file_name = file_name
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.keep_open = keep_open
+        self.retry_interval = retry_interval
+        self.retry_timeout = retry_timeout
+
+        # name of the group that appended data goes to (see start_trial)
+        self.group = 'pre_trial'
+        self.trial_count = 0
+
+        # start the writer thread
+        self.queue = Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+        if attrs is not None:
+            self.set_attrs(**attrs)
+
+    def submit(self, function, *args):
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put((function, args))
+
+    ###########################################
+    # functions called by the experiment
+    ###########################################
+
+    def set_attrs(self, group='/', **attrs):
+        """
+        Sets attributes of the session (or of the given group).
+        """
+
+        self.submit(self.write_attrs, group, attrs)
+
+    def start_trial(self, name=None, **attrs):
+        """
+        Starts a new trial group.  Data appended from now until the next trial starts (including the following
+        inter-trial interval) is stored in this group.  Data appended before the first trial goes to 'pre_trial'.
+        :param name: name of the trial group.  Defaults to the trial number, formatted as 000, 001, ...
+        :param attrs: trial attributes, e.g. start_time
+        """
+
+        if name is None:
+            name = '{:03}'.format(self.trial_count)
+        self.trial_count += 1
+
+        self.group = 'trials/' + name
+        self.submit(self.write_attrs, self.group, attrs)
+
+        return name
+
+    def end_trial(self, **attrs):
+        """
+        Adds attributes to the current trial, e.g. end_time.
+        """
+
+        self.submit(self.write_attrs, self.group, attrs)
+
+    def append(self, name, data):
+        """
+        Appends rows to a dataset of the current trial, creating it if needed.
+        :param data: scalar, 1D array of rows, or ND array whose first axis indexes rows
+        """
+
+        data = np.asarray(data)
+        if data.ndim == 0:
+            data = data[np.newaxis]
+
+        self.submit(self.write_append, self.group + '/' + name, data)
+
+    def write(self, name, data):
+        """
+        Writes a complete dataset to the current trial (e.g., the display history of the trial).
+        """
+
+        self.submit(self.write_dataset, self.group + '/' + name, np.asarray(data))
+
+    def link(self, name, file_name, path):
+        """
+        Adds a link in the current trial to a dataset or group in another HDF5 file, e.g. to the display history
+        written by a display process.
+        """
+
+        self.submit(self.write_link, self.group + '/' + name, file_name, path)
+
+    def link_history(self, save_path, screen_name, save_prefix):
+        """
+        Links the display history of a trial, written by the display process for the given screen, into the current
+        trial of this session.
+        :param save_prefix: save prefix of the trial on the display (see set_save_history_params)
+        """
+
+        file_name = history_file_name(save_path, screen_name)
+        for name in HISTORY_DATASETS:
+            self.link(name, file_name, '/trials/' + save_prefix + '/' + name)
+
+    def flush(self):
+        """
+        Waits until everything submitted so far has been written.  If the file is locked by a reader, this waits until
+        the reader closes it.
+        """
+
+        self.queue.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Writes everything submitted so far and closes the file.  If the file stays locked for longer than
+        retry_timeout, the data that could not be written is dropped and an error is raised.
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    ###########################################
+    # functions called by the writer thread
+    ###########################################
+
+    def write_loop(self):
+        f = None
+
+        # items taken from the queue that have not been written yet, because the file could not be opened
+        pending = []
+        close_time = None
+
+        try:
+            while True:
+                # wait for more data, or for the next attempt at writing the pending data
+                try:
+                    pending.append(self.queue.get(timeout=self.retry_interval if pending else None))
+                except Empty:
+                    pass
+                while not self.queue.empty():
+                    pending.append(self.queue.get())
+
+                if close_time is None and None in pending:
+                    close_time = time.time()
+
+                if self.error is None and f is None:
+                    try:
+                        f = self.h5py.File(self.file_name, 'a')
+                    except OSError as error:
+                        # the file is locked, e.g. by a reader.  keep the data and try again later, unless the writer
+                        # is being closed and the file has stayed locked for too long.
+                        if close_time is None or time.time() - close_time < self.retry_timeout:
+                            continue
+                        self.error = error
+
+                try:
+                    if self.error is None:
+                        self.write_batch(f, [job for job in pending if job is not None])
+                        if self.keep_open:
+                            f.flush()
+                except Exception as error:
+                    self.error = error
+                finally:
+                    # release the file between batches (keep_open=False), or as soon as writing fails
+                    if f is not None and (not self.keep_open or self.error is not None):
+                        f.close()
+                        f = None
+                    for _ in pending:
+                        self.queue.task_done()
+
+                if close_time is not None:
+                    return
+
+                pending = []
+        finally:
+            if f is not None:
+                f.close()
+
+    def write_batch(self, f, jobs):
+        # rows appended to the same dataset are joined until another kind of job needs them to be written
+        appends = {}
+
+        def write_appends():
+            for name, parts in appends.items():
+                self.write_append(f, name, np.concatenate(parts) if len(parts) > 1 else parts[0])
+            appends.clear()
+
+        for function, args in jobs:
+            if function == self.write_append:
+                name, data = args
+                appends.setdefault(name, []).append(data)
+            else:
+                write_appends()
+                function(f, *args)
+
+        write_appends()
+
+    def write_attrs(self, f, group, attrs):
+        group = f.require_group(group)
+        for key, value in attrs.items():
+            group.attrs[key] = value
+
+    def write_append(self, f, name, data):
+        if name not in f:
+            f.create_dataset(name, data=data, maxshape=(None,) + data.shape[1:],
+                             chunks=(self.chunk_size,) + data.shape[1:], compression=self.compression)
+        else:
+            dataset = f[name]
+            n = dataset.shape[0]
+            dataset.resize(n + data.shape[0], axis=0)
+            dataset[n:] = data
+
+    def write_dataset(self, f, name, data):
+        if name in f:
+            del f[name]
+
+        f.create_dataset(name, data=data, compression=self.compression if data.ndim > 0 else None)
+
+    def write_link(self, f, name, file_name, path):
+        if name in f:
+            del f[name]
+
+        f[name] = self.h5py.ExternalLink(file_name, path)
@@ -1,31 +1,54 @@
 import numpy as np
 from math import radians
+from functools import lru_cache
 from .util import get_rgba, rotx, roty, rotz, translate, scale
 
 class GlVertices:
     def __init__(self, vertices=None, colors=None, tex_coords=None):
-        self.vertices = vertices
-        self.colors = colors
-        self.tex_coords = tex_coords
+        self._vertices = vertices
+        self._colors = colors
+        self._tex_coords = tex_coords
+
+        # (vertices, colors, tex_coords) of objects added since the arrays were last built.  they are joined with a
+        # single concatenation when the arrays are next used, so that building a mesh from many small pieces takes
+        # linear rather than quadratic time.
+        self.pending = []
 
     def add(self, obj):
-        # add vertices
-        if self.vertices is None:
-            self.vertices = obj.vertices
-        else:
-            self.vertices = np.concatenate((self.vertices, obj.vertices), axis=1)
+        self.pending.append((obj.vertices, obj.colors, obj.tex_coords))
 
-        # add colors
-        if self.colors is None:
-            self.colors = obj.colors
-        else:
-            self.colors = np.concatenate((self.colors, obj.colors), axis=1)
+    def build(self):
+        if not self.pending:
+            return
 
-        # add tex_coords
-        if self.tex_coords is None:
-            self.tex_coords = obj.tex_coords
+        parts = self.pending
+        if self._vertices is not None:
+            parts = [(self._vertices, self._colors, self._tex_coords)] + parts
+        self.pending = []
+
+        self._vertices = np.concatenate([part[0] for part in parts], axis=1)
+        self._colors = np.concatenate([part[1] for part in parts], axis=1)
+
+        # tex_coords are only kept if every part has them
+        if all(part[2] is not None for part in parts):
+            self._tex_coords = np.concatenate([part[2] for part in parts], axis=1)
         else:
-            self.tex_coords = np.concatenate((self.tex_coords, obj.tex_coords), axis=1)
+            self._tex_coords = None
+
+    @property
+    def vertices(self):
+        self.build()
+        return self._vertices
+
+    @property
+    def colors(self):
+        self.build()
+        return self._colors
+
+    @property
+    def tex_coords(self):
+        self.build()
+        return self._tex_coords
 
     def rotx(self, th):
         return GlVertices(vertices=rotx(self.vertices, th), colors=self.colors, tex_coords=self.tex_coords)
@@ -111,7 +134,6 @@ class GlSphericalRect(GlVertices):
                  color=None,  # (r,g,b,a) or single value for monochrome, alpha = 1
                  n_steps_x=None,
                  n_steps_y=None):
-        super().__init__()
         if width is None:
             width = 20
         if height is None:
@@ -127,20 +149,8 @@ class GlSphericalRect(GlVertices):
         if n_steps_y is None:
             n_steps_y = 6
 
-        d_theta = (1/n_steps_x) * radians(width)
-        d_phi = (1/n_steps_y) * radians(height)
-        for rr in range(n_steps_y):
-            for cc in range(n_steps_x):
-                # render patch at the equator (phi=pi/2) so it's not near the poles
-                theta = radians(width) * (-1/2 + (cc/n_steps_x))
-                phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
-                v1 = self.sphericalToCartesian((sphere_radius, theta, phi))
-                v2 = self.sphericalToCartesian((sphere_radius, theta, phi + d_phi))
-                v3 = self.sphericalToCartesian((sphere_radius, theta + d_theta, phi))
-                v4 = self.sphericalToCartesian((sphere_radius, theta + d_theta, phi + d_phi))
-                self.add(GlTri(v1, v2, v4, color))
-                self.add(GlTri(v1, v3, v4, color))
-
+        vertices, colors = spherical_rect_arrays(width, height, sphere_radius, tuple(color), n_steps_x, n_steps_y)
+        super().__init__(vertices=vertices, colors=colors)
 
     def sphericalToCartesian(self, spherical_coords):
         r, theta, phi = spherical_coords
@@ -156,7 +166,6 @@ class GlSphericalCirc(GlVertices):
                  sphere_radius=None,  # meters
                  color=None,  # (r,g,b,a) or single value for monochrome, alpha = 1
                  n_steps=None):
-        super().__init__()
         if circle_radius is None:
             circle_radius = 10
         if sphere_radius is None:
@@ -168,19 +177,8 @@ class GlSphericalCirc(GlVertices):
         if n_steps is None:
             n_steps = 36
 
-        v_center = self.sphericalToCartesian((sphere_radius, 0, np.pi/2))
-
-        angles = np.linspace(0, 2*np.pi, n_steps+1)
-        for wedge in range(n_steps):
-            # render circle at the equator (phi=pi/2) so it's not near the poles
-            v1 = self.sphericalToCartesian((sphere_radius,
-                                            radians(circle_radius)*np.cos(angles[wedge]),
-                                            np.pi/2 + radians(circle_radius)*np.sin(angles[wedge])))
-            v2 = self.sphericalToCartesian((sphere_radius,
-                                            radians(circle_radius)*np.cos(angles[wedge+1]),
-                                            np.pi/2 + radians(circle_radius)*np.sin(angles[wedge+1])))
-
-            self.add(GlTri(v1, v2, v_center, color))
+        vertices, colors = spherical_circ_arrays(circle_radius, sphere_radius, tuple(color), n_steps)
+        super().__init__(vertices=vertices, colors=colors)
 
     def sphericalToCartesian(self, spherical_coords):
         r, theta, phi = spherical_coords
@@ -197,7 +195,6 @@ class GlCylinder(GlVertices):
                  color=None,  # (r,g,b,a) or single value for monochrome, alpha = 1
                  n_faces=None,
                  texture=False):
-        super().__init__()
         if cylinder_height is None:
             cylinder_height = 10
         if cylinder_radius is None:
@@ -211,21 +208,9 @@ class GlCylinder(GlVertices):
         if n_faces is None:
             n_faces = 64
 
-        d_theta = 2*np.pi / n_faces
-        for face in range(n_faces):
-            v1 = self.cylindricalToCartesian((cylinder_radius, face*d_theta, cylinder_height/2))
-            v2 = self.cylindricalToCartesian((cylinder_radius, face*d_theta, -cylinder_height/2))
-            v3 = self.cylindricalToCartesian((cylinder_radius, (face+1)*d_theta, -cylinder_height/2))
-            v4 = self.cylindricalToCartesian((cylinder_radius, (face+1)*d_theta, cylinder_height/2))
-
-            if texture:
-                self.add(GlQuad(v1, v2, v3, v4, color,
-                                tc1=(face/n_faces, 1),
-                                tc2=(face/n_faces, 0),
-                                tc3=((face+1)/n_faces, 0),
-                                tc4=((face+1)/n_faces, 1)).translate(cylinder_location))
-            else:
-                self.add(GlQuad(v1, v2, v3, v4, color).translate(cylinder_location))
+        vertices, colors, tex_coords = cylinder_arrays(cylinder_height, cylinder_radius, tuple(cylinder_location),
+                                                       tuple(color), n_faces, bool(texture))
+        super().__init__(vertices=vertices, colors=colors, tex_coords=tex_coords)
 
     def cylindricalToCartesian(self, cylindrical_coords):
         r, theta, z = cylindrical_coords
@@ -233,3 +218,95 @@ class GlCylinder(GlVertices):
                             r * np.sin(theta),
                             z)
         return cartesian_coords
+
+# Vectorized generators for the shapes above.  Each returns the full vertex, color and tex_coord arrays, with the
+# triangles in the same order as building the shape one GlTri at a time.  Results are cached by parameters, so
+# stimuli that rebuild the same shape every frame (e.g. before rotating it) only pay for the transform; the cached
+# arrays are read-only, since every transform of a GlVertices returns new arrays.
+
+# number of distinct shapes of each kind that are cached
+SHAPE_CACHE_SIZE = 32
+
+
+def spherical_to_cartesian(r, theta, phi):
+    return np.stack((r * np.sin(phi) * np.cos(theta),
+                     r * np.sin(phi) * np.sin(theta),
+                     r * np.cos(phi) * np.ones_like(theta)))
+
+
+def solid_colors(color, n_vertices):
+    return np.tile(np.array(color, dtype=float)[:, np.newaxis], (1, n_vertices))
+
+
+def read_only(*arrays):
+    for array in arrays:
+        if array is not None:
+            array.setflags(write=False)
+
+    return arrays
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def spherical_rect_arrays(width, height, sphere_radius, color, n_steps_x, n_steps_y):
+    d_theta = (1/n_steps_x) * radians(width)
+    d_phi = (1/n_steps_y) * radians(height)
+
+    # corners of each patch, indexed by (row, column).  the patch is rendered at the equator (phi=pi/2), so it's not
+    # near the poles
+    theta = radians(width) * (-1/2 + (np.arange(n_steps_x)/n_steps_x))
+    phi = np.pi/2 + radians(height) * (-1/2 + (np.arange(n_steps_y)/n_steps_y))
+    theta, phi = np.meshgrid(theta, phi)
+
+    v1 = spherical_to_cartesian(sphere_radius, theta, phi)
+    v2 = spherical_to_cartesian(sphere_radius, theta, phi + d_phi)
+    v3 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi)
+    v4 = spherical_to_cartesian(sphere_radius, theta + d_theta, phi + d_phi)
+
+    # two triangles per patch: (v1, v2, v4) and (v1, v3, v4)
+    vertices = np.stack((v1, v2, v4, v1, v3, v4), axis=-1).reshape((3, -1))
+
+    return read_only(vertices, solid_colors(color, vertices.shape[1]))
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def spherical_circ_arrays(circle_radius, sphere_radius, color, n_steps):
+    # one triangle per wedge, from the edge of the circle to its center, rendered at the equator
+    angles = np.linspace(0, 2*np.pi, n_steps+1)
+    edge = spherical_to_cartesian(sphere_radius,
+                                  radians(circle_radius)*np.cos(angles),
+                                  np.pi/2 + radians(circle_radius)*np.sin(angles))
+    center = np.tile(spherical_to_cartesian(sphere_radius, np.zeros(1), np.pi/2), (1, n_steps))
+
+    vertices = np.stack((edge[:, :-1], edge[:, 1:], center), axis=-1).reshape((3, -1))
+
+    return read_only(vertices, solid_colors(color, vertices.shape[1]))
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def cylinder_arrays(cylinder_height, cylinder_radius, cylinder_location, color, n_faces, texture):
+    d_theta = 2*np.pi / n_faces
+    face = np.arange(n_faces)
+
+    def cylindrical_to_cartesian(theta, z):
+        return np.stack((cylinder_radius * np.cos(theta),
+                         cylinder_radius * np.sin(theta),
+                         np.full(n_faces, z, dtype=float)))
+
+    v1 = cylindrical_to_cartesian(face*d_theta, cylinder_height/2)
+    v2 = cylindrical_to_cartesian(face*d_theta, -cylinder_height/2)
+    v3 = cylindrical_to_cartesian((face+1)*d_theta, -cylinder_height/2)
+    v4 = cylindrical_to_cartesian((face+1)*d_theta, cylinder_height/2)
+
+    # one quad per face, split into (v1, v2, v3) and (v1, v3, v4)
+    vertices = np.stack((v1, v2, v3, v1, v3, v4), axis=-1).reshape((3, -1))
+    vertices = translate(vertices, cylinder_location)
+
+    tex_coords = None
+    if texture:
+        tc1 = np.stack((face/n_faces, np.ones(n_faces)))
+        tc2 = np.stack((face/n_faces, np.zeros(n_faces)))
+        tc3 = np.stack(((face+1)/n_faces, np.zeros(n_faces)))
+        tc4 = np.stack(((face+1)/n_faces, np.ones(n_faces)))
+        tex_coords = np.stack((tc1, tc2, tc3, tc1, tc3, tc4), axis=-1).reshape((2, -1))
+
+    return read_only(vertices, solid_colors(color, vertices.shape[1]), tex_coords)
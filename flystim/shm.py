@@ -0,0 +1,91 @@
+# Shared-memory transport for the closed-loop pose of the fly.  Instead of sending every FicTrac sample over RPC, the
+# client writes the latest pose into a small block of shared memory, and each display process reads it once per frame.
+# Updates are protected by a sequence lock: the writer makes the sequence number odd while it writes, so readers can
+# detect and retry a torn read without ever blocking the writer.
+
+import numpy as np
+
+from multiprocessing import shared_memory, resource_tracker
+
+# layout of the shared block: sequence number, followed by the pose
+POSE_DTYPE = np.dtype([('seq', '<u8'), ('theta_offset', '<f8'), ('phi_offset', '<f8'), ('fly_pos', '<f8', (3,)),
+                       ('t', '<f8')])
+
+
+class SharedPose:
+    """
+    Latest pose of the fly (theta and phi offsets in degrees and position in meters, matching set_global_theta_offset,
+    set_global_phi_offset and set_global_fly_pos), kept in shared memory.
+    """
+
+    def __init__(self, name=None, create=False):
+        """
+        :param name: Name of the shared memory block.  If None, a unique name is chosen (only when creating).
+        :param create: If True, create the block (writer side).  Otherwise attach to an existing one (reader side).
+        """
+
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=POSE_DTYPE.itemsize)
+        self.owner = create
+
+        # only the creator should unlink the block when it exits
+        if not create:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        self.data = np.ndarray((), dtype=POSE_DTYPE, buffer=self.shm.buf)
+        self.seq = self.data['seq']
+
+        if create:
+            self.data[()] = (0, 0.0, 0.0, (0.0, 0.0, 0.0), 0.0)
+
+        # sequence number of the last pose returned by read()
+        self.last_seq = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, theta_offset=0.0, phi_offset=0.0, fly_pos=(0.0, 0.0, 0.0), t=0.0):
+        """
+        Writes a new pose.  Only one process may write to a given block.
+        :param t: time stamp of the pose (e.g., time.time() when it was measured), passed through to readers
+        """
+
+        seq = int(self.seq)
+
+        # odd sequence number: write in progress
+        self.seq[...] = seq + 1
+        self.data['theta_offset'] = theta_offset
+        self.data['phi_offset'] = phi_offset
+        self.data['fly_pos'] = fly_pos
+        self.data['t'] = t
+        self.seq[...] = seq + 2
+
+    def read(self):
+        """
+        Returns the latest pose as a dictionary, or None if it has not changed since the last call.
+        """
+
+        while True:
+            seq = int(self.seq)
+            if seq == self.last_seq:
+                return None
+            if seq % 2 == 1:
+                continue
+
+            pose = self.data.copy()
+            if int(self.seq) == seq:
+                break
+
+        self.last_seq = seq
+
+        return {'seq': seq//2, 'theta_offset': float(pose['theta_offset']), 'phi_offset': float(pose['phi_offset']),
+                'fly_pos': pose['fly_pos'].tolist(), 't': float(pose['t'])}
+
+    def close(self):
+        # release the numpy views before the memory itself
+        del self.seq
+        del self.data
+
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
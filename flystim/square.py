@@ -1,6 +1,5 @@
 # ref: https://github.com/cprogrammer1994/ModernGL/blob/master/examples/julia_fractal.py
 
-import os.path
 import random
 from time import time
 
@@ -8,6 +7,9 @@ from time import time
 import moderngl
 import numpy as np
 
+from flystim.gl_cache import get_program, shader_source
+from flystim.sync import mseq
+
 # bounds on square flicker frequency
 # min is somewhat arbitrary - I think there is a trade-off between alignment accuracy
 #  (sequence uniqueness) and minimum alignable window size (?), but shouldn't be that big of a deal
@@ -18,6 +20,9 @@ MAX_SQUARE_FREQ = 100
 MIN_TOGGLE_FREQ = MIN_SQUARE_FREQ * 2
 MAX_TOGGLE_FREQ = MAX_SQUARE_FREQ * 2
 
+# ways of choosing the square color on each frame (see SquareProgram.set_mode)
+SQUARE_MODES = ['random', 'seeded', 'mseq']
+
 
 class SquareProgram:
     def __init__(self, screen):
@@ -32,6 +37,10 @@ class SquareProgram:
         self.dwell_time = 0
         self.draw = True
 
+        # frame-driven toggling
+        self.frame_index = 0
+        self.set_mode('random')
+
         #self.profile_frame_count = 0
 
     def initialize(self, ctx):
@@ -42,13 +51,9 @@ class SquareProgram:
         # save context
         self.ctx = ctx
 
-        # find path to shader directory
-        this_file_path = os.path.realpath(os.path.expanduser(__file__))
-        shader_dir = os.path.join(os.path.dirname(os.path.dirname(this_file_path)), 'shaders')
-
         # create OpenGL program
-        self.prog = self.ctx.program(vertex_shader=open(os.path.join(shader_dir, 'square.vert'), 'r').read(),
-                                     fragment_shader=open(os.path.join(shader_dir, 'square.frag'), 'r').read())
+        self.prog = get_program(self.ctx, vertex_shader=shader_source('square.vert'),
+                                fragment_shader=shader_source('square.frag'))
 
         # create VBO to represent vertex positions
         pts = self.make_vert_pts()
@@ -95,7 +100,71 @@ class SquareProgram:
         # return vertex point data
         return np.array([x_min, y_min, x_max, y_min, x_min, y_max, x_max, y_max])
 
+    def set_mode(self, mode='random', seed=0, n_bits=15, frames_per_bit=1):
+        """
+        Sets how the square toggles.
+        :param mode: 'random': dwell times are drawn at random and measured with the wall clock (default).
+        'seeded': dwell times are drawn from a random number generator with the given seed and counted in frames, so
+        the pattern is reproducible.
+        'mseq': the square shows a maximal-length sequence indexed by the frame counter, so that any n_bits consecutive
+        bits give the frame number (modulo the sequence period) directly (see flystim.sync.MSequenceDecoder).
+        :param seed: seed of the 'seeded' mode
+        :param n_bits: register length of the 'mseq' mode.  The sequence repeats every 2**n_bits - 1 bits.
+        :param frames_per_bit: number of frames that each bit of the 'mseq' mode is shown for, so that slower cameras
+        can resolve it
+        """
+
+        if mode not in SQUARE_MODES:
+            raise ValueError('Invalid square mode: {}'.format(mode))
+
+        self.mode = mode
+        self.frame_index = 0
+
+        if mode == 'seeded':
+            self.rng = np.random.RandomState(seed)
+            self.dwell_frames = 0
+        elif mode == 'mseq':
+            self.code = mseq(n_bits)
+            self.frames_per_bit = frames_per_bit
+
+        # the color of the first frame
+        if mode != 'random':
+            self.toggle_square()
+
+    def advance_frame(self):
+        """
+        Called after each frame is drawn.
+        """
+
+        self.frame_index += 1
+
+        if self.toggle:
+            self.toggle_square()
+
     def toggle_square(self):
+        """
+        Chooses the color of the next frame.
+        """
+
+        if self.mode == 'seeded':
+            self.toggle_seeded()
+        elif self.mode == 'mseq':
+            bit = self.code[(self.frame_index // self.frames_per_bit) % len(self.code)]
+            self.color = float(bit)
+        else:
+            self.toggle_random()
+
+    def toggle_seeded(self):
+        if self.dwell_frames <= 0:
+            if self.frame_index > 0:
+                self.color = 1.0 - self.color
+
+            dwell_time = self.rng.uniform(1 / MAX_TOGGLE_FREQ, 1 / MIN_TOGGLE_FREQ)
+            self.dwell_frames = max(int(round(dwell_time * self.screen.refresh_rate)), 1)
+
+        self.dwell_frames -= 1
+
+    def toggle_random(self):
         """ Called on every frame. Guaranteed to never exceed MAX_SQUARE_FREQ
         May violate MIN_SQUARE_FREQ, depending on flystim performance
         """
@@ -118,5 +187,4 @@ class SquareProgram:
         #if self.save_square_history:
         #    self.square_history[self.profile_frame_count] = int(self.color)
 
-        if self.toggle:
-            self.toggle_square()
+        self.advance_frame()
@@ -0,0 +1,63 @@
+# Lightweight timing of process startup, used to find slow imports and initialization steps in the subprocesses
+# that display stimuli.  The report is similar in spirit to "python -X importtime", but only covers the steps that
+# are explicitly wrapped.
+
+import sys
+import json
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class StartupTimer:
+    def __init__(self):
+        # all times are reported relative to the creation of the timer
+        self.t0 = perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        """
+        Context manager that records the duration of the code it wraps, along with the number of modules that were
+        imported as a side effect.
+        :param name: Descriptive name of the step
+        """
+
+        start = perf_counter()
+        n_modules = len(sys.modules)
+
+        try:
+            yield
+        finally:
+            self.steps.append({'name': name,
+                               'start': start - self.t0,
+                               'duration': perf_counter() - start,
+                               'new_modules': len(sys.modules) - n_modules})
+
+    def mark(self, name):
+        """
+        Records a point in time (e.g., the first frame being drawn) as a step of zero duration.
+        """
+
+        self.steps.append({'name': name, 'start': perf_counter() - self.t0, 'duration': 0.0, 'new_modules': 0})
+
+    def has_mark(self, name):
+        return any(step['name'] == name for step in self.steps)
+
+    def report(self):
+        total = max((step['start'] + step['duration'] for step in self.steps), default=0.0)
+        return {'total': total, 'steps': list(self.steps)}
+
+    def format_report(self):
+        lines = ['{:>12} | {:>12} | {:>7} | {}'.format('start [ms]', 'self [ms]', 'modules', 'step')]
+        for step in self.steps:
+            lines.append('{:>12.1f} | {:>12.1f} | {:>7} | {}'.format(1e3*step['start'], 1e3*step['duration'],
+                                                                   step['new_modules'], step['name']))
+        return '\n'.join(lines)
+
+    def save_report(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# timer shared by the whole process
+startup_timer = StartupTimer()
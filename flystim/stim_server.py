@@ -1,8 +1,8 @@
 import platform
+import os.path
 
 from time import time
 
-import flystim.framework
 from flystim.screen import Screen
 from flystim.util import listify
 
@@ -20,10 +20,16 @@ def launch_screen(screen):
 
     # set the arguments as necessary
     new_env_vars = {}
-    if platform.system() in ['Linux', 'Darwin']:
+    if platform.system() in ['Linux', 'Darwin'] and not screen.headless:
         new_env_vars['DISPLAY'] = ':{}.{}'.format(screen.server_number, screen.id)
-    # launch the server and return the resulting client
-    return launch_server(flystim.framework, screen=screen.serialize(), new_env_vars=new_env_vars)
+
+    # headless screens are rendered offscreen by a display program that does not use Qt
+    program = 'headless.py' if screen.headless else 'framework.py'
+
+    # launch the server and return the resulting client.  the display program is referred to by its path so
+    # that this process does not have to import Qt and the stimulus classes.
+    program_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), program)
+    return launch_server(program_path, screen=screen.serialize(), new_env_vars=new_env_vars)
 
 
 class StimServer(MySocketServer):
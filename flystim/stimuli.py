@@ -279,8 +279,9 @@ class MovingPatch(BaseProgram):
         if trajectory is None:
             trajectory = RectangleTrajectory().to_dict()
 
-        # convert the input dictionary to a trajectory object
-        trajectory = RectangleTrajectory.from_dict(trajectory)
+        # convert the input dictionary to a trajectory object (trajectories from a TrajectoryBank are objects already)
+        if not isinstance(trajectory, RectangleTrajectory):
+            trajectory = RectangleTrajectory.from_dict(trajectory)
 
         return super().make_config_options(*args, trajectory=trajectory, **kwargs)
 
@@ -490,7 +491,7 @@ class GridStim(BaseProgram):
         self.texture = ctx.texture((self.max_theta, self.max_phi), 1, patches.tobytes(), dtype='f4')
         self.texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
         self.texture.swizzle = 'RRR1'
-        self.texture.use()
+        self.texture.use(location=self.texture_unit)
 
         super().initialize(ctx)
 
@@ -537,7 +538,7 @@ class RandomGrid(GridStim):
 
         # write to GPU
         self.texture.write(face_colors.astype('f4'))
-        self.texture.use()
+        self.texture.use(location=self.texture_unit)
 
 class Checkerboard(GridStim):
     # changing to cylinder style
@@ -563,7 +564,7 @@ class Checkerboard(GridStim):
         self.texture.write(face_colors.astype('f4'))
 
     def eval_at(self, t):
-        self.texture.use()
+        self.texture.use(location=self.texture_unit)
 
 class ArbitraryGrid(BaseProgram):
     # changing to cylinder style
@@ -611,7 +612,7 @@ class ArbitraryGrid(BaseProgram):
         self.texture = self.ctx.texture((num_theta, num_phi), 1, patches.tobytes(), dtype='f4')
         self.texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
         self.texture.swizzle = 'RRR1'
-        self.texture.use()
+        self.texture.use(location=self.texture_unit)
 
     def configure(self, stixel_size = 10, num_theta = 20, num_phi = 20, t_dim = 100, update_rate = 30,
                   center_theta = 0, center_phi = 0, background = 0.5,
@@ -648,7 +649,7 @@ class ArbitraryGrid(BaseProgram):
             self.stimulus_code = np.zeros((self.num_phi, self.num_theta, self.t_dim))
 
         if encoding_scheme == 'ternary_dense':
-            self.xyt_stimulus = np.array(self.stimulus_code).reshape(self.num_phi, self.num_theta, self.t_dim)
+            self.xyt_stimulus = np.asarray(self.stimulus_code).reshape(self.num_phi, self.num_theta, self.t_dim)
 
         elif encoding_scheme == 'single_spot':
             row, col = self.getRowColumnFromLocation(self.stimulus_code, self.num_phi, self.num_theta)
@@ -671,4 +672,4 @@ class ArbitraryGrid(BaseProgram):
 
             # write to GPU
             self.texture.write(face_colors.astype('f4'))
-            self.texture.use()
+            self.texture.use(location=self.texture_unit)
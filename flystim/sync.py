@@ -0,0 +1,248 @@
+# Frame-exact alignment of the sync square.  The square recorded by flystim (StimEngine.save_history) and the square
+# seen by a photodiode or camera (e.g., FicTrac's sync_mean column) are both reduced to run lengths, i.e., the number
+# of frames between toggles.  Because SquareProgram toggles after random dwell times, a short sequence of consecutive
+# run lengths is almost always unique, so the recorded runs are indexed by their k-grams and each k-gram seen by the
+# camera is looked up in O(1).  The whole alignment is therefore linear in the length of the session.
+#
+# When the square encodes the frame counter with a maximal-length sequence instead (see SquareProgram.set_mode), any
+# n_bits consecutive bits give the position in the sequence directly, and MSequenceDecoder replaces the search.
+
+import numpy as np
+
+from functools import lru_cache
+
+# feedback taps of maximal-length Fibonacci LFSRs, by register length
+# ref: https://en.wikipedia.org/wiki/Linear-feedback_shift_register#Example_polynomials_for_maximal_LFSRs
+LFSR_TAPS = {5: (5, 3), 7: (7, 6), 9: (9, 5), 10: (10, 7), 11: (11, 9), 15: (15, 14), 16: (16, 15, 13, 4),
+             17: (17, 14), 20: (20, 17)}
+
+
+def binarize(trace, threshold=None):
+    """
+    Converts an analog trace of the sync square (e.g., mean pixel intensity) to 0/1 values.
+    :param threshold: If None, the midpoint between the 5th and 95th percentiles is used.
+    """
+
+    trace = np.asarray(trace, dtype=float)
+
+    if threshold is None:
+        threshold = 0.5*(np.percentile(trace, 5) + np.percentile(trace, 95))
+
+    return (trace > threshold).astype(int)
+
+
+def run_lengths(values):
+    """
+    :return: start index, length and value of each run of equal values
+    """
+
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), values
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(values)])))
+
+    return starts, lengths, values[starts]
+
+
+class SyncAlignment:
+    """
+    Result of aligning the recorded square history with a camera or photodiode trace.
+    """
+
+    def __init__(self, frame_times, dropped_frames, dropped_counts, matched_runs, total_runs):
+        # time (in the camera's clock) at which each recorded frame appeared, or NaN if it could not be aligned
+        self.frame_times = frame_times
+
+        # recorded frames that stayed on screen longer than expected, and by how many frame periods
+        self.dropped_frames = dropped_frames
+        self.dropped_counts = dropped_counts
+
+        # fraction of the recorded runs that were matched to the camera trace
+        self.matched_fraction = matched_runs/total_runs if total_runs > 0 else 0.0
+
+    @property
+    def n_dropped(self):
+        return int(np.sum(self.dropped_counts))
+
+
+class SyncDecoder:
+    """
+    Index of the square history recorded by flystim, used to align one or more camera traces against it.
+    """
+
+    def __init__(self, square_history, k=8):
+        """
+        :param square_history: value of the sync square on each displayed frame (e.g., the _fs_square.txt history)
+        :param k: number of consecutive runs used as a key.  Larger values are more unique, but each dropped frame
+        prevents k keys from matching.
+        """
+
+        self.k = k
+        self.n_frames = len(square_history)
+        self.starts, self.lengths, self.values = run_lengths(np.round(square_history).astype(int))
+
+        # index the k-grams of run lengths, keeping only the ones that occur once
+        self.index = {}
+        for i in range(len(self.lengths) - k + 1):
+            key = tuple(self.lengths[i:i+k])
+            self.index[key] = None if key in self.index else i
+
+    def lookup(self, key):
+        return self.index.get(key)
+
+    def decode(self, camera_times, camera_sync, frame_period, threshold=None, max_drop=0.5):
+        """
+        Aligns a camera trace with the recorded square history.
+        :param camera_times: time of each camera sample (seconds)
+        :param camera_sync: sync square as seen by the camera (analog or 0/1)
+        :param frame_period: display frame period (seconds), e.g. 1/120
+        :param max_drop: a run that lasts more than this many frame periods longer than recorded counts as having
+        dropped frames
+        :return: SyncAlignment
+        """
+
+        camera_times = np.asarray(camera_times, dtype=float)
+        cam_starts, _, cam_values = run_lengths(binarize(camera_sync, threshold=threshold))
+
+        # duration of each camera run in display frames.  the first and last runs are incomplete, so they are not used.
+        cam_start_times = camera_times[cam_starts]
+        cam_durations = np.diff(cam_start_times)/frame_period
+        cam_lengths = np.round(cam_durations).astype(int)
+        n_cam_runs = len(cam_lengths)
+
+        # find anchors: camera runs whose k-gram identifies a unique recorded run
+        anchors_cam = []
+        anchors_rec = []
+        for j in range(n_cam_runs - self.k + 1):
+            i = self.lookup(tuple(cam_lengths[j:j+self.k]))
+            if i is not None and cam_values[j] == self.values[i]:
+                anchors_cam.append(j)
+                anchors_rec.append(i)
+
+        frame_times = np.full(self.n_frames, np.nan)
+        if not anchors_cam:
+            return SyncAlignment(frame_times, np.zeros(0, dtype=int), np.zeros(0, dtype=int), 0, len(self.lengths))
+
+        anchors_cam = np.array(anchors_cam)
+        offsets = np.array(anchors_rec) - anchors_cam
+
+        # between anchors, runs correspond one to one, so every camera run gets the offset of the closest anchor at or
+        # before it (or the first anchor)
+        j = np.arange(1, n_cam_runs)
+        nearest = np.clip(np.searchsorted(anchors_cam, j, side='right') - 1, 0, len(anchors_cam) - 1)
+        i = j + offsets[nearest]
+
+        valid = (i >= 0) & (i < len(self.lengths))
+        valid[valid] &= cam_values[j[valid]] == self.values[i[valid]]
+        j, i = j[valid], i[valid]
+
+        # a run with more frames than recorded means that its last frame was held on the screen
+        extra = cam_durations[j] - self.lengths[i]
+        dropped = extra > max_drop
+        dropped_frames = self.starts[i[dropped]] + self.lengths[i[dropped]] - 1
+        dropped_counts = np.round(extra[dropped]).astype(int)
+
+        # each frame of a run appears one frame period after the previous one
+        lengths = self.lengths[i]
+        within = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        frames = np.repeat(self.starts[i], lengths) + within
+        frame_times[frames] = np.repeat(cam_start_times[j], lengths) + frame_period*within
+
+        return SyncAlignment(frame_times, dropped_frames, dropped_counts, len(i), len(self.lengths))
+
+
+@lru_cache(maxsize=None)
+def mseq(n_bits=15):
+    """
+    Returns one period (2**n_bits - 1 bits) of a maximal-length sequence.  Every window of n_bits consecutive bits,
+    taken cyclically, occurs exactly once per period.
+    """
+
+    taps = LFSR_TAPS[n_bits]
+    period = (1 << n_bits) - 1
+
+    bits = np.zeros(period, dtype=np.uint8)
+    state = 1
+    for k in range(period):
+        bits[k] = state & 1
+        feedback = 0
+        for tap in taps:
+            feedback ^= (state >> (n_bits - tap)) & 1
+        state = (state >> 1) | (feedback << (n_bits - 1))
+
+    bits.flags.writeable = False
+
+    return bits
+
+
+def window_codes(bits, n_bits):
+    """
+    Returns the integer formed by each window of n_bits consecutive bits, with the first bit as the most significant.
+    """
+
+    bits = np.asarray(bits, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(bits, n_bits)
+
+    return windows.dot(1 << np.arange(n_bits - 1, -1, -1))
+
+
+class MSequenceDecoder:
+    """
+    Converts bits of a maximal-length sequence back into their position in the sequence with a lookup table.
+    """
+
+    def __init__(self, n_bits=15):
+        self.n_bits = n_bits
+        self.period = (1 << n_bits) - 1
+
+        # position of the first bit of every window, indexed by the window's code (code 0 never occurs)
+        bits = mseq(n_bits)
+        codes = window_codes(np.concatenate((bits, bits[:n_bits-1])), n_bits)
+        self.table = np.full(1 << n_bits, -1, dtype=np.int64)
+        self.table[codes] = np.arange(self.period)
+
+    def decode(self, bits):
+        """
+        :param bits: consecutive bits of the sequence (e.g., the recorded square history, one bit per frame)
+        :return: position in the sequence of each bit, or -1 where it could not be decoded.  Positions are decoded
+        from the window starting at each bit, and the last n_bits-1 bits are extrapolated from the window before them.
+        """
+
+        bits = np.round(np.asarray(bits)).astype(np.int64)
+        positions = np.full(len(bits), -1, dtype=np.int64)
+        if len(bits) < self.n_bits:
+            return positions
+
+        positions[:len(bits)-self.n_bits+1] = self.table[window_codes(bits, self.n_bits)]
+
+        last = positions[len(bits)-self.n_bits]
+        if last >= 0:
+            positions[len(bits)-self.n_bits+1:] = (last + np.arange(1, self.n_bits)) % self.period
+
+        return positions
+
+    def decode_trace(self, camera_times, camera_sync, bit_period, threshold=None):
+        """
+        Decodes a camera or photodiode trace of the square directly.
+        :param bit_period: duration of one bit on the screen (seconds), i.e., frames_per_bit times the frame period
+        :return: start time (in the camera's clock) and position in the sequence of each bit seen by the camera,
+        with positions of -1 where a window could not be decoded (e.g., at dropped frames)
+        """
+
+        camera_times = np.asarray(camera_times, dtype=float)
+        cam_starts, _, cam_values = run_lengths(binarize(camera_sync, threshold=threshold))
+
+        # split each complete run into bits
+        run_times = camera_times[cam_starts]
+        n_bits = np.maximum(np.round(np.diff(run_times)/bit_period).astype(int), 1)
+        within = np.arange(np.sum(n_bits)) - np.repeat(np.cumsum(n_bits) - n_bits, n_bits)
+
+        bit_times = np.repeat(run_times[:-1], n_bits) + bit_period*within
+        bits = np.repeat(cam_values[:-1], n_bits)
+
+        # the first run may have started before the camera, so it is skipped
+        skip = n_bits[0]
+
+        return bit_times[skip:], self.decode(bits[skip:])
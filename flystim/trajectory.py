@@ -1,4 +1,4 @@
-from scipy.interpolate import interp1d
+import numpy as np
 
 class Trajectory:
     def __init__(self, tv_pairs, kind='linear'):
@@ -8,7 +8,14 @@ class Trajectory:
         # define interpolation function
         # ref: https://stackoverflow.com/questions/2184955/test-if-a-variable-is-a-list-or-tuple
         if hasattr(tv_pairs, '__iter__'):
-            times, values = zip(*tv_pairs)
+            # scipy is slow to import, so it is only loaded when a time-varying trajectory is used
+            from scipy.interpolate import interp1d
+
+            if isinstance(tv_pairs, np.ndarray):
+                # (N, 2) array of times and values, e.g. decoded by flystim.wire
+                times, values = tv_pairs[:, 0], tv_pairs[:, 1]
+            else:
+                times, values = zip(*tv_pairs)
             self.eval_at = interp1d(times, values, kind=self.kind, fill_value='extrapolate')
         else:
             self.eval_at = lambda t: self.tv_pairs
@@ -53,3 +60,38 @@ class RectangleTrajectory:
         return RectangleTrajectory(x=Trajectory.from_dict(d['x']), y=Trajectory.from_dict(d['y']),
                                    w=Trajectory.from_dict(d['w']), h=Trajectory.from_dict(d['h']),
                                    angle=Trajectory.from_dict(d['angle']), color=Trajectory.from_dict(d['color']))
+
+class TrajectoryBank:
+    """
+    Trajectories uploaded to a display once per session and referred to by name afterwards, so that the interpolation
+    functions are built once and stimuli can be loaded with a short name instead of the full list of points.
+    """
+
+    def __init__(self):
+        self.trajectories = {}
+
+    def add(self, trajectory_id, trajectory):
+        """
+        :param trajectory: RectangleTrajectory, or RectangleTrajectory converted to dictionary (to_dict method)
+        """
+
+        if not isinstance(trajectory, RectangleTrajectory):
+            trajectory = RectangleTrajectory.from_dict(trajectory)
+
+        self.trajectories[trajectory_id] = trajectory
+
+    def get(self, trajectory_id):
+        try:
+            return self.trajectories[trajectory_id]
+        except KeyError:
+            raise KeyError('Trajectory {} has not been uploaded.'.format(trajectory_id))
+
+    def clear(self):
+        self.trajectories = {}
+
+    def __contains__(self, trajectory_id):
+        return trajectory_id in self.trajectories
+
+    def __len__(self):
+        return len(self.trajectories)
+
@@ -0,0 +1,70 @@
+# Trial structures for experiments with a fixed set of conditions, e.g. the coherent and incoherent trajectories of the
+# ballrig examples.  Every trajectory used by a condition is uploaded to the displays once per session (see
+# StimEngine.upload_trajectory), and each trial then loads its stimuli by trajectory name, so that a trial costs a few
+# bytes over RPC instead of the whole list of trajectory points, e.g.:
+#
+# trials = TrialStructure({'coh_r': [('MovingPatch', {'trajectory': coh_bar_r, 'hold': True})],
+#                          'inc_r': [('MovingPatch', {'trajectory': inc_bar_r, 'hold': True})]})
+# trials.upload(manager)
+# for label in trials.sequence(n_repeats=10):
+#     trials.load(manager, label)
+
+import numpy as np
+
+from flystim.trajectory import RectangleTrajectory
+from flystim.wire import encode
+
+
+class TrialStructure:
+    def __init__(self, conditions):
+        """
+        :param conditions: dictionary that maps each condition label to the stimuli of its trials, as a list of
+        (stimulus name, keyword arguments of load_stim) pairs.  The trajectory argument may be a RectangleTrajectory,
+        which is uploaded once even if several conditions use it.
+        """
+
+        self.conditions = {}
+        self.trajectories = {}
+
+        # name each distinct trajectory object
+        names = {}
+        for label, stims in conditions.items():
+            self.conditions[label] = []
+            for name, kwargs in stims:
+                kwargs = dict(kwargs)
+                trajectory = kwargs.get('trajectory')
+
+                if isinstance(trajectory, RectangleTrajectory):
+                    if id(trajectory) not in names:
+                        names[id(trajectory)] = '{}_{}'.format(label, len(self.trajectories))
+                        self.trajectories[names[id(trajectory)]] = trajectory
+                    kwargs['trajectory'] = names[id(trajectory)]
+
+                self.conditions[label].append((name, kwargs))
+
+    @property
+    def labels(self):
+        return list(self.conditions)
+
+    def upload(self, manager):
+        """
+        Uploads every trajectory to the displays.  Should be called once, before the first trial.
+        """
+
+        for trajectory_id, trajectory in self.trajectories.items():
+            manager.upload_trajectory(trajectory_id, encode(trajectory.to_dict()))
+
+    def load(self, manager, label):
+        """
+        Loads the stimuli of a trial of the given condition.
+        """
+
+        for name, kwargs in self.conditions[label]:
+            manager.load_stim(name, **kwargs)
+
+    def sequence(self, n_repeats, seed=None):
+        """
+        :return: list of condition labels with each condition repeated n_repeats times, in random order
+        """
+
+        return np.random.RandomState(seed).permutation(np.repeat(self.labels, n_repeats)).tolist()
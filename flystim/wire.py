@@ -0,0 +1,100 @@
+# Wire format for NumPy arrays in RPC payloads.  flyrpc sends every call as JSON, so an array sent as a nested list
+# is encoded and parsed one Python float at a time.  Instead, arrays are packed into a small dictionary with their
+# dtype, shape and raw bytes (base64-encoded, since JSON has no binary type), and unpacked on the display side with
+# np.frombuffer, which is a view of the decoded bytes rather than a copy.  Arrays anywhere in the arguments of a call
+# are tagged as {'__ndarray__': {...}}, so they can be found and decoded without knowing the signature of the call.
+
+import base64
+import numpy as np
+
+from functools import wraps
+
+ARRAY_TAG = '__ndarray__'
+
+
+def encode_array(arr):
+    """
+    Packs a numpy array into a JSON-compatible dictionary, with the raw bytes of the array base64-encoded.
+    """
+
+    arr = np.ascontiguousarray(arr)
+
+    return {
+        'dtype': arr.dtype.str,
+        'shape': list(arr.shape),
+        'data': base64.b64encode(arr.tobytes()).decode('ascii')
+    }
+
+
+def decode_array(data):
+    """
+    Inverse of encode_array.  The result is a read-only view of the decoded bytes.
+    """
+
+    return np.frombuffer(base64.b64decode(data['data']), dtype=data.get('dtype', 'f4')).reshape(data['shape'])
+
+
+def encode(obj):
+    """
+    Returns a copy of obj (e.g., the arguments of an RPC call) in which every numpy array is replaced by its tagged
+    encoding.  Dictionaries, lists and tuples are searched recursively.
+    """
+
+    if isinstance(obj, np.ndarray):
+        return {ARRAY_TAG: encode_array(obj)}
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, dict):
+        return {key: encode(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [encode(value) for value in obj]
+    else:
+        return obj
+
+
+def decode(obj):
+    """
+    Inverse of encode.  Plain JSON data is returned unchanged.
+    """
+
+    if isinstance(obj, dict):
+        if ARRAY_TAG in obj:
+            return decode_array(obj[ARRAY_TAG])
+        return {key: decode(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        # lists of numbers (e.g., from clients that do not encode arrays) are returned without being rebuilt
+        if not any(isinstance(value, (dict, list)) for value in obj):
+            return obj
+        return [decode(value) for value in obj]
+    else:
+        return obj
+
+
+def decode_args(function):
+    """
+    Wraps an RPC function so that arrays in its arguments are decoded before it is called.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        return function(*[decode(arg) for arg in args], **decode(kwargs))
+
+    return wrapper
+
+
+class EncodingClient:
+    """
+    Wraps a client returned by launch_stim_server so that numpy arrays can be passed directly as arguments, e.g.
+    EncodingClient(manager).load_stim('ArbitraryGrid', stimulus_code=code).
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        function = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            return function(*[encode(arg) for arg in args], **encode(kwargs))
+
+        return call
@@ -18,11 +18,15 @@ setup(
 	    'hidapi',
         'pandas',
         'json-rpc',
-        'matplotlib'
+        'matplotlib',
+        'h5py'
     ],
     entry_points={
         'console_scripts': [
-            'lcr_ctl=examples.lcr_ctl:main'
+            'lcr_ctl=examples.lcr_ctl:main',
+            'flystim_export=flystim.export:main',
+            'flystim_bench=flystim.bench:main',
+            'flystim_rpc_bench=flystim.rpc_bench:main'
         ]
     },
     include_package_data=True,
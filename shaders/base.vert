@@ -7,16 +7,32 @@
 in vec2 vert_pos;
 in vec3 vert_col;
 
+#ifdef USE_WARP
+// 3D positions of the screen, indexed by NDC coordinates
+uniform sampler2D warp_map;
+#endif
+
 ////////////////
 // output
 ////////////////
 
 out vec3 pixel_pos;
 
+#ifdef USE_WARP
+out vec2 warp_coord;
+#endif
+
 void main() {
     // pass along (interpolated) vertex color to the fragment shader as the 3D pixel coordinates
     pixel_pos = vert_col;
 
+#ifdef USE_WARP
+    // map NDC [-1, +1] onto the centers of the first and last texels of the warp map, so that the grid nodes at the
+    // edges of the screen are sampled exactly
+    vec2 warp_size = vec2(textureSize(warp_map, 0));
+    warp_coord = ((0.5*vert_pos + 0.5)*(warp_size - 1.0) + 0.5)/warp_size;
+#endif
+
     // assign gl_Position
     gl_Position = vec4(vert_pos, 0.0, 1.0);
 }
\ No newline at end of file
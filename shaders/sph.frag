@@ -0,0 +1,40 @@
+#version 330
+
+////////////////
+// inputs
+////////////////
+
+// from vertex shader
+in vec3 pixel_pos;
+
+#ifdef USE_WARP
+// 3D positions of the screen, sampled per pixel instead of being interpolated across triangles
+uniform sampler2D warp_map;
+in vec2 warp_coord;
+#endif
+
+// position of the fly
+uniform vec3 global_fly_pos;
+
+////////////////
+// output
+////////////////
+
+// spherical coordinates (r, theta, phi) of this pixel relative to the fly
+out vec4 out_sph;
+
+void main() {
+    // find position of this pixel relative to fly
+#ifdef USE_WARP
+    vec3 pos = texture(warp_map, warp_coord).xyz - global_fly_pos;
+#else
+    vec3 pos = pixel_pos - global_fly_pos;
+#endif
+
+    // compute screen position in spherical coordinates
+    float r     = length(pos);
+    float phi   = acos(pos.z / r);
+    float theta = atan(pos.y, pos.x);
+
+    out_sph = vec4(r, theta, phi, 1.0);
+}
\ No newline at end of file
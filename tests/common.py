@@ -3,11 +3,18 @@ import numpy as np
 from PIL import Image
 from PyQt5 import QtOpenGL, QtWidgets
 
+from flystim.headless import default_backend
+
 
 class HeadlessDisplay:
     def __init__(self, width=512, height=512):
         # Create an OpenGL context
-        self.ctx = moderngl.create_context(standalone=True, size=(width, height))
+        # (EGL is used when there is no display, e.g. on CI machines)
+        backend = default_backend()
+        if backend is None:
+            self.ctx = moderngl.create_context(standalone=True, size=(width, height))
+        else:
+            self.ctx = moderngl.create_context(standalone=True, size=(width, height), backend=backend)
         self.ctx.enable(moderngl.DEPTH_TEST)
         self.ctx.enable(moderngl.BLEND)
 
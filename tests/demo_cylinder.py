@@ -30,7 +30,16 @@ def register_cave(display):
 
     t0 = time()
     omega = 20
-    display.render_actions.append(lambda: cave.render(GlCylinder(texture=True).rotz(radians(omega*(time()-t0))).rotx(radians(0)), texture_img=img))
+
+    # the texture is created on the first frame, once the GL context exists, and reused afterwards
+    texture = []
+
+    def render():
+        if not texture:
+            texture.append(cave.create_texture(img))
+        cave.render(GlCylinder(texture=True).rotz(radians(omega*(time()-t0))).rotx(radians(0)), texture=texture[0])
+
+    display.render_actions.append(render)
 
 
 if __name__ == '__main__':
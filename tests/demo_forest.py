@@ -2,7 +2,7 @@ from math import radians
 from time import time
 import numpy as np
 
-from flystim import GenPerspective, GlCylinder, CaveSystem
+from flystim import GenPerspective, GlCylinder, CaveSystem, model_rotz, model_translate
 from common import run_qt
 
 def get_perspective(theta, phi):
@@ -27,9 +27,19 @@ def register_cave(display, omega=0):
     xx = np.random.uniform(-2, 0, size=n_trees)
     yy = np.random.uniform(-3, 3, size=n_trees)
 
+    # the trees share one mesh, which is uploaded once, and the forest rotates as a whole
+    tree = GlCylinder(cylinder_height=height, cylinder_radius=radius)
+    forest = cave.scene.add()
     for t in range(n_trees):
-        new_obj = GlCylinder(cylinder_height=height, cylinder_radius=radius, cylinder_location=(xx[t], yy[t],+height/2))
-        display.render_actions.append(lambda: cave.render(new_obj))
+        forest.add(tree, model=model_translate((xx[t], yy[t], +height/2)))
+
+    t0 = time()
+
+    def render():
+        forest.model = model_rotz(radians(omega*(time()-t0)))
+        cave.render_scene()
+
+    display.render_actions.append(render)
 
 if __name__ == '__main__':
     run_qt(lambda display: register_cave(display, omega=20))
@@ -0,0 +1,60 @@
+import asyncio
+import numpy as np
+
+from queue import Queue
+
+from flystim.aio import AsyncStimClient
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+
+
+class DirectClient(AsyncStimClient):
+    # sends each batch to a queue that the display task below works through, instead of to a stim server
+    def __init__(self, batches, **kwargs):
+        super().__init__(manager=None, **kwargs)
+        self.batches = batches
+
+    def send_batch(self, requests):
+        self.batches.put(requests)
+
+
+async def run_display(display, batches, stop):
+    # process the commands received before each frame, like StimDisplay.paintGL
+    frame = 0
+    while not stop.is_set():
+        while not batches.empty():
+            for name, args, kwargs in batches.get():
+                getattr(display, name)(*args, **kwargs)
+
+        display.paint(t=frame/120)
+        frame += 1
+        await asyncio.sleep(0.002)
+
+
+def test_frame_applied():
+    async def run():
+        display = HeadlessStimDisplay(screen=Screen(name='test'), width=32, height=32)
+        display.hide_corner_square()
+
+        batches = Queue()
+        stop = asyncio.Event()
+        display_task = asyncio.ensure_future(run_display(display, batches, stop))
+
+        client = DirectClient(batches)
+        await client.start()
+
+        # commands are pipelined, and the frame event arrives once they have been drawn
+        client.set_idle_background(1.0)
+        frame_times = await asyncio.wait_for(client.frame_applied(), timeout=5)
+        assert list(frame_times) == ['test']
+        assert np.all(display.read_frame() == 255)
+
+        client.set_idle_background(0.0)
+        await asyncio.wait_for(client.frame_applied(), timeout=5)
+        assert np.all(display.read_frame() == 0)
+
+        await client.close()
+        stop.set()
+        await display_task
+
+    asyncio.run(run())
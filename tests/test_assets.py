@@ -0,0 +1,43 @@
+import json
+import numpy as np
+
+from flystim.assets import AssetClient, content_key
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.wire import decode_args
+
+
+class DirectManager:
+    # passes calls to a display through JSON and the same wrappers as the RPC server
+    def __init__(self, display):
+        self.display = display
+
+    def __getattr__(self, name):
+        function = self.display.asset_cache.resolve_args(decode_args(getattr(self.display, name)))
+        return lambda *args, **kwargs: function(*json.loads(json.dumps(args)), **json.loads(json.dumps(kwargs)))
+
+
+def test_asset_cache():
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.hide_corner_square()
+    manager = DirectManager(display)
+
+    # budget for two of the three codes
+    rng = np.random.RandomState(0)
+    codes = [rng.randint(0, 2, size=(4, 4, 100)).astype(float) for _ in range(3)]
+    assets = AssetClient(manager, max_bytes=2*codes[0].nbytes)
+
+    assert content_key(codes[0]) == content_key(codes[0].copy())
+    assert content_key(codes[0]) != content_key(codes[1])
+
+    for k in [0, 1, 0, 2, 0, 1]:
+        manager.load_stim('ArbitraryGrid', stixel_size=10, num_theta=4, num_phi=4, t_dim=100,
+                          stimulus_code=assets.ref(codes[k]))
+        assert np.array_equal(display.stim_list[0][1].kwargs['stimulus_code'], codes[k])
+
+        # the mirror on the client matches the cache on the display
+        assert list(assets.mirror.entries) == list(display.asset_cache.entries)
+
+    # code 0 stays cached, code 1 is evicted by code 2 and uploaded again
+    assert assets.upload_count == 4
+    assert assets.hit_count == 2
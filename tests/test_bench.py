@@ -0,0 +1,15 @@
+import json
+
+from flystim.bench import run_bench, compare
+
+
+def test_bench_report():
+    report = run_bench(width=64, height=48, layers=2, n_frames=3, n_warmup=1, names=['SineGrating', 'GlCube'])
+
+    # the report has to be machine-readable
+    report = json.loads(json.dumps(report))
+    assert [result['name'] for result in report['results']] == ['SineGrating', 'GlCube']
+    assert report['results'][0]['composited']
+
+    # a report never regresses against itself
+    assert compare(report, report) == []
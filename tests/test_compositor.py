@@ -0,0 +1,55 @@
+import numpy as np
+
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.trajectory import RectangleTrajectory
+
+
+def render_layers(stims, composite, times=(0.0, 0.05, 0.1)):
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.set_composite_layers(composite)
+
+    for name, kwargs in stims:
+        display.load_stim(name, hold=True, **kwargs)
+    display.start_stim(t=0)
+
+    # check which path is taken, so that the comparison below is meaningful
+    stim_list = [stim for stim, _ in display.stim_list]
+    assert display.compositor.can_composite(stim_list)
+
+    frames = []
+    for t in times:
+        display.paint(t=t)
+        frames.append(display.read_frame())
+
+    display.release()
+
+    return frames
+
+
+def check_composite(stims):
+    fused = render_layers(stims, composite=True)
+    layered = render_layers(stims, composite=False)
+
+    for frame1, frame2 in zip(fused, layered):
+        assert np.array_equal(frame1, frame2)
+
+    return fused
+
+
+def test_alpha_layer():
+    grating = ('SineGrating', {'period': 20, 'rate': 40, 'color': 1.0, 'background': 0.0})
+    patch = RectangleTrajectory(x=[(0, -30), (0.1, 30)], y=90, w=20, h=20, color=0.37).to_dict()
+
+    for background in [None, 0.3]:
+        fused = check_composite([grating, ('MovingPatch', {'trajectory': patch, 'background': background,
+                                                           'vary': 'alpha'})])
+
+        # the patch should be visible on top of the grating
+        assert any(not np.array_equal(frame1, frame2)
+                   for frame1, frame2 in zip(fused, render_layers([grating, grating], composite=False)))
+
+
+def test_textured_layers():
+    check_composite([('RandomGrid', {'theta_period': 15, 'phi_period': 15, 'start_seed': 1, 'update_rate': 60.0}),
+                     ('Checkerboard', {'theta_period': 10, 'phi_period': 10})])
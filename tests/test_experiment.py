@@ -0,0 +1,75 @@
+import socket
+import h5py
+
+from time import monotonic
+
+from flystim.experiment import ExperimentRunner, LineReader
+from flystim.session import SessionWriter
+
+
+class Manager:
+    # records the calls made by the runner
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(name)
+
+
+def test_wait_and_sockets():
+    runner = ExperimentRunner()
+
+    # FicTrac-like lines split across datagrams
+    lines = []
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    runner.add_socket(receiver, LineReader(lines.append, prefix='FT').feed)
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for data in [b'FT, 1, 0.5\nFT, 2', b', 0.6\n', b'xFT, 3, 0.7\n']:
+        sender.sendto(data, receiver.getsockname())
+
+    # the upper bounds are loose, since loaded machines may wake up late
+    start = monotonic()
+    fired = []
+    runner.call_later(0.01, lambda: fired.append(monotonic()))
+
+    runner.wait(0.05)
+    end = monotonic()
+
+    assert lines == ['FT, 1, 0.5', 'FT, 2, 0.6', 'FT, 3, 0.7']
+    assert len(fired) == 1
+    assert start + 0.01 <= fired[0] <= end
+    assert 0.05 <= end - start < 0.5
+
+    runner.close()
+    sender.close()
+    receiver.close()
+
+
+def test_run_trials(tmp_path):
+    runner = ExperimentRunner()
+    manager = Manager()
+    session = SessionWriter(str(tmp_path / 'session.h5'))
+
+    started = []
+    saved = []
+    trials = runner.run_trials(2, stim_duration=0.02, iti=0.02, start_trial=started.append, manager=manager,
+                               save_history=True, save_prefix='test', session=session,
+                               history_saved=lambda t, prefix: saved.append(prefix))
+    session.close()
+
+    assert started == [0, 1]
+    assert len(trials) == 2
+    assert all(0.02 <= trial['end_time'] - trial['start_time'] < 0.2 for trial in trials)
+    assert trials[0]['end_time'] <= trials[1]['start_time']
+    assert manager.calls == 2*['start_saving_history', 'start_stim', 'stop_stim', 'stop_saving_history',
+                               'set_save_prefix', 'save_history']
+    assert saved == ['test_t000', 'test_t001']
+
+    with h5py.File(str(tmp_path / 'session.h5'), 'r') as f:
+        for k, trial in enumerate(trials):
+            assert f['trials/{:03}'.format(k)].attrs['start_time'] == trial['start_time']
+            assert f['trials/{:03}'.format(k)].attrs['end_time'] == trial['end_time']
+
+    runner.close()
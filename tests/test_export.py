@@ -0,0 +1,71 @@
+import json
+import zipfile
+import numpy as np
+
+from flystim.export import export_session
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.trajectory import RectangleTrajectory
+
+
+def check_export(tmp_path, stims, trajectories=None, save_format='txt'):
+    screen = Screen(name='test')
+
+    # run a short trial with history saving turned on, keeping the frames that were shown
+    display = HeadlessStimDisplay(screen=screen, width=64, height=48)
+    for trajectory_id, trajectory in (trajectories or {}).items():
+        display.upload_trajectory(trajectory_id, trajectory)
+    display.set_save_history_params(save_path=str(tmp_path), save_prefix='trial', save_duration=1,
+                                    save_format=save_format)
+    display.start_saving_history()
+    for stim in stims:
+        display.load_stim(stim['name'], hold=True, **stim['kwargs'])
+    display.set_global_theta_offset(15)
+    display.start_stim(t=0)
+
+    shown = []
+    for t in np.arange(10)/120:
+        display.paint(t=t)
+        shown.append(display.read_frame())
+
+    display.stop_saving_history()
+    display.save_history()
+    display.release()
+
+    # export the trial and compare with what was shown
+    session = {'screens': [screen.serialize()],
+               'trials': [{'stims': stims, 'save_path': str(tmp_path), 'save_prefix': 'trial'}]}
+    if trajectories is not None:
+        session['trajectories'] = trajectories
+    file_names = export_session(session, str(tmp_path / 'export'), width=64, height=48, verbose=False)
+
+    with zipfile.ZipFile(file_names[0]) as f:
+        info = json.loads(f.read('frames.json'))
+        assert len(info) == len(shown)
+
+        for k, frame in enumerate(shown):
+            with f.open('frame_{:07d}.npy'.format(k)) as g:
+                assert np.array_equal(np.load(g), frame)
+
+    return shown
+
+
+def test_export_matches_display(tmp_path):
+    check_export(tmp_path, [{'name': 'SineGrating',
+                             'kwargs': {'period': 20, 'rate': 40, 'color': 1.0, 'background': 0.0}}])
+
+
+def test_export_h5_history(tmp_path):
+    check_export(tmp_path, [{'name': 'SineGrating',
+                             'kwargs': {'period': 20, 'rate': 40, 'color': 1.0, 'background': 0.0}}],
+                 save_format='h5')
+
+    assert not list(tmp_path.glob('*.txt'))
+
+
+def test_export_with_uploaded_trajectories(tmp_path):
+    trajectory = RectangleTrajectory(x=[(0, -30), (0.1, 30)], y=90, w=20, h=20, color=1).to_dict()
+    shown = check_export(tmp_path, [{'name': 'MovingPatch', 'kwargs': {'trajectory': 'patch', 'background': 0.0}}],
+                         trajectories={'patch': trajectory})
+
+    assert any(frame.any() for frame in shown)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from flystim.fictrac import load_fictrac
+
+
+def write_log(file_name, n_rows, first_frame=1, partial=True):
+    rng = np.random.RandomState(0)
+    values = rng.rand(n_rows, 26)
+    values[:, 0] = first_frame + np.arange(n_rows)
+    values[:, 21] = 1.6e12 + 4*np.arange(n_rows)
+
+    with open(file_name, 'w') as f:
+        for row in values:
+            f.write(', '.join('{:d}'.format(int(v)) if k in (0, 22) else repr(float(v)) for k, v in enumerate(row)) + '\n')
+        if partial:
+            # FicTrac may still be writing the last line
+            f.write('{}, 0.1, 0.2'.format(first_frame + n_rows))
+
+    return values
+
+
+def test_load_fictrac(tmp_path):
+    file_name = str(tmp_path / 'fictrac.dat')
+    values = write_log(file_name, 1000, first_frame=5)
+
+    # small chunks, so that lines are split across several of them
+    log = load_fictrac(file_name, chunk_size=4096)
+
+    assert len(log) == 1000
+    assert np.array_equal(log['frame'], values[:, 0].astype(int))
+    assert np.allclose(log['heading'], values[:, 16])
+    assert np.allclose(log['timestamp'], values[:, 21])
+    assert np.allclose(log['sync_mean'], values[:, 25])
+
+    trial = log.between(100, 199)
+    assert trial['frame'][0] == 100
+    assert trial['frame'][-1] == 199
+
+    assert [len(rows) for rows in log.trials([0, 500], [9, 2000])] == [5, 505]
+
+
+def test_load_fields(tmp_path):
+    file_name = str(tmp_path / 'fictrac.dat')
+    values = write_log(file_name, 100, partial=False)
+
+    log = load_fictrac(file_name, fields=['heading', 'sync_mean'])
+
+    assert log.data.dtype.names == ('frame', 'heading', 'sync_mean')
+    assert np.allclose(log['sync_mean'], values[:, 25])
@@ -0,0 +1,107 @@
+import json
+import zipfile
+import threading
+import numpy as np
+
+from flystim.capture import FrameCapture
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+
+
+def test_idle_background():
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.set_idle_background(0.25)
+    display.hide_corner_square()
+
+    display.paint(t=0)
+    frame = display.read_frame()
+
+    assert frame.shape == (48, 64, 3)
+    assert np.all(np.abs(frame.astype(int) - 64) <= 1)
+
+
+def test_render_at_explicit_times():
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.hide_corner_square()
+
+    display.load_stim('SineGrating', period=20, rate=40, color=1.0, background=0.0)
+    display.start_stim(t=0)
+
+    # frames drawn at the same time are identical, and the grating moves between different times
+    display.paint(t=0.1)
+    frame1 = display.read_frame()
+    display.paint(t=0.1)
+    frame2 = display.read_frame()
+    display.paint(t=0.2)
+    frame3 = display.read_frame()
+
+    assert np.array_equal(frame1, frame2)
+    assert not np.array_equal(frame1, frame3)
+    assert frame1.max() > 200
+
+
+def test_capture(tmp_path):
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.load_stim('SineGrating', period=20, rate=40, color=1.0, background=0.0)
+    display.start_stim(t=0)
+
+    # frames are read back a few frames late, so compare after the capture is finished
+    display.start_capture(str(tmp_path / 'capture.zip'))
+
+    shown = []
+    for t in np.arange(5)/120:
+        display.paint(t=t)
+        shown.append(display.read_frame())
+
+    display.stop_capture()
+
+    with zipfile.ZipFile(str(tmp_path / 'capture.zip')) as f:
+        info = json.loads(f.read('frames.json'))
+        assert [frame['time'] for frame in info] == list(np.arange(5)/120)
+
+        for k, frame in enumerate(shown):
+            with f.open('frame_{:07d}.npy'.format(k)) as g:
+                assert np.array_equal(np.load(g), frame)
+
+
+def check_slow_writer(block):
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.load_stim('SineGrating', period=20, rate=40, color=1.0, background=0.0)
+    display.start_stim(t=0)
+
+    # the writer thread waits until every frame has been captured, so that the queue fills up
+    written = []
+    done = threading.Event()
+
+    def write(frame, info):
+        done.wait(timeout=10)
+        written.append(info['frame'])
+
+    capture = FrameCapture(display.ctx, size=display.size, callback=write, n_buffers=2, max_queue=1, block=block)
+    if block:
+        threading.Timer(0.1, done.set).start()
+
+    for k in range(10):
+        display.paint(t=k/120)
+        capture.capture(fbo=display.fbo, info={'frame': k})
+
+    done.set()
+    capture.close()
+    display.release()
+
+    return capture, written
+
+
+def test_capture_drops_frames():
+    # during an experiment, frames are dropped rather than stalling the display
+    capture, written = check_slow_writer(block=False)
+    assert capture.dropped_count > 0
+    assert len(written) + capture.dropped_count == capture.frame_count == 10
+    assert written == sorted(written)
+    assert written[-1] == 9
+
+
+def test_capture_blocks():
+    capture, written = check_slow_writer(block=True)
+    assert capture.dropped_count == 0
+    assert written == list(range(10))
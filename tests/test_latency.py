@@ -0,0 +1,69 @@
+import numpy as np
+
+from flystim.latency import latency_report, xcorr_lag, OnlineLatencyEstimator
+from flystim.util import calculate_lag
+
+
+def make_traces(duration=60, lag=0.0235, seed=0):
+    # sync square toggling at random times, drawn at 120 Hz and seen by a 500 Hz camera after a delay
+    rng = np.random.RandomState(seed)
+    fs_timestamps = 1 + np.arange(0, duration, 1/120)
+    fs_sync = np.cumsum(rng.rand(len(fs_timestamps)) < 0.2) % 2
+
+    ft_timestamps = 1 + np.arange(0, duration, 1/500)
+    ft_sync = np.interp(ft_timestamps - lag, fs_timestamps, fs_sync) + 0.05*rng.randn(len(ft_timestamps))
+
+    return fs_timestamps, fs_sync, ft_timestamps, ft_sync
+
+
+def test_xcorr_lag():
+    rng = np.random.RandomState(1)
+    x = rng.rand(1000)
+    y = np.roll(x, 7)
+
+    # the FFT method matches np.correlate
+    assert calculate_lag(x, y) == np.argmax(np.correlate(y, x, mode='full')) - len(x) + 1 == 7
+    assert abs(xcorr_lag(x, y) - 7) < 0.5
+
+
+def test_latency_report():
+    fs_timestamps, fs_sync, ft_timestamps, ft_sync = make_traces()
+    report = latency_report(fs_timestamps, fs_sync, ft_timestamps, ft_sync, window_size=5, verbose=False)
+
+    assert abs(report.global_lag - 0.0235) < 1e-3
+    assert len(report.local_lags) == 32
+    assert np.all(np.abs(report.local_lags - 0.0235) < 2e-3)
+    assert abs(report.fictrac_stats['mean_fps'] - 500) < 1
+
+
+def test_online_estimator():
+    fs_timestamps, fs_sync, ft_timestamps, ft_sync = make_traces(duration=20)
+    estimator = OnlineLatencyEstimator(window_size=5)
+
+    # feed one second of data at a time
+    for t in range(20):
+        fs = (fs_timestamps >= 1 + t) & (fs_timestamps < 2 + t)
+        ft = (ft_timestamps >= 1 + t) & (ft_timestamps < 2 + t)
+        estimator.add_flystim(fs_timestamps[fs], fs_sync[fs])
+        estimator.add_fictrac(ft_timestamps[ft], ft_sync[ft])
+        estimator.update()
+
+    assert len(estimator.lags) >= 14
+    assert all(abs(lag - 0.0235) < 2e-3 for _, lag in estimator.lags)
+
+
+def test_online_estimator_empty_chunks():
+    fs_timestamps, fs_sync, ft_timestamps, ft_sync = make_traces(duration=20)
+    estimator = OnlineLatencyEstimator(window_size=5)
+
+    # polls that return no samples are normal, both before and after data arrives
+    estimator.add_fictrac([], [])
+    assert estimator.update() is None
+
+    estimator.add_flystim(fs_timestamps, fs_sync)
+    estimator.add_fictrac(ft_timestamps, ft_sync)
+    estimator.add_fictrac([], [])
+    estimator.add_flystim([], [])
+
+    lag = estimator.update()
+    assert lag is not None and abs(lag - 0.0235) < 2e-3
@@ -0,0 +1,17 @@
+import numpy as np
+
+from flystim.rpc_bench import frame_latencies, decode_theta, sample_value
+
+
+def test_frame_latencies():
+    # five samples sent every 2 ms, and frames every 8 ms using the latest sample received
+    sent_times = 0.002*np.arange(5)
+    frame_times = np.array([0.001, 0.009, 0.017])
+    frame_samples = decode_theta(np.radians([sample_value(0), sample_value(3), sample_value(3)]))
+
+    latencies, rendered = frame_latencies(sent_times, frame_times, frame_samples)
+
+    # samples 1 and 2 were superseded by sample 3, and sample 4 was never shown
+    assert np.allclose(latencies[:4], [0.001, 0.007, 0.005, 0.003])
+    assert np.isnan(latencies[4])
+    assert list(rendered) == [True, False, False, True, False]
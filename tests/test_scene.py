@@ -0,0 +1,73 @@
+from math import radians
+
+import numpy as np
+
+from flystim import GenPerspective, GlCube, GlCylinder, GlVertices, CaveSystem, model_rotz, model_translate
+from common import run_headless
+
+
+def get_perspective():
+    return GenPerspective(pa=(+1, -1, -1), pb=(+1, +1, -1), pc=(+1, -1, 1), pe=(+5, 0, 0))
+
+
+def render_cave(draw):
+    def register_cave(display):
+        cave = CaveSystem()
+        cave.add_subscreen((0, 0, 512, 512), get_perspective())
+        display.render_objs.append(cave)
+        display.render_actions.append(lambda: draw(cave))
+
+    return np.array(run_headless(register_cave), dtype=int)
+
+
+def test_scene_matches_immediate_rendering():
+    # a retained mesh placed with a model matrix should look the same as the transformed shape drawn directly
+    cube = GlCube()
+    node = [None]
+
+    def draw_scene(cave):
+        if node[0] is None:
+            node[0] = cave.scene.add(cube)
+        node[0].model = model_translate((0, 0.5, 0)).dot(model_rotz(radians(30)))
+        cave.render_scene()
+
+    obs = render_cave(draw_scene)
+    ref = render_cave(lambda cave: cave.render(cube.rotz(radians(30)).translate((0, 0.5, 0))))
+
+    assert obs.sum() > 0
+    assert np.abs(obs - ref).max() <= 1
+
+
+def test_scene_uploads_shared_mesh_once():
+    tree = GlCylinder(cylinder_height=1, cylinder_radius=0.25, n_faces=16)
+    caves = []
+
+    def draw_scene(cave):
+        group = cave.scene.add(model=model_translate((-1, 0, 0)))
+        for y in (-1, 0, 1):
+            group.add(tree, model=model_translate((0, y, 0)))
+        cave.render_scene()
+        caves.append(cave)
+
+    obs = render_cave(draw_scene)
+
+    assert obs.sum() > 0
+    assert len(caves[0].meshes) == 1
+    assert len(caves[0].scene.draw_list()) == 3
+    assert np.allclose(caves[0].scene.draw_list()[2][1][:3, 3], (-1, 1, 0))
+
+
+def test_add_matches_concatenation():
+    parts = [GlCube().translate((k, 0, 0)) for k in range(5)]
+
+    mesh = GlVertices()
+    for part in parts:
+        mesh.add(part)
+
+    assert np.array_equal(mesh.vertices, np.concatenate([part.vertices for part in parts], axis=1))
+    assert np.array_equal(mesh.colors, np.concatenate([part.colors for part in parts], axis=1))
+    assert mesh.tex_coords is None
+
+    # objects added after the arrays were built are appended to them
+    mesh.add(parts[0])
+    assert mesh.vertices.shape == (3, 6*36)
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+
+from flystim.screen import Screen, ScreenMesh
+
+
+def test_default_mesh():
+    screen = Screen(width=2, height=1, offset=(0, 1, 0))
+
+    # the default screen is a quad made of two triangles
+    tri_array = screen.get_tri_array()
+    assert tri_array.shape == (2, 3, 5)
+
+    # the legacy triangle list view matches the array
+    tri = screen.tri_list[0]
+    assert np.allclose(tri.pa.ndc + tri.pa.cart, tri_array[0, 0])
+
+
+def test_serialize_round_trip():
+    ndc_x, ndc_y = np.meshgrid(np.linspace(-1, 1, 65), np.linspace(-1, 1, 33))
+    ndc = np.stack((ndc_x, ndc_y), axis=-1)
+    cart = np.stack((ndc_x, np.ones_like(ndc_x), 0.5*ndc_y), axis=-1)
+    mesh = ScreenMesh.from_grid(ndc, cart)
+    assert len(mesh) == 2*64*32
+
+    screen = Screen(tri_list=mesh, name='warped')
+
+    # the serialized screen has to survive being sent as JSON
+    data = json.loads(json.dumps(screen.serialize()))
+    copy = Screen.deserialize(data)
+
+    assert copy.name == 'warped'
+    assert np.array_equal(copy.get_tri_array(), screen.get_tri_array())
+
+
+def test_legacy_tri_list():
+    tri_list = Screen.quad_to_tri_list(((-1, -1), (-1, 1, -1)), ((+1, -1), (1, 1, -1)),
+                                       ((+1, +1), (1, 1, +1)), ((-1, +1), (-1, 1, +1)))
+    data = Screen(tri_list=tri_list).serialize()
+
+    # screens serialized with the old nested-list format can still be loaded
+    data['tri_list'] = [tri.serialize() for tri in tri_list]
+    del data['mesh']
+
+    screen = Screen.deserialize(data)
+    assert np.array_equal(screen.get_vertex_data()[:, 0:2], [[-1, -1], [+1, -1], [-1, +1],
+                                                             [+1, -1], [+1, +1], [-1, +1]])
+
+
+def test_warp_map():
+    # flat screen in front of the fly, described by a coarse calibration grid
+    x, z = np.meshgrid(np.linspace(-0.1, 0.1, 5), np.linspace(-0.05, 0.05, 4))
+    warp = np.stack((x, 0.3*np.ones_like(x), z), axis=-1)
+
+    screen = Screen.deserialize(json.loads(json.dumps(Screen(warp=warp).serialize())))
+    assert np.allclose(screen.warp, warp)
+
+    # without a triangle list the screen is one full-screen quad spanning the corners of the map
+    tri_array = screen.get_tri_array()
+    assert tri_array.shape == (2, 3, 5)
+    assert np.allclose(tri_array[0, 0], [-1, -1, -0.1, 0.3, -0.05])
+    assert np.allclose(tri_array[1, 1], [+1, +1, +0.1, 0.3, +0.05])
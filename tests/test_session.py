@@ -0,0 +1,82 @@
+import time
+import numpy as np
+import h5py
+
+from flystim.session import SessionWriter
+
+
+def test_session(tmp_path):
+    history_file = str(tmp_path / 'screen_history.h5')
+    session_file = str(tmp_path / 'session.h5')
+
+    # display side: complete history of one trial
+    history = SessionWriter(history_file)
+    history.start_trial(name='trial_000')
+    history.write('fs_square', np.array([0, 1, 1, 0]))
+    history.write('fs_timestamps', np.arange(4)/120)
+    history.write('fs_stim_timestamps', np.arange(4)/120)
+    history.write('fs_theta', np.zeros(4))
+    history.close()
+
+    # client side: samples appended as they arrive, across several flushes
+    session = SessionWriter(session_file, attrs={'rig': 'test'}, chunk_size=4)
+    session.append('ft_frame', 0)
+    session.start_trial(start_time=1.0)
+    for k in range(10):
+        session.append('ft_frame', np.arange(3*k, 3*k+3))
+        session.append('ft_pos', np.full((3, 2), k))
+        if k % 4 == 0:
+            session.flush()
+    session.link_history(str(tmp_path), 'screen', 'trial_000')
+    session.end_trial(end_time=2.0)
+    session.close()
+
+    with h5py.File(session_file, 'r') as f:
+        assert f.attrs['rig'] == 'test'
+        assert f['pre_trial/ft_frame'][:].tolist() == [0]
+
+        trial = f['trials/000']
+        assert trial.attrs['start_time'] == 1.0
+        assert trial.attrs['end_time'] == 2.0
+        assert np.array_equal(trial['ft_frame'][:], np.arange(30))
+        assert trial['ft_pos'].shape == (30, 2)
+        assert trial['fs_square'][:].tolist() == [0, 1, 1, 0]
+
+
+def test_reopened_file_is_readable(tmp_path):
+    file_name = str(tmp_path / 'screen_history.h5')
+
+    # with keep_open=False, the file can be read in between batches, e.g. by analysis code during the session
+    writer = SessionWriter(file_name, keep_open=False)
+    writer.start_trial(name='trial_000')
+    writer.write('fs_square', np.array([0, 1]))
+    writer.flush()
+
+    with h5py.File(file_name, 'r') as f:
+        assert f['trials/trial_000/fs_square'][:].tolist() == [0, 1]
+
+    writer.close()
+
+
+def test_locked_file_is_written_later(tmp_path):
+    file_name = str(tmp_path / 'screen_history.h5')
+
+    writer = SessionWriter(file_name, keep_open=False, retry_interval=0.01)
+    writer.start_trial(name='a')
+    writer.write('fs_square', np.array([0]))
+    writer.flush()
+
+    # a trial saved while the file is being read is kept until the reader is done
+    with h5py.File(file_name, 'r') as f:
+        writer.start_trial(name='b')
+        writer.write('fs_square', np.array([1]))
+        time.sleep(0.1)
+        assert list(f['trials']) == ['a']
+
+    writer.start_trial(name='c')
+    writer.write('fs_square', np.array([2]))
+    writer.close()
+
+    with h5py.File(file_name, 'r') as f:
+        assert list(f['trials']) == ['a', 'b', 'c']
+        assert [f['trials'][name]['fs_square'][0] for name in 'abc'] == [0, 1, 2]
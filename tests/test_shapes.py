@@ -0,0 +1,102 @@
+from math import radians
+
+import numpy as np
+
+from flystim import GlTri, GlQuad, GlVertices, GlSphericalRect, GlSphericalCirc, GlCylinder
+
+
+# reference implementations that build the shapes one triangle at a time
+
+def spherical(r, theta, phi):
+    return (r * np.sin(phi) * np.cos(theta), r * np.sin(phi) * np.sin(theta), r * np.cos(phi))
+
+
+def ref_spherical_rect(width, height, sphere_radius, color, n_steps_x, n_steps_y):
+    obj = GlVertices()
+    d_theta = (1/n_steps_x) * radians(width)
+    d_phi = (1/n_steps_y) * radians(height)
+    for rr in range(n_steps_y):
+        for cc in range(n_steps_x):
+            theta = radians(width) * (-1/2 + (cc/n_steps_x))
+            phi = np.pi/2 + radians(height) * (-1/2 + (rr/n_steps_y))
+            v1 = spherical(sphere_radius, theta, phi)
+            v2 = spherical(sphere_radius, theta, phi + d_phi)
+            v3 = spherical(sphere_radius, theta + d_theta, phi)
+            v4 = spherical(sphere_radius, theta + d_theta, phi + d_phi)
+            obj.add(GlTri(v1, v2, v4, color))
+            obj.add(GlTri(v1, v3, v4, color))
+    return obj
+
+
+def ref_spherical_circ(circle_radius, sphere_radius, color, n_steps):
+    obj = GlVertices()
+    v_center = spherical(sphere_radius, 0, np.pi/2)
+    angles = np.linspace(0, 2*np.pi, n_steps+1)
+    for wedge in range(n_steps):
+        v1 = spherical(sphere_radius, radians(circle_radius)*np.cos(angles[wedge]),
+                       np.pi/2 + radians(circle_radius)*np.sin(angles[wedge]))
+        v2 = spherical(sphere_radius, radians(circle_radius)*np.cos(angles[wedge+1]),
+                       np.pi/2 + radians(circle_radius)*np.sin(angles[wedge+1]))
+        obj.add(GlTri(v1, v2, v_center, color))
+    return obj
+
+
+def ref_cylinder(cylinder_height, cylinder_radius, cylinder_location, color, n_faces, texture):
+    obj = GlVertices()
+    d_theta = 2*np.pi / n_faces
+    for face in range(n_faces):
+        v1 = (cylinder_radius*np.cos(face*d_theta), cylinder_radius*np.sin(face*d_theta), cylinder_height/2)
+        v2 = (cylinder_radius*np.cos(face*d_theta), cylinder_radius*np.sin(face*d_theta), -cylinder_height/2)
+        v3 = (cylinder_radius*np.cos((face+1)*d_theta), cylinder_radius*np.sin((face+1)*d_theta), -cylinder_height/2)
+        v4 = (cylinder_radius*np.cos((face+1)*d_theta), cylinder_radius*np.sin((face+1)*d_theta), cylinder_height/2)
+        if texture:
+            quad = GlQuad(v1, v2, v3, v4, color, tc1=(face/n_faces, 1), tc2=(face/n_faces, 0),
+                          tc3=((face+1)/n_faces, 0), tc4=((face+1)/n_faces, 1))
+        else:
+            quad = GlQuad(v1, v2, v3, v4, color)
+        obj.add(quad.translate(cylinder_location))
+    return obj
+
+
+def assert_same(obj, ref):
+    assert obj.vertices.shape == ref.vertices.shape
+    assert np.allclose(obj.vertices, ref.vertices)
+    assert np.allclose(obj.colors, ref.colors)
+    if ref.tex_coords is None:
+        assert obj.tex_coords is None
+    else:
+        assert np.allclose(obj.tex_coords, ref.tex_coords)
+    assert np.allclose(obj.data, ref.data)
+
+
+def test_spherical_rect():
+    assert_same(GlSphericalRect(), ref_spherical_rect(20, 20, 1, (1, 1, 1, 1), 6, 6))
+    assert_same(GlSphericalRect(width=10, height=30, sphere_radius=2, color=0.5, n_steps_x=3, n_steps_y=7),
+                ref_spherical_rect(10, 30, 2, [0.5, 0.5, 0.5, 1], 3, 7))
+
+
+def test_spherical_circ():
+    assert_same(GlSphericalCirc(), ref_spherical_circ(10, 1, (1, 1, 1, 1), 36))
+    assert_same(GlSphericalCirc(circle_radius=25, sphere_radius=3, color=(1, 0, 0, 1), n_steps=7),
+                ref_spherical_circ(25, 3, (1, 0, 0, 1), 7))
+
+
+def test_cylinder():
+    assert_same(GlCylinder(), ref_cylinder(10, 1, (0, 0, 0), (1, 1, 1, 1), 64, False))
+    assert_same(GlCylinder(cylinder_height=1, cylinder_radius=0.25, cylinder_location=(1, -2, 0.5), color=0.2,
+                           n_faces=9, texture=True),
+                ref_cylinder(1, 0.25, (1, -2, 0.5), [0.2, 0.2, 0.2, 1], 9, True))
+
+
+def test_cached_shapes_are_independent():
+    # shapes with the same parameters share cached arrays, which transforms must not modify
+    a = GlSphericalCirc()
+    vertices = a.vertices.copy()
+    a.rotz(1.0).translate((1, 2, 3))
+    assert np.array_equal(GlSphericalCirc().vertices, vertices)
+
+
+def test_fine_mesh():
+    obj = GlSphericalRect(n_steps_x=300, n_steps_y=300, sphere_radius=1.5)
+    assert obj.vertices.shape == (3, 6*300*300)
+    assert np.allclose(np.linalg.norm(obj.vertices, axis=0), 1.5)
@@ -0,0 +1,97 @@
+import threading
+import time
+import pytest
+
+# multiprocessing.shared_memory requires Python 3.8+
+pytest.importorskip('multiprocessing.shared_memory')
+
+from multiprocessing import resource_tracker
+from flystim.shm import SharedPose
+
+
+def attach(writer):
+    reader = SharedPose(name=writer.name)
+
+    # readers unregister the block from the resource tracker, which is shared with the writer in this process
+    resource_tracker.register(writer.shm._name, 'shared_memory')
+
+    return reader
+
+
+class TornData:
+    # stands in for the pose of a reader, and lets the writer update the pose in the middle of the first copy
+    def __init__(self, data, write):
+        self.data = data
+        self.write = write
+
+    def copy(self):
+        pose = self.data.copy()
+        if self.write is not None:
+            write, self.write = self.write, None
+            write()
+        return pose
+
+
+def test_round_trip():
+    writer = SharedPose(create=True)
+    reader = attach(writer)
+
+    try:
+        # nothing has been written yet
+        assert reader.read() is None
+
+        writer.write(theta_offset=10.0, phi_offset=-5.0, fly_pos=(0.1, 0.2, 0.3), t=1.5)
+        assert reader.read() == {'seq': 1, 'theta_offset': 10.0, 'phi_offset': -5.0, 'fly_pos': [0.1, 0.2, 0.3],
+                                 't': 1.5}
+
+        # the same pose is only returned once
+        assert reader.read() is None
+
+        # only the latest of several poses is returned
+        writer.write(theta_offset=20.0, t=2.0)
+        writer.write(theta_offset=30.0, t=3.0)
+        pose = reader.read()
+        assert pose['seq'] == 3
+        assert pose['theta_offset'] == 30.0
+        assert pose['t'] == 3.0
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_torn_read_is_retried():
+    writer = SharedPose(create=True)
+    reader = attach(writer)
+
+    try:
+        writer.write(theta_offset=1.0, t=1.0)
+
+        # the pose changes while it is being copied, so the copy is discarded and the new pose is read instead
+        reader.data = TornData(reader.data, lambda: writer.write(theta_offset=2.0, t=2.0))
+        pose = reader.read()
+        reader.data = reader.data.data
+        assert pose['seq'] == 2
+        assert pose['theta_offset'] == 2.0
+        assert pose['t'] == 2.0
+
+        # a reader that finds a write in progress waits until the write is finished
+        seq = int(writer.seq)
+        writer.seq[...] = seq + 1
+        writer.data['theta_offset'] = 3.0
+
+        poses = []
+        thread = threading.Thread(target=lambda: poses.append(reader.read()))
+        thread.start()
+        time.sleep(0.05)
+        assert thread.is_alive()
+
+        writer.data['t'] = 3.0
+        writer.seq[...] = seq + 2
+        thread.join(timeout=10)
+
+        assert poses[0]['seq'] == 3
+        assert poses[0]['theta_offset'] == 3.0
+        assert poses[0]['t'] == 3.0
+    finally:
+        reader.close()
+        writer.close()
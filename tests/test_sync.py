@@ -0,0 +1,74 @@
+import numpy as np
+
+from flystim.screen import Screen
+from flystim.square import SquareProgram
+from flystim.sync import SyncDecoder, MSequenceDecoder, run_lengths
+
+
+def simulate(n_frames=5000, dropped=(1000, 3000), seed=0):
+    rng = np.random.RandomState(seed)
+
+    # square toggled after random dwell times of 1 to 6 frames, as recorded by flystim
+    lengths = rng.randint(1, 7, size=n_frames)
+    square = (np.repeat(np.arange(len(lengths)), lengths) % 2)[:n_frames]
+
+    # time at which each frame appeared on a 120 Hz screen, with a frame held twice as long at each dropped frame
+    period = 1/120
+    durations = np.full(n_frames, period)
+    durations[list(dropped)] *= 2
+    appeared = 10 + np.concatenate(([0], np.cumsum(durations)[:-1]))
+
+    # 500 Hz camera watching the screen
+    camera_times = np.arange(appeared[0], appeared[-1], 1/500)
+    shown = np.searchsorted(appeared, camera_times, side='right') - 1
+    camera_sync = 0.2 + 0.6*square[shown] + 0.05*rng.randn(len(camera_times))
+
+    return square, appeared, camera_times, camera_sync
+
+
+def test_run_lengths():
+    starts, lengths, values = run_lengths([0, 0, 1, 1, 1, 0])
+    assert list(starts) == [0, 2, 5]
+    assert list(lengths) == [2, 3, 1]
+    assert list(values) == [0, 1, 0]
+
+
+def test_decode():
+    square, appeared, camera_times, camera_sync = simulate()
+
+    alignment = SyncDecoder(square).decode(camera_times, camera_sync, frame_period=1/120)
+
+    # frames are placed to within a camera sample, except those whose run contains a dropped frame
+    matched = ~np.isnan(alignment.frame_times)
+    assert alignment.matched_fraction > 0.95
+    assert np.median(np.abs(alignment.frame_times[matched] - appeared[matched])) < 1/500
+
+    # both dropped frames are found
+    assert all(np.any(np.abs(alignment.dropped_frames - frame) <= 6) for frame in [1000, 3000])
+    assert alignment.n_dropped == 2
+
+
+def test_mseq_square():
+    # square driven by the frame counter, with each bit shown for two frames
+    square_program = SquareProgram(Screen())
+    square_program.set_mode('mseq', n_bits=10, frames_per_bit=2)
+
+    square = []
+    for _ in range(3000):
+        square.append(square_program.color)
+        square_program.advance_frame()
+    square = np.array(square)
+
+    # 500 Hz camera watching a 120 Hz screen, starting at frame 500
+    camera_times = np.arange(500/120, 3000/120, 1/500)
+    camera_sync = 0.2 + 0.6*square[(120*camera_times + 1e-9).astype(int)]
+
+    bit_times, positions = MSequenceDecoder(n_bits=10).decode_trace(camera_times, camera_sync, bit_period=2/120)
+
+    # each bit decodes to the frame at which it appeared, modulo the period of the sequence
+    valid = positions >= 0
+    assert np.mean(valid) > 0.99
+
+    error = (bit_times[valid]*120/2 - positions[valid]) % 1023
+    error = np.minimum(error, 1023 - error)
+    assert np.all(error < (120/2)/500 + 1e-9)
@@ -0,0 +1,43 @@
+import json
+import numpy as np
+
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.trajectory import RectangleTrajectory, Trajectory
+from flystim.trials import TrialStructure
+
+
+def test_trajectory_bank():
+    # bar sweeping across the default screen, and an occluder shared by both conditions
+    sweep = Trajectory([(t, -30 + 60*t) for t in np.linspace(0, 1, 200)])
+    bar = RectangleTrajectory(x=sweep, y=90, w=10, h=180, color=1.0)
+    occluder = RectangleTrajectory(x=20, y=90, w=10, h=180, color=0.0)
+
+    trials = TrialStructure({'bar': [('MovingPatch', {'trajectory': bar, 'background': 0.0}),
+                                     ('MovingPatch', {'trajectory': occluder, 'background': None, 'hold': True})],
+                             'occluder': [('MovingPatch', {'trajectory': occluder, 'background': 0.0})]})
+    assert len(trials.trajectories) == 2
+
+    # each trial only sends trajectory names
+    payload = [kwargs for name, kwargs in trials.conditions['bar']]
+    assert len(json.dumps(payload)) < len(json.dumps(bar.to_dict()))/10
+
+    sequence = trials.sequence(n_repeats=3, seed=0)
+    assert sorted(sequence) == 3*['bar'] + 3*['occluder']
+
+    # displays draw the same frame from the uploaded trajectory as from the full one
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.hide_corner_square()
+    trials.upload(display)
+
+    frames = []
+    for load in [lambda: trials.load(display, 'bar'),
+                 lambda: (display.load_stim('MovingPatch', trajectory=bar.to_dict(), background=0.0),
+                          display.load_stim('MovingPatch', trajectory=occluder.to_dict(), background=None, hold=True))]:
+        load()
+        display.start_stim(t=0)
+        display.paint(t=0.25)
+        frames.append(display.read_frame())
+
+    assert frames[0].max() > 200
+    assert np.array_equal(frames[0], frames[1])
@@ -0,0 +1,40 @@
+import json
+import numpy as np
+
+from flystim.headless import HeadlessStimDisplay
+from flystim.screen import Screen
+from flystim.trajectory import RectangleTrajectory, Trajectory
+from flystim.wire import encode, decode, decode_args
+
+
+def test_round_trip():
+    code = np.random.RandomState(0).rand(4, 5, 6)
+    payload = {'stimulus_code': code, 'points': [(0, np.arange(3, dtype='i2'))], 'background': np.float32(0.5)}
+
+    decoded = decode(json.loads(json.dumps(encode(payload))))
+
+    assert np.array_equal(decoded['stimulus_code'], code)
+    assert decoded['points'][0][1].dtype == np.int16
+    assert decoded['background'] == 0.5
+
+    # arrays are views of the decoded bytes
+    assert not decoded['stimulus_code'].flags.owndata
+
+
+def test_rpc_arguments():
+    display = HeadlessStimDisplay(screen=Screen(), width=64, height=48)
+    display.hide_corner_square()
+    load_stim = decode_args(display.load_stim)
+
+    # a trajectory given as an array draws the same frame as one given as a list of pairs
+    tv_pairs = np.array([(0, -30), (1, 30)], dtype=float)
+    frames = []
+    for x in [Trajectory(tv_pairs), Trajectory([(0, -30), (1, 30)])]:
+        trajectory = RectangleTrajectory(x=x, y=90, w=10, h=180, color=1.0).to_dict()
+        load_stim('MovingPatch', trajectory=json.loads(json.dumps(encode(trajectory))), background=0.0)
+        display.start_stim(t=0)
+        display.paint(t=0.5)
+        frames.append(display.read_frame())
+
+    assert frames[0].max() > 200
+    assert np.array_equal(frames[0], frames[1])